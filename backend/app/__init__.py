@@ -59,6 +59,7 @@ def register_namespaces(api_instance: Api):  # 接收 Api 实例作为参数
     # 导入 Namespaces
     from app.routes.admin_routes import admin_ns
     from app.routes.category_routes import category_ns
+    from app.routes.chart_routes import chart_ns
     from app.routes.chat_routes import chat_ns
     from app.routes.dish_routes import dish_ns
     from app.routes.health import api as health_ns
@@ -83,16 +84,20 @@ def register_namespaces(api_instance: Api):  # 接收 Api 实例作为参数
     api_instance.add_namespace(auth_ns, path='/auth')
     api_instance.add_namespace(staff_ns, path='/staff')
     api_instance.add_namespace(tag_ns, path='/tags')
+    api_instance.add_namespace(chart_ns, path='/charts')
     logger.info("所有 API 命名空间注册完成。")
 
 
-def create_app(config_name: Optional[str] = None) -> Flask:
+def create_app(config_name: Optional[str] = None, start_background: bool = True) -> Flask:
     """
     应用工厂函数。
 
     Args:
         config_name: 要使用的配置名称 (例如 'development', 'production', 'testing')。
                      如果为 None，会尝试从 FLASK_CONFIG 环境变量获取，否则默认为 'default'。
+        start_background: 是否启动后台线程（预热、销量写回、副本心跳、事件分发、订单超时清理）
+                          并注册事件订阅者。命令行维护脚本 (python -m app.services.xxx) 传 False，
+                          避免重建 / 归档等任务与本进程内的后台线程相互竞争。
 
     Returns:
         配置好的 Flask 应用实例。
@@ -127,6 +132,49 @@ def create_app(config_name: Optional[str] = None) -> Flask:
     register_error_handlers(app)
     logger.info("全局错误处理器注册完成。")
 
+    # --- 命令行维护脚本不启动后台线程 ---
+    if not start_background:
+        from app.utils.warmup import mark_ready
+        mark_ready()
+        logger.info("Flask 应用实例创建完成（未启动后台线程）。")
+        return app
+
+    # --- 启动预热（可选）：后台线程预热连接池与推荐缓存，完成后 /health/ready 返回就绪 ---
+    from app.utils.warmup import mark_ready, start_warmup
+    if app.config.get('WARMUP_ENABLED'):
+        start_warmup(app)
+    else:
+        mark_ready()
+
+    # --- 菜品销量写回线程：订阅订单事件，批量更新 dish.sales（需在分发线程启动前订阅）---
+    if app.config.get('SALES_COUNTER_ENABLED'):
+        from app.services.sales_counter_service import sales_counter_flusher
+        sales_counter_flusher.start(app)
+
+    # --- 只读副本心跳线程：主库定期写入心跳，用于判断副本延迟是否可以承接只读查询 ---
+    if app.config.get('SQLALCHEMY_BINDS'):
+        from app.utils.replica import replica_heartbeat_writer
+        replica_heartbeat_writer.start(app)
+
+    # --- 用户订单汇总：订阅订单事件增量维护 user_order_summary（需在分发线程启动前订阅）---
+    # 汇总行只能由分发线程维护；未启动分发线程时不订阅，汇总改为读取时实时计算
+    if app.config.get('USER_SUMMARY_ENABLED'):
+        if app.config.get('ORDER_EVENT_DISPATCH_ENABLED'):
+            from app.services import user_summary_service
+            user_summary_service.register()
+        else:
+            logger.warning("USER_SUMMARY_ENABLED 需要 ORDER_EVENT_DISPATCH_ENABLED，用户订单汇总将实时计算。")
+
+    # --- 订单事件分发线程：将发件箱中的事件投递给订阅者和消息代理 ---
+    if app.config.get('ORDER_EVENT_DISPATCH_ENABLED'):
+        from app.services.order_event_service import order_event_dispatcher
+        order_event_dispatcher.start(app)
+
+    # --- 超时未支付订单清理线程：取消超过 TTL 的 PENDING 订单并恢复库存 ---
+    if app.config.get('ORDER_EXPIRY_ENABLED'):
+        from app.services.order_expiry_service import order_expiry_sweeper
+        order_expiry_sweeper.start(app)
+
     # 可以在这里添加其他应用级别的设置或钩子
 
     logger.info("Flask 应用实例创建完成。")
@@ -127,6 +127,14 @@ class Config:
         SQLALCHEMY_DATABASE_URI = None
         logger.error("数据库连接信息不完整，SQLALCHEMY_DATABASE_URI 未能构建！")
 
+    # 只读副本：逗号分隔的 SQLAlchemy URL，依次注册为 replica_0、replica_1 ... 绑定；
+    # @read_only 标记的服务函数中的查询路由到延迟不超过 DB_REPLICA_MAX_LAG_SECONDS 的副本，否则读主库
+    DB_REPLICA_URLS = [url.strip() for url in (_get_env_var('DB_REPLICA_URLS') or '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f"replica_{i}": url for i, url in enumerate(DB_REPLICA_URLS)}
+    DB_REPLICA_MAX_LAG_SECONDS = _get_int_env_var('DB_REPLICA_MAX_LAG_SECONDS', 5)
+    DB_REPLICA_HEARTBEAT_SECONDS = _get_int_env_var('DB_REPLICA_HEARTBEAT_SECONDS', 1)
+    DB_REPLICA_LAG_CHECK_SECONDS = _get_int_env_var('DB_REPLICA_LAG_CHECK_SECONDS', 1)
+
     # External API configuration
     DEEPSEEK_API_KEY = _get_env_var('DEEPSEEK_API_KEY', '')
 
@@ -146,6 +154,70 @@ class Config:
     RECOMMEND_CACHE_SECONDS = _get_int_env_var("RECOMMEND_CACHE_SECONDS", 300)
     RECOMMEND_WEIGHT_USER = float(_get_env_var("RECOMMEND_WEIGHT_USER", "0.4"))
     RECOMMEND_WEIGHT_POPULAR = float(_get_env_var("RECOMMEND_WEIGHT_POPULAR", "0.6"))
+    # 购物车“经常一起点”关联规则阈值
+    RECOMMEND_RULE_MIN_SUPPORT = float(_get_env_var("RECOMMEND_RULE_MIN_SUPPORT", "0.01"))
+    RECOMMEND_RULE_MIN_CONFIDENCE = float(_get_env_var("RECOMMEND_RULE_MIN_CONFIDENCE", "0.1"))
+    RECOMMEND_RULE_MIN_LIFT = float(_get_env_var("RECOMMEND_RULE_MIN_LIFT", "1.0"))
+    RECOMMEND_RULE_TOP_K = _get_int_env_var("RECOMMEND_RULE_TOP_K", 20)
+    RECOMMEND_RULE_MAX_BASKET_SIZE = _get_int_env_var("RECOMMEND_RULE_MAX_BASKET_SIZE", 50)
+    RECOMMEND_RULE_WINDOW_DAYS = _get_int_env_var("RECOMMEND_RULE_WINDOW_DAYS", 90)
+    # 推荐特征仓库快照目录（由 python -m app.recommend.feature_store 刷新）
+    FEATURE_STORE_DIR = _get_env_var("FEATURE_STORE_DIR", "data/feature_store")
+    FEATURE_STORE_RELOAD_SECONDS = _get_int_env_var("FEATURE_STORE_RELOAD_SECONDS", 60)
+    # 可选学习排序阶段（逻辑回归），不可用或超出耗时预算时回退到静态权重
+    RECOMMEND_RANKER_ENABLED = _get_bool_env_var("RECOMMEND_RANKER_ENABLED", False)
+    RECOMMEND_RANKER_MODEL_PATH = _get_env_var("RECOMMEND_RANKER_MODEL_PATH", "data/ranker/ranker.npz")
+    RECOMMEND_RANKER_RELOAD_SECONDS = _get_int_env_var("RECOMMEND_RANKER_RELOAD_SECONDS", 60)
+    RECOMMEND_RANKER_BUDGET_US = float(_get_env_var("RECOMMEND_RANKER_BUDGET_US", "20"))
+    RECOMMEND_RANKER_LABEL_WINDOW_HOURS = _get_int_env_var("RECOMMEND_RANKER_LABEL_WINDOW_HOURS", 24)
+    RECOMMEND_EXPOSURE_LOG_ENABLED = _get_bool_env_var("RECOMMEND_EXPOSURE_LOG_ENABLED", False)
+    RECOMMEND_EXPOSURE_LOG_PATH = _get_env_var("RECOMMEND_EXPOSURE_LOG_PATH",
+                                               "data/ranker/exposures.ndjson")
+    # 启动预热：后台预建连接池、预编译热点 SQL、预加载推荐缓存，完成前 /health/ready 返回 503
+    WARMUP_ENABLED = _get_bool_env_var("WARMUP_ENABLED", False)
+    WARMUP_DB_CONNECTIONS = _get_int_env_var("WARMUP_DB_CONNECTIONS", 0)  # 0 表示按连接池大小
+
+    # --- 订单配置 ---
+    # 下单 Idempotency-Key 的保留时长（秒），期间重复提交直接返回首次结果
+    ORDER_IDEMPOTENCY_TTL_SECONDS = _get_int_env_var("ORDER_IDEMPOTENCY_TTL_SECONDS", 24 * 3600)
+    # 订单事件发件箱：后台线程投递给进程内订阅者和消息代理（none / file / queue）
+    ORDER_EVENT_DISPATCH_ENABLED = _get_bool_env_var("ORDER_EVENT_DISPATCH_ENABLED", True)
+    ORDER_EVENT_POLL_SECONDS = _get_int_env_var("ORDER_EVENT_POLL_SECONDS", 5)
+    ORDER_EVENT_BATCH_SIZE = _get_int_env_var("ORDER_EVENT_BATCH_SIZE", 100)
+    ORDER_EVENT_BROKER = _get_env_var("ORDER_EVENT_BROKER", "none")
+    ORDER_EVENT_BROKER_PATH = _get_env_var("ORDER_EVENT_BROKER_PATH", "data/events/order_events.ndjson")
+    ORDER_EVENT_RETENTION_DAYS = _get_int_env_var("ORDER_EVENT_RETENTION_DAYS", 7)
+    # 游标分页返回的订单总数缓存秒数（estimated_total）
+    ORDER_TOTAL_CACHE_SECONDS = _get_int_env_var("ORDER_TOTAL_CACHE_SECONDS", 60)
+    # 订单导出时服务端游标每批读取的行数
+    ORDER_EXPORT_BATCH_SIZE = _get_int_env_var("ORDER_EXPORT_BATCH_SIZE", 1000)
+    # 超时未支付订单自动取消：后台线程每隔 INTERVAL 秒取消创建超过 TTL 分钟仍为 PENDING 的订单
+    ORDER_EXPIRY_ENABLED = _get_bool_env_var("ORDER_EXPIRY_ENABLED", False)
+    ORDER_PENDING_TTL_MINUTES = _get_int_env_var("ORDER_PENDING_TTL_MINUTES", 30)
+    ORDER_EXPIRY_INTERVAL_SECONDS = _get_int_env_var("ORDER_EXPIRY_INTERVAL_SECONDS", 60)
+    ORDER_EXPIRY_BATCH_SIZE = _get_int_env_var("ORDER_EXPIRY_BATCH_SIZE", 100)
+    # 菜品销量写后计数：订阅订单事件在内存累加，每 SALES_FLUSH_SECONDS 秒批量写回 dish.sales
+    SALES_COUNTER_ENABLED = _get_bool_env_var("SALES_COUNTER_ENABLED", True)
+    SALES_FLUSH_SECONDS = _get_int_env_var("SALES_FLUSH_SECONDS", 10)
+    # 重建销量前要求的静默期：该时间内有事件被投递说明仍有分发线程在运行，拒绝重建
+    SALES_REBUILD_QUIET_SECONDS = _get_int_env_var("SALES_REBUILD_QUIET_SECONDS", 60)
+    # 热门菜品库存分片：分片菜品集合与展示用库存合计的缓存秒数
+    STOCK_SHARD_FLAG_CACHE_SECONDS = _get_int_env_var("STOCK_SHARD_FLAG_CACHE_SECONDS", 30)
+    STOCK_SHARD_TOTAL_CACHE_SECONDS = _get_int_env_var("STOCK_SHARD_TOTAL_CACHE_SECONDS", 2)
+    # 后厨看板推送：进程内缓冲的消息条数、SSE 心跳 / 长轮询最长等待秒数、快照队列上限
+    KITCHEN_FEED_BUFFER_SIZE = _get_int_env_var("KITCHEN_FEED_BUFFER_SIZE", 1000)
+    KITCHEN_FEED_HEARTBEAT_SECONDS = _get_int_env_var("KITCHEN_FEED_HEARTBEAT_SECONDS", 15)
+    KITCHEN_FEED_RETRY_MS = _get_int_env_var("KITCHEN_FEED_RETRY_MS", 3000)
+    KITCHEN_QUEUE_LIMIT = _get_int_env_var("KITCHEN_QUEUE_LIMIT", 100)
+    # 用户订单汇总：订阅订单事件增量维护 user_order_summary（需同时启用 ORDER_EVENT_DISPATCH_ENABLED，
+    # 否则汇总在读取时实时计算），“我的订单”汇总模式返回的常点菜品数
+    USER_SUMMARY_ENABLED = _get_bool_env_var("USER_SUMMARY_ENABLED", True)
+    USER_SUMMARY_TOP_DISHES = _get_int_env_var("USER_SUMMARY_TOP_DISHES", 5)
+    # 历史订单归档：迁移创建超过 ORDER_ARCHIVE_MONTHS 个月的已完成 / 已取消订单，每个事务 ORDER_ARCHIVE_BATCH_SIZE 个
+    ORDER_ARCHIVE_MONTHS = _get_int_env_var("ORDER_ARCHIVE_MONTHS", 6)
+    ORDER_ARCHIVE_BATCH_SIZE = _get_int_env_var("ORDER_ARCHIVE_BATCH_SIZE", 500)
+    # 经营分析（营收 / 客单价 / 分类构成）结果缓存秒数，本进程内订单进入或离开统计口径时按时间范围失效
+    ANALYTICS_CACHE_SECONDS = _get_int_env_var("ANALYTICS_CACHE_SECONDS", 300)
 
     @staticmethod
     def init_app(app):
@@ -249,6 +321,9 @@ class TestConfig(Config):
     LOG_LEVEL = "WARNING"
     # LOG_FILE = "test.log" # 如果需要测试日志文件
     CACHE_TYPE = "NullCache"  # 使用 NullCache 禁用缓存
+    ORDER_EVENT_DISPATCH_ENABLED = False  # 测试时不启动后台事件分发线程，按需调用 dispatch_pending
+    SALES_COUNTER_ENABLED = False  # 测试时不启动销量写回线程，按需调用 flush
+    SQLALCHEMY_BINDS = {}  # 测试默认不使用只读副本
 
     @classmethod
     def init_app(cls, app):
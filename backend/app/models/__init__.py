@@ -16,7 +16,14 @@ from .order import Order
 from .dining_area import DiningArea
 from .chat import Chat
 from .order_item import OrderItem
+from .idempotency_key import IdempotencyKey
+from .order_event import OrderEvent
+from .dish_stock_shard import DishStockShard
+from .user_order_summary import UserOrderSummary
+from .replica_heartbeat import ReplicaHeartbeat
+from .order_archive import OrderArchive, OrderItemArchive
 
 db = SQLAlchemy()
 
-__all__ = ["db", "Dish", "User", "Order", "DiningArea", "Category", "Chat", "OrderItem"]
+__all__ = ["db", "Dish", "User", "Order", "DiningArea", "Category", "Chat", "OrderItem", "IdempotencyKey", "OrderEvent",
+           "DishStockShard", "UserOrderSummary", "ReplicaHeartbeat", "OrderArchive", "OrderItemArchive"]
@@ -18,6 +18,7 @@ from sqlalchemy import ForeignKey, String, Integer, Boolean, DateTime, Numeric,
 from sqlalchemy.orm import validates, relationship, backref, Mapped, mapped_column
 
 from app.utils.db import db
+from app.utils.money import to_decimal
 
 from app.models.tag import Tag, dish_tags
 
@@ -47,6 +48,9 @@ class Dish(db.Model):
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False, default=Decimal("0.00"),
                                            comment="菜品价格")
     stock: Mapped[int] = mapped_column(Integer, nullable=False, default=0, comment="库存数量")
+    # 大于 0 时库存存放在 dish_stock_shard 的 N 个分片中，stock 列不再实时更新
+    stock_shards: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0",
+                                              comment="库存分片数（0 表示不分片）")
     image_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True,
                                                      comment="菜品图片链接")
     sales: Mapped[int] = mapped_column(Integer, nullable=False, default=0, comment="已售数量")
@@ -97,7 +101,7 @@ class Dish(db.Model):
         validate_price 验证价格是否有效。
         """
         try:
-            price_decimal = Decimal(str(price_value))
+            price_decimal = to_decimal(price_value)
         except (TypeError, InvalidOperation):
             raise ValueError("价格必须是有效的数字")
         if price_decimal < 0:
@@ -165,6 +169,7 @@ class Dish(db.Model):
             "description": self.description,
             "category_id": self.category_id,
             "is_available": self.is_available,
+            "stock_shards": self.stock_shards,
             "created_at": self.created_at.astimezone(
                 timezone.utc).isoformat() if self.created_at else None,
             "updated_at": self.updated_at.astimezone(
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/dish_stock_shard.py
+@description  热门菜品的库存分片：开启分片的菜品库存拆分为 N 个子计数器，
+              并发下单随机扣减不同分片，避免在同一 dish 行上排队等待行锁。
+@date         2025-06-08
+@author       taichilei
+"""
+
+from sqlalchemy import ForeignKey, Integer, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.utils.db import db
+
+
+class DishStockShard(db.Model):
+    """
+    菜品库存分片模型。
+
+    Attributes:
+        dish_id: 所属菜品 ID
+        shard_no: 分片序号，0 ~ dish.stock_shards - 1
+        stock: 该分片的剩余库存
+    """
+    __tablename__ = 'dish_stock_shard'
+    __table_args__ = (
+        UniqueConstraint('dish_id', 'shard_no', name='uq_dish_stock_shard'),
+    )
+
+    shard_id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="主键 ID")
+    dish_id: Mapped[int] = mapped_column(Integer, ForeignKey('dish.dish_id', name='fk_stock_shard_dish_id',
+                                                             ondelete="CASCADE"),
+                                         nullable=False, comment="菜品ID")
+    shard_no: Mapped[int] = mapped_column(Integer, nullable=False, comment="分片序号")
+    stock: Mapped[int] = mapped_column(Integer, nullable=False, default=0, comment="分片库存")
+
+    def __repr__(self):
+        return f"<DishStockShard(dish_id={self.dish_id}, shard_no={self.shard_no}, stock={self.stock})>"
@@ -34,6 +34,14 @@ class OrderState(Enum):
     COMPLETED = "COMPLETED"
 
 
+class OrderEventType(Enum):
+    """Enum for order lifecycle events published through the order outbox."""
+    CREATED = "CREATED"
+    UPDATED = "UPDATED"
+    ITEM_UPDATED = "ITEM_UPDATED"
+    CANCELED = "CANCELED"
+
+
 class PaymentMethod(Enum):
     """Enum for different payment methods in the system."""
     WECHAT = "WECHAT"
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/idempotency_key.py
+@description  下单幂等键记录：同一用户重复提交相同 Idempotency-Key 时直接返回首次结果。
+@date         2025-06-08
+@author       taichilei
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.utils.db import db
+
+
+class IdempotencyKey(db.Model):
+    """
+    幂等键模型。
+
+    Attributes:
+        user_id: 提交请求的用户 ID
+        idempotency_key: 客户端提供的 Idempotency-Key 请求头
+        request_hash: 请求体摘要，用于识别同一键被复用于不同请求
+        order_id: 首次请求创建的订单 ID（与订单在同一事务中写入）
+        response_body: 首次请求的响应数据 (JSON)，commit 后回填
+        expires_at: 过期时间，过期后同一键可重新使用
+    """
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'idempotency_key', name='uq_idempotency_user_key'),
+        Index('ix_idempotency_expires_at', 'expires_at'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="主键 ID")
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('user.user_id', name='fk_idempotency_user_id',
+                                                             ondelete="CASCADE"),
+                                         nullable=False, comment="用户ID")
+    idempotency_key: Mapped[str] = mapped_column(String(64), nullable=False, comment="幂等键")
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False, comment="请求体 SHA-256 摘要")
+    order_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, comment="首次创建的订单ID")
+    response_body: Mapped[Optional[str]] = mapped_column(Text, nullable=True, comment="首次响应数据 (JSON)")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                 server_default=func.now(), comment="创建时间")
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                 comment="过期时间")
+
+    def __repr__(self):
+        return f"<IdempotencyKey(user_id={self.user_id}, key={self.idempotency_key}, order_id={self.order_id})>"
@@ -17,6 +17,7 @@ from sqlalchemy.orm import relationship, validates, Mapped, mapped_column
 
 from app.models.enums import OrderState, PaymentMethod
 from app.utils.db import db
+from app.utils.money import to_decimal
 
 # 处理 OrderItem 的循环类型提示
 if TYPE_CHECKING:
@@ -26,6 +27,14 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# 订单状态机：当前状态 -> 允许转换到的目标状态（COMPLETED / CANCELED 为终态）
+ORDER_STATE_TRANSITIONS: Dict[OrderState, frozenset] = {
+    OrderState.PENDING: frozenset({OrderState.PAID, OrderState.CANCELED}),
+    OrderState.PAID: frozenset({OrderState.COMPLETED, OrderState.CANCELED}),
+    OrderState.COMPLETED: frozenset(),
+    OrderState.CANCELED: frozenset(),
+}
+
 
 class Order(db.Model):
     """
@@ -35,6 +44,11 @@ class Order(db.Model):
     __table_args__ = (
         db.Index('ix_order_user_id', 'user_id'),
         db.Index('ix_order_area_id', 'area_id'),
+        # 游标分页：按 (created_at, order_id) 降序扫描全部订单 / 某用户的订单
+        db.Index('ix_order_created_at_id', 'created_at', 'order_id'),
+        db.Index('ix_order_user_created_at_id', 'user_id', 'created_at', 'order_id'),
+        # 超时未支付订单清理：按状态 + 创建时间扫描最旧的 PENDING 订单
+        db.Index('ix_order_state_created_at', 'state', 'created_at'),
     )
 
     order_id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="订单号（主键）")
@@ -77,7 +91,7 @@ class Order(db.Model):
         验证服务层设置的总价（通常是计算好的）
         """
         try:
-            price_decimal = Decimal(str(price_value))
+            price_decimal = to_decimal(price_value)
         except (TypeError, InvalidOperation):
             raise ValueError("订单价格必须是有效的数字")
         if price_decimal < 0:
@@ -125,9 +139,17 @@ class Order(db.Model):
         """根据已加载的订单项计算订单总价。"""
         if not self.order_items:
             return Decimal("0.00")
-        # 确保 item.price 返回的是 Decimal
-        total = sum(item.calculate_item_total() for item in self.order_items)
-        return total if isinstance(total, Decimal) else Decimal(str(total))  # 确保返回 Decimal
+        return sum((item.calculate_item_total() for item in self.order_items), Decimal("0.00"))
+
+    @staticmethod
+    def is_valid_transition(current: OrderState, target: OrderState) -> bool:
+        """按状态机判断 current -> target 是否允许。"""
+        return target in ORDER_STATE_TRANSITIONS.get(current, frozenset())
+
+    @staticmethod
+    def source_states(target: OrderState) -> List[OrderState]:
+        """可以转换到 target 的全部来源状态。"""
+        return [state for state, targets in ORDER_STATE_TRANSITIONS.items() if target in targets]
 
     def can_be_canceled(self) -> bool:
         """检查订单当前状态是否允许被取消。"""
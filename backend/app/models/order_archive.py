@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/order_archive.py
+@description  历史订单归档表：超过保留期的已完成 / 已取消订单连同订单项从 orders、order_items
+              批量迁入 orders_archive、order_items_archive，热表只保留近期与进行中的订单。
+              列与原表一致（另加 archived_at），不设外键，用户或菜品删除不影响归档数据；
+              MySQL 上可由 DBA 将归档表按 created_at 做 RANGE 分区，应用代码无需改动。
+@date         2025-06-08
+@author       taichilei
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import DateTime, Integer, Numeric, String, func, Enum as DBEnum
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.enums import OrderState, PaymentMethod
+from app.utils.db import db
+
+
+class OrderArchive(db.Model):
+    """已归档订单，字段含义同 Order。"""
+    __tablename__ = 'orders_archive'
+    __table_args__ = (
+        db.Index('ix_order_archive_user_created_at', 'user_id', 'created_at'),
+        db.Index('ix_order_archive_created_at', 'created_at'),
+    )
+
+    order_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False, comment="订单号")
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False, comment="下单用户ID")
+    area_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, comment="用餐区域ID")
+    state: Mapped[OrderState] = mapped_column(DBEnum(OrderState, name="order_state_enum"),
+                                              nullable=False, comment="订单状态")
+    price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False, comment="订单总金额")
+    payment_method: Mapped[Optional[PaymentMethod]] = mapped_column(
+        DBEnum(PaymentMethod, name="payment_method_enum"), nullable=True, comment="支付方式")
+    image_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, comment="支付凭证图片URL")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, comment="订单创建时间")
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, comment="订单更新时间")
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                           comment="删除时间（软删除）")
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                  server_default=func.now(), comment="归档时间")
+
+    def __repr__(self):
+        return f"<OrderArchive(id={self.order_id}, user_id={self.user_id}, state={self.state.name})>"
+
+
+class OrderItemArchive(db.Model):
+    """已归档订单项，字段含义同 OrderItem。"""
+    __tablename__ = 'order_items_archive'
+    __table_args__ = (
+        db.Index('ix_order_item_archive_order_id', 'order_id'),
+        db.Index('ix_order_item_archive_dish_id', 'dish_id'),
+    )
+
+    order_item_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False,
+                                               comment="订单项ID")
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False, comment="订单号")
+    dish_id: Mapped[int] = mapped_column(Integer, nullable=False, comment="菜品ID")
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False, comment="菜品数量")
+    unit_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False, comment="下单时单价")
+    dish_name: Mapped[Optional[str]] = mapped_column(String(50), nullable=True, comment="下单时菜品名称快照")
+    dish_image_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True,
+                                                          comment="下单时菜品图片快照")
+
+    def __repr__(self):
+        return f"<OrderItemArchive(id={self.order_item_id}, order_id={self.order_id}, dish_id={self.dish_id})>"
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/order_event.py
+@description  订单事件发件箱（transactional outbox）：与订单变更在同一事务中写入，
+              由后台分发线程投递给进程内订阅者和消息代理。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import DateTime, Index, Integer, Text, func, Enum as DBEnum
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.enums import OrderEventType
+from app.utils.db import db
+
+
+class OrderEvent(db.Model):
+    """
+    订单事件模型。
+
+    Attributes:
+        event_id: 事件 ID (自增，即投递顺序)
+        order_id: 关联订单 ID（不设外键，订单硬删除后事件仍可投递）
+        event_type: 事件类型
+        payload: 事件数据 (JSON)
+        created_at: 事件产生时间
+        dispatched_at: 投递完成时间，为空表示待投递
+    """
+    __tablename__ = 'order_event'
+    __table_args__ = (
+        Index('ix_order_event_pending', 'dispatched_at', 'event_id'),
+        Index('ix_order_event_order_id', 'order_id'),
+    )
+
+    event_id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="事件ID")
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False, comment="关联订单ID")
+    event_type: Mapped[OrderEventType] = mapped_column(
+        DBEnum(OrderEventType, name="order_event_type_enum"), nullable=False, comment="事件类型")
+    payload: Mapped[str] = mapped_column(Text, nullable=False, comment="事件数据 (JSON)")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                 server_default=func.now(), comment="事件产生时间")
+    dispatched_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                              comment="投递完成时间")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为投递给订阅者 / 消息代理的事件字典。"""
+        return {
+            "event_id": self.event_id,
+            "event_type": self.event_type.name,
+            "order_id": self.order_id,
+            "payload": json.loads(self.payload),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f"<OrderEvent(id={self.event_id}, order_id={self.order_id}, type={self.event_type.name})>"
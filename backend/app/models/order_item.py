@@ -11,12 +11,13 @@
 
 import logging
 from decimal import Decimal, InvalidOperation
-from typing import TYPE_CHECKING, Dict, Any
+from typing import TYPE_CHECKING, Dict, Any, Optional
 
-from sqlalchemy import ForeignKey, Integer, Numeric
+from sqlalchemy import ForeignKey, Integer, Numeric, String
 from sqlalchemy.orm import relationship, validates, Mapped, mapped_column
 
 from app.utils.db import db
+from app.utils.money import to_decimal
 
 logger = logging.getLogger(__name__)
 
@@ -35,8 +36,10 @@ class OrderItem(db.Model):
         dish_id: 关联菜品 ID (外键)
         quantity: 菜品数量 (必须 > 0)
         unit_price: 下单时菜品单价快照 (Decimal)
+        dish_name: 下单时菜品名称快照（早期订单项为空，读取时回退到 Dish）
+        dish_image_url: 下单时菜品图片快照
         order: 关联的 Order 对象
-        dish: 关联的 Dish 对象
+        dish: 关联的 Dish 对象 (按需加载，展示订单项只需快照列)
     """
     __tablename__ = 'order_items'
 
@@ -59,12 +62,16 @@ class OrderItem(db.Model):
     # --- 使用 Numeric 存储单价 ---
     unit_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False,
                                                 comment="下单时菜品单价快照")
+    # --- 菜品快照：订单展示不再联表加载 Dish ---
+    dish_name: Mapped[Optional[str]] = mapped_column(String(50), nullable=True, comment="下单时菜品名称快照")
+    dish_image_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True,
+                                                          comment="下单时菜品图片快照")
 
     # --- 关系定义 ---
     order: Mapped["Order"] = relationship(back_populates="order_items")
-    # lazy='joined' 或 'selectin' 通常比默认的 'select' 好，避免 N+1
-    dish: Mapped["Dish"] = relationship(backref=db.backref('order_items', lazy='selectin'),
-                                        lazy='joined')
+    # 展示所需的名称 / 图片已快照到本表，Dish 仅在访问时加载；菜品一侧的反向关系同样按需加载
+    dish: Mapped["Dish"] = relationship(backref=db.backref('order_items', lazy='select'),
+                                        lazy='select')
 
     # --- 移除自定义 __init__ ---
 
@@ -84,7 +91,7 @@ class OrderItem(db.Model):
         validate_unit_price 验证单价是否有效，并转换为 Decimal 类型。
         """
         try:
-            price_decimal = Decimal(str(price))  # 确保是 Decimal
+            price_decimal = to_decimal(price)  # 确保是 Decimal
         except (TypeError, InvalidOperation):
             raise ValueError("单价必须是有效的数字")
         if price_decimal <= 0:  # 单价通常必须大于 0
@@ -94,16 +101,19 @@ class OrderItem(db.Model):
     # --- 实例方法 ---
     def calculate_item_total(self) -> Decimal:
         """计算当前订单项的总价 (数量 * 单价)。"""
-        # 确保 self.quantity 和 self.unit_price 是正确的类型
         if self.quantity is None or self.unit_price is None:
             logger.error(f"订单项 {self.order_item_id} 缺少数量或单价，无法计算总价。")
             return Decimal("0.00")
-        return Decimal(str(self.quantity)) * self.unit_price  # 确保是 Decimal 运算
+        return self.quantity * self.unit_price  # int * Decimal 仍为 Decimal，保留两位小数
 
     def to_dict(self) -> Dict[str, Any]:
         """将订单项对象转换为字典。"""
-        # 确保 dish 对象已加载 (lazy='joined' 或服务层预加载)
-        dish_name = self.dish.name if self.dish else "未知菜品"
+        # 优先使用快照；早期未快照的订单项才加载 Dish
+        dish_name = self.dish_name
+        dish_image_url = self.dish_image_url
+        if dish_name is None:
+            dish_name = self.dish.name if self.dish else "未知菜品"
+            dish_image_url = self.dish.image_url if self.dish else None
         item_total = self.calculate_item_total()
 
         return {
@@ -111,6 +121,7 @@ class OrderItem(db.Model):
             'order_id': self.order_id,
             'dish_id': self.dish_id,
             'dish_name': dish_name,
+            'dish_image_url': dish_image_url,
             'quantity': self.quantity,
             # --- unit_price 和 total 返回字符串保证精度 ---
             'unit_price': str(self.unit_price) if self.unit_price is not None else "0.00",
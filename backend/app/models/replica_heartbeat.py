@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/replica_heartbeat.py
+@description  只读副本心跳：主库定期写入当前时间，经复制到达副本后，
+              副本上读到的时间与当前时间之差即为副本延迟的上界。
+@date         2025-06-08
+@author       taichilei
+"""
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.utils.db import db
+
+
+class ReplicaHeartbeat(db.Model):
+    """
+    副本心跳模型（单行，id 固定为 1）。
+
+    Attributes:
+        beat_at: 主库最近一次写入心跳的时间（UTC）
+    """
+    __tablename__ = 'replica_heartbeat'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False, comment="固定为 1")
+    beat_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, comment="心跳时间 (UTC)")
+
+    def __repr__(self):
+        return f"<ReplicaHeartbeat(beat_at={self.beat_at})>"
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/models/user_order_summary.py
+@description  用户订单汇总：每个用户一行，保存订单数、累计消费、最近下单时间与各菜品点单数量，
+              由订单事件增量维护，“我的订单”汇总模式按主键一次读取。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import DateTime, ForeignKey, Integer, Numeric, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.utils.db import db
+
+
+class UserOrderSummary(db.Model):
+    """
+    用户订单汇总模型。
+
+    Attributes:
+        user_id: 用户 ID（主键）
+        order_count: 未取消的订单数
+        total_spent: 未取消订单的金额合计
+        last_order_at: 最近一次下单时间（含已取消订单）
+        dish_counts: 各菜品的点单数量 JSON，{"dish_id": {"name": ..., "quantity": ...}}
+        baseline_event_id: 汇总由订单表重算时可见的最大事件 ID
+        baseline_pending_ids: 重算时已可见、已计入汇总但尚未投递的事件 ID 列表 (JSON)。
+            不大于 baseline_event_id 的事件只有在此列表中才跳过：其余的是重算时尚未提交的
+            （自增 ID 较小但提交较晚的事务），未计入汇总，仍需累加
+    """
+    __tablename__ = 'user_order_summary'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('user.user_id', name='fk_order_summary_user_id',
+                                                             ondelete="CASCADE"),
+                                         primary_key=True, comment="用户ID")
+    order_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, comment="未取消订单数")
+    total_spent: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False, default=Decimal("0.00"),
+                                                 comment="累计消费金额")
+    last_order_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                              comment="最近下单时间")
+    dish_counts: Mapped[str] = mapped_column(Text, nullable=False, default="{}", comment="各菜品点单数量 (JSON)")
+    baseline_event_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0,
+                                                   comment="重算时可见的最大事件ID")
+    baseline_pending_ids: Mapped[str] = mapped_column(Text, nullable=False, default="[]",
+                                                      comment="重算时已计入但未投递的事件ID (JSON)")
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                 server_default=func.now(), onupdate=func.now(),
+                                                 comment="更新时间")
+
+    def get_dish_counts(self) -> Dict[str, Dict[str, Any]]:
+        return json.loads(self.dish_counts or "{}")
+
+    def set_dish_counts(self, counts: Dict[str, Dict[str, Any]]):
+        # 数量减到 0 的菜品不再保留
+        self.dish_counts = json.dumps({k: v for k, v in counts.items() if v["quantity"] > 0},
+                                      ensure_ascii=False)
+
+    def get_baseline_pending_ids(self) -> List[int]:
+        return json.loads(self.baseline_pending_ids or "[]")
+
+    def set_baseline_pending_ids(self, event_ids: List[int]):
+        self.baseline_pending_ids = json.dumps(sorted(event_ids))
+
+    def top_dishes(self, limit: int) -> List[Dict[str, Any]]:
+        """点单数量最多的 limit 个菜品。"""
+        ranked = sorted(self.get_dish_counts().items(), key=lambda kv: (-kv[1]["quantity"], int(kv[0])))
+        return [{"dish_id": int(dish_id), "name": v.get("name"), "quantity": v["quantity"]}
+                for dish_id, v in ranked[:limit]]
+
+    def __repr__(self):
+        return f"<UserOrderSummary(user_id={self.user_id}, order_count={self.order_count})>"
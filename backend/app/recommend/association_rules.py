@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/recommend/association_rules.py
+@description  基于订单内共现的关联规则（support / confidence / lift）购物车加购推荐。
+              与按用户共购计算的 ItemCF 不同，这里以单个订单（order_id）为一个购物篮。
+              只统计最近 RECOMMEND_RULE_WINDOW_DAYS 天的订单，挖掘开销不随历史订单增长。
+              规则索引在启动预热或后台线程中挖掘：进程内尚无索引（未启用预热）时由首个请求同步构建一次，
+              之后请求路径只读取已构建的索引，超过 RECOMMEND_CACHE_SECONDS 后触发一次后台刷新，
+              刷新完成前继续使用上一版；挖掘失败不覆盖上一版索引，RETRY_SECONDS 秒后再重试。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import select
+
+from app.config import Config
+from app.models.enums import OrderState
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+# 规则索引结构：{前项 dish_id: [(后项 dish_id, confidence, lift, support), ...]}，按 confidence、lift 降序
+RuleIndex = Dict[int, List[Tuple[int, float, float, float]]]
+
+RETRY_SECONDS = 30
+
+# 进程内的当前规则索引及其刷新状态
+_state_lock = threading.Lock()
+_rule_index: Optional[RuleIndex] = None
+_next_refresh = float("-inf")
+_refreshing = False
+
+
+class BasketRuleRecommender:
+    """“经常一起点”推荐器：预计算两两关联规则索引，按购物车内容在内存中查表。"""
+
+    @staticmethod
+    def _load_baskets() -> List[frozenset]:
+        """按 order_id 聚合订单项，得到最近 RECOMMEND_RULE_WINDOW_DAYS 天内每个未取消订单的菜品集合（0 表示不限）。"""
+        stmt = (
+            select(OrderItem.order_id, OrderItem.dish_id)
+            .join(Order, Order.order_id == OrderItem.order_id)
+            .where(Order.state != OrderState.CANCELED, Order.deleted_at.is_(None))
+        )
+        if Config.RECOMMEND_RULE_WINDOW_DAYS > 0:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=Config.RECOMMEND_RULE_WINDOW_DAYS)
+            stmt = stmt.where(Order.created_at >= cutoff)
+        baskets: Dict[int, set] = {}
+        for order_id, dish_id in db.session.execute(stmt):
+            baskets.setdefault(order_id, set()).add(dish_id)
+        return [frozenset(items) for items in baskets.values()]
+
+    @staticmethod
+    def mine_rules(baskets: Iterable[frozenset],
+                   min_support: float = Config.RECOMMEND_RULE_MIN_SUPPORT,
+                   min_confidence: float = Config.RECOMMEND_RULE_MIN_CONFIDENCE,
+                   min_lift: float = Config.RECOMMEND_RULE_MIN_LIFT,
+                   top_k: int = Config.RECOMMEND_RULE_TOP_K,
+                   max_basket_size: int = Config.RECOMMEND_RULE_MAX_BASKET_SIZE) -> RuleIndex:
+        """
+        从购物篮中挖掘两两关联规则 A -> B：
+        support = P(A∩B)，confidence = P(B|A)，lift = confidence / P(B)。
+        超过 max_basket_size 的大单（如宴会团餐）不参与配对统计，避免组合爆炸。
+        """
+        total = 0
+        item_counts: Dict[int, int] = {}
+        pair_counts: Dict[Tuple[int, int], int] = {}
+        for basket in baskets:
+            if not basket:
+                continue
+            total += 1
+            for dish_id in basket:
+                item_counts[dish_id] = item_counts.get(dish_id, 0) + 1
+            if len(basket) < 2 or len(basket) > max_basket_size:
+                continue
+            for pair in combinations(sorted(basket), 2):
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
+
+        if total == 0:
+            return {}
+
+        index: RuleIndex = {}
+        for (dish_a, dish_b), count in pair_counts.items():
+            support = count / total
+            if support < min_support:
+                continue
+            for antecedent, consequent in ((dish_a, dish_b), (dish_b, dish_a)):
+                confidence = count / item_counts[antecedent]
+                lift = confidence / (item_counts[consequent] / total)
+                if confidence >= min_confidence and lift >= min_lift:
+                    index.setdefault(antecedent, []).append(
+                        (consequent, round(confidence, 4), round(lift, 4), round(support, 4)))
+
+        for antecedent, rules in index.items():
+            rules.sort(key=lambda rule: (rule[1], rule[2]), reverse=True)
+            del rules[top_k:]
+        return index
+
+    def get_rule_index(self) -> RuleIndex:
+        """
+        返回当前规则索引。进程内尚无索引时在调用线程中同步构建一次（并发的其他请求返回空索引）；
+        已有索引过期时启动后台刷新，刷新完成前返回上一版索引。构建失败时返回空索引。
+        """
+        global _refreshing
+        if time.monotonic() >= _next_refresh and not _refreshing:
+            with _state_lock:
+                start = time.monotonic() >= _next_refresh and not _refreshing
+                if start:
+                    _refreshing = True
+            if start and _rule_index is None:
+                try:
+                    self.refresh_rule_index()
+                except Exception as ex:
+                    db.session.rollback()
+                    logger.error(f"首次构建关联规则失败，{RETRY_SECONDS} 秒后重试: {ex}", exc_info=True)
+                finally:
+                    with _state_lock:
+                        _refreshing = False
+            elif start:
+                threading.Thread(target=self._refresh_in_background, args=(current_app._get_current_object(),),
+                                 name="hotmeal-basket-rules", daemon=True).start()
+        return _rule_index or {}
+
+    def _refresh_in_background(self, app: Flask):
+        global _refreshing
+        try:
+            with app.app_context():
+                try:
+                    self.refresh_rule_index()
+                except Exception as ex:
+                    logger.error(f"后台刷新关联规则失败，{RETRY_SECONDS} 秒后重试: {ex}", exc_info=True)
+                finally:
+                    db.session.remove()
+        finally:
+            with _state_lock:
+                _refreshing = False
+
+    def refresh_rule_index(self) -> RuleIndex:
+        """
+        同步挖掘并替换当前规则索引（启动预热与后台刷新使用）。
+        失败时保留上一版索引并抛出异常，RETRY_SECONDS 秒内不再自动重试。
+        """
+        global _rule_index, _next_refresh
+        try:
+            index = self.build_rule_index()
+        except Exception:
+            _next_refresh = time.monotonic() + RETRY_SECONDS
+            raise
+        _rule_index = index
+        _next_refresh = time.monotonic() + Config.RECOMMEND_CACHE_SECONDS
+        return index
+
+    def build_rule_index(self) -> RuleIndex:
+        """重新从最近窗口内的订单项挖掘关联规则；加载订单数据失败时抛出异常。"""
+        logger.info("开始挖掘订单内菜品关联规则...")
+        baskets = self._load_baskets()
+        index = self.mine_rules(baskets)
+        logger.info(f"关联规则挖掘完成：{len(baskets)} 个订单，{len(index)} 个前项菜品。")
+        return index
+
+    @staticmethod
+    def invalidate():
+        """标记规则索引过期，下次访问时后台刷新（刷新完成前仍使用当前索引）。"""
+        global _next_refresh
+        _next_refresh = float("-inf")
+
+    def recommend_addons(self, cart_dish_ids: Iterable[int], limit: int = 5) -> Dict[int, Dict[str, float]]:
+        """
+        根据购物车中的菜品推荐加购菜品。
+        多个前项命中同一后项时 confidence 累加作为得分，lift 取最大值。
+        返回格式：{dish_id: {"score": ..., "confidence": ..., "lift": ...}}，按得分降序。
+        """
+        cart = set(cart_dish_ids)
+        if not cart:
+            return {}
+        index = self.get_rule_index()
+
+        candidates: Dict[int, Dict[str, float]] = {}
+        for antecedent in cart:
+            for consequent, confidence, lift, _support in index.get(antecedent, ()):
+                if consequent in cart:
+                    continue
+                entry = candidates.setdefault(consequent,
+                                              {"score": 0.0, "confidence": 0.0, "lift": 0.0})
+                entry["score"] += confidence
+                entry["confidence"] = max(entry["confidence"], confidence)
+                entry["lift"] = max(entry["lift"], lift)
+
+        ranked = sorted(candidates.items(), key=lambda item: (item[1]["score"], item[1]["lift"]),
+                        reverse=True)[:limit]
+        return {dish_id: {k: round(v, 4) for k, v in stats.items()} for dish_id, stats in ranked}
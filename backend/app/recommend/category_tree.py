@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/recommend/category_tree.py
+@description  分类树索引：缓存 父分类 -> 全部子孙分类 的闭包，供推荐模块在内存中展开分类子树。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.config import Config
+from app.models.category import Category
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryTreeIndex:
+    """
+    分类树闭包索引（进程内缓存）。
+
+    - 首次使用时一次性查询全部未删除分类，构建 {category_id: 自身及全部子孙 ID} 的闭包；
+    - 分类发生增删改时由 category_service 调用 invalidate()，下次访问时惰性重建；
+      失效递增版本号，构建开始前记下版本，构建期间发生的失效会让结果立即过期，不会丢失；
+    - 与其他推荐缓存一样最多保留 RECOMMEND_CACHE_SECONDS 秒，其他进程修改的分类也会生效；
+    - 避免每次推荐请求都执行递归查询。
+    """
+
+    def __init__(self, ttl_seconds: int = Config.RECOMMEND_CACHE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._version = 0
+        self._built_version = -1
+        self._expires_at = float("-inf")
+        self._name_to_id: Dict[str, int] = {}
+        self._descendants: Dict[int, frozenset] = {}
+
+    def invalidate(self):
+        """标记索引失效，下一次访问时重建。"""
+        with self._version_lock:
+            self._version += 1
+        logger.debug("分类树索引已标记为失效。")
+
+    def _is_fresh(self) -> bool:
+        return self._built_version == self._version and time.monotonic() < self._expires_at
+
+    def _build(self):
+        """从数据库加载分类并构建闭包（调用方需持有构建锁）。"""
+        version = self._version
+        stmt = select(Category.category_id, Category.parent_category_id, Category.name).where(
+            Category.deleted_at.is_(None))
+        rows = db.session.execute(stmt).fetchall()
+
+        children: Dict[int, List[int]] = {}
+        name_to_id: Dict[str, int] = {}
+        for category_id, parent_id, name in rows:
+            name_to_id[name] = category_id
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(category_id)
+
+        # 迭代 DFS 计算闭包，visited 防止异常数据中的环导致死循环
+        descendants: Dict[int, frozenset] = {}
+        for category_id in name_to_id.values():
+            visited: Set[int] = {category_id}
+            stack = [category_id]
+            while stack:
+                for child_id in children.get(stack.pop(), ()):
+                    if child_id not in visited:
+                        visited.add(child_id)
+                        stack.append(child_id)
+            descendants[category_id] = frozenset(visited)
+
+        self._name_to_id = name_to_id
+        self._descendants = descendants
+        self._built_version = version
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        logger.info(f"分类树索引构建完成，共 {len(descendants)} 个分类。")
+
+    def _ensure_loaded(self):
+        if self._is_fresh():
+            return
+        with self._lock:
+            if not self._is_fresh():
+                self._build()
+
+    def get_subtree_ids(self, category_id: int) -> Set[int]:
+        """返回指定分类自身及其全部子孙分类的 ID 集合（分类不存在时返回空集合）。"""
+        self._ensure_loaded()
+        return set(self._descendants.get(category_id, ()))
+
+    def get_subtree_ids_by_name(self, name: Optional[str]) -> Set[int]:
+        """按分类名称展开子树，名称未匹配到分类时返回空集合。"""
+        if not name:
+            return set()
+        self._ensure_loaded()
+        category_id = self._name_to_id.get(name.strip())
+        if category_id is None:
+            return set()
+        return set(self._descendants.get(category_id, ()))
+
+
+# 进程内单例
+category_tree_index = CategoryTreeIndex()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/recommend/feature_store.py
+@description  推荐信号特征仓库：将菜品 / 用户特征物化为列式 .npy 快照，启动时 mmap 加载，
+              推荐器与排序模型按行号读取特征，无需在请求路径上查询数据库。
+
+              快照目录结构（FEATURE_STORE_DIR）：
+                  CURRENT                      -> 当前快照目录名（原子替换）
+                  snapshot-<时间戳>/manifest.json
+                  snapshot-<时间戳>/dish__<列名>.npy
+                  snapshot-<时间戳>/user__<列名>.npy
+
+              刷新任务：python -m app.recommend.feature_store
+              各进程每 FEATURE_STORE_RELOAD_SECONDS 秒检查一次 CURRENT，指向新快照时重新加载。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import select, func, case, distinct
+from sqlalchemy.orm import aliased
+
+from app.config import Config
+from app.models.dish import Dish
+from app.models.enums import OrderState
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+DISH_COLUMNS = ("dish_id", "category_id", "price", "sales", "rating", "is_available",
+                "pop_7d", "pop_30d", "cooc_degree")
+USER_COLUMNS = ("user_id", "order_count", "avg_spend", "favorite_category_id", "last_order_ts")
+
+_CURRENT_FILE = "CURRENT"
+_KEEP_SNAPSHOTS = 2
+
+
+def _to_timestamp(value: Optional[datetime]) -> float:
+    """将数据库时间转为 UTC 时间戳；无时区信息的时间按 UTC 处理。"""
+    if value is None:
+        return float("nan")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _counted_orders():
+    """与推荐器其他部分一致的订单口径：未取消且未删除。"""
+    return Order.state != OrderState.CANCELED, Order.deleted_at.is_(None)
+
+
+class FeatureStore:
+    """列式特征快照的物化（refresh）与只读访问（load / 按 ID 取特征）。"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self._dish: Dict[str, np.ndarray] = {}
+        self._user: Dict[str, np.ndarray] = {}
+        self.manifest: Dict = {}
+
+    # ---------- 物化 ----------
+    @staticmethod
+    def _materialize_dish_features(now: datetime) -> Dict[str, np.ndarray]:
+        """聚合菜品维度特征：基础属性、近 7/30 天热度、订单内共现菜品数。"""
+        cutoff_7d = now - timedelta(days=7)
+        cutoff_30d = now - timedelta(days=30)
+
+        dishes = db.session.execute(
+            select(Dish.dish_id, Dish.category_id, Dish.price, Dish.sales, Dish.rating,
+                   Dish.is_available)
+            .where(Dish.deleted_at.is_(None))
+            .order_by(Dish.dish_id)
+        ).fetchall()
+
+        popularity = {
+            row[0]: (int(row[1] or 0), int(row[2] or 0)) for row in db.session.execute(
+                select(OrderItem.dish_id,
+                       func.sum(case((Order.created_at >= cutoff_7d, 1), else_=0)),
+                       func.count(OrderItem.order_item_id))
+                .join(Order, Order.order_id == OrderItem.order_id)
+                .where(Order.created_at >= cutoff_30d, *_counted_orders())
+                .group_by(OrderItem.dish_id)
+            )
+        }
+
+        other = aliased(OrderItem)
+        cooc = dict(db.session.execute(
+            select(OrderItem.dish_id, func.count(distinct(other.dish_id)))
+            .join(other, (other.order_id == OrderItem.order_id)
+                  & (other.dish_id != OrderItem.dish_id))
+            .join(Order, Order.order_id == OrderItem.order_id)
+            .where(*_counted_orders())
+            .group_by(OrderItem.dish_id)
+        ).fetchall())
+
+        return {
+            "dish_id": np.array([r.dish_id for r in dishes], dtype=np.int64),
+            "category_id": np.array([r.category_id if r.category_id is not None else -1
+                                     for r in dishes], dtype=np.int64),
+            "price": np.array([float(r.price or 0) for r in dishes], dtype=np.float64),
+            "sales": np.array([r.sales or 0 for r in dishes], dtype=np.int64),
+            "rating": np.array([float(r.rating or 0) for r in dishes], dtype=np.float32),
+            "is_available": np.array([bool(r.is_available) for r in dishes], dtype=np.bool_),
+            "pop_7d": np.array([popularity.get(r.dish_id, (0, 0))[0] for r in dishes],
+                               dtype=np.int64),
+            "pop_30d": np.array([popularity.get(r.dish_id, (0, 0))[1] for r in dishes],
+                                dtype=np.int64),
+            "cooc_degree": np.array([cooc.get(r.dish_id, 0) for r in dishes], dtype=np.int64),
+        }
+
+    @staticmethod
+    def _materialize_user_features() -> Dict[str, np.ndarray]:
+        """聚合用户维度特征：订单数、客单价、最常点分类、最近下单时间。"""
+        orders = db.session.execute(
+            select(Order.user_id, func.count(Order.order_id), func.avg(Order.price),
+                   func.max(Order.created_at))
+            .where(*_counted_orders())
+            .group_by(Order.user_id)
+            .order_by(Order.user_id)
+        ).fetchall()
+
+        favorite: Dict[int, tuple] = {}
+        for user_id, category_id, item_count in db.session.execute(
+                select(Order.user_id, Dish.category_id, func.count(OrderItem.order_item_id))
+                .join(OrderItem, OrderItem.order_id == Order.order_id)
+                .join(Dish, Dish.dish_id == OrderItem.dish_id)
+                .where(*_counted_orders(), Dish.category_id.is_not(None))
+                .group_by(Order.user_id, Dish.category_id)):
+            best = favorite.get(user_id)
+            if best is None or item_count > best[1]:
+                favorite[user_id] = (category_id, item_count)
+
+        return {
+            "user_id": np.array([r[0] for r in orders], dtype=np.int64),
+            "order_count": np.array([r[1] for r in orders], dtype=np.int64),
+            "avg_spend": np.array([float(r[2] or 0) for r in orders], dtype=np.float64),
+            "favorite_category_id": np.array([favorite.get(r[0], (-1, 0))[0] for r in orders],
+                                             dtype=np.int64),
+            "last_order_ts": np.array([_to_timestamp(r[3]) for r in orders], dtype=np.float64),
+        }
+
+    def refresh(self) -> str:
+        """重新物化全部特征并写入新快照，随后切换 CURRENT 并加载。返回快照目录名。"""
+        now = datetime.now(timezone.utc)
+        logger.info("开始物化推荐特征快照...")
+        dish_columns = self._materialize_dish_features(now)
+        user_columns = self._materialize_user_features()
+
+        snapshot = f"snapshot-{now.strftime('%Y%m%d%H%M%S%f')}"
+        snapshot_dir = os.path.join(self.base_dir, snapshot)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        for prefix, columns in (("dish", dish_columns), ("user", user_columns)):
+            for name, values in columns.items():
+                np.save(os.path.join(snapshot_dir, f"{prefix}__{name}.npy"), values)
+
+        manifest = {
+            "snapshot": snapshot,
+            "created_at": now.isoformat(),
+            "dish_rows": int(len(dish_columns["dish_id"])),
+            "user_rows": int(len(user_columns["user_id"])),
+            "dish_columns": list(DISH_COLUMNS),
+            "user_columns": list(USER_COLUMNS),
+        }
+        with open(os.path.join(snapshot_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        # 先写临时文件再 os.replace，保证读取方看到的 CURRENT 总是完整的
+        tmp_current = os.path.join(self.base_dir, _CURRENT_FILE + ".tmp")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+        os.replace(tmp_current, os.path.join(self.base_dir, _CURRENT_FILE))
+
+        logger.info(f"特征快照 {snapshot} 写入完成：{manifest['dish_rows']} 个菜品，"
+                    f"{manifest['user_rows']} 个用户。")
+        self._prune_old_snapshots(keep=snapshot)
+        self.load()
+        return snapshot
+
+    def _prune_old_snapshots(self, keep: str):
+        """只保留最近的若干个快照目录（已 mmap 的旧快照在 POSIX 下删除后仍可读）。"""
+        snapshots = sorted(name for name in os.listdir(self.base_dir)
+                           if name.startswith("snapshot-") and name != keep)
+        for name in snapshots[:max(len(snapshots) - (_KEEP_SNAPSHOTS - 1), 0)]:
+            shutil.rmtree(os.path.join(self.base_dir, name), ignore_errors=True)
+
+    # ---------- 加载与读取 ----------
+    def current_snapshot(self) -> Optional[str]:
+        """CURRENT 当前指向的快照目录名，尚无快照时返回 None。"""
+        try:
+            with open(os.path.join(self.base_dir, _CURRENT_FILE), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def reload_if_changed(self) -> bool:
+        """CURRENT 指向的快照与已加载的不同时重新加载，返回是否发生了加载。"""
+        snapshot = self.current_snapshot()
+        if snapshot is None or snapshot == self.manifest.get("snapshot"):
+            return False
+        return self.load()
+
+    def load(self) -> bool:
+        """以 mmap 只读方式加载 CURRENT 指向的快照，快照不存在时返回 False。"""
+        current_path = os.path.join(self.base_dir, _CURRENT_FILE)
+        if not os.path.exists(current_path):
+            logger.info(f"特征仓库 {self.base_dir} 尚无快照，跳过加载。")
+            return False
+        with open(current_path, encoding="utf-8") as f:
+            snapshot_dir = os.path.join(self.base_dir, f.read().strip())
+        try:
+            with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+            dish = {name: np.load(os.path.join(snapshot_dir, f"dish__{name}.npy"), mmap_mode="r")
+                    for name in manifest["dish_columns"]}
+            user = {name: np.load(os.path.join(snapshot_dir, f"user__{name}.npy"), mmap_mode="r")
+                    for name in manifest["user_columns"]}
+        except (OSError, ValueError, KeyError) as ex:
+            logger.error(f"加载特征快照 {snapshot_dir} 失败: {ex}", exc_info=True)
+            return False
+
+        with self._lock:
+            self._dish, self._user, self.manifest = dish, user, manifest
+        logger.info(f"特征快照 {manifest['snapshot']} 已加载。")
+        return True
+
+    @property
+    def is_loaded(self) -> bool:
+        return bool(self._dish)
+
+    @staticmethod
+    def _lookup_rows(ids: np.ndarray, query: Iterable[int]) -> np.ndarray:
+        """在升序 ID 列中批量查找行号，未找到的返回 -1。"""
+        query_arr = np.asarray(list(query), dtype=np.int64)
+        if len(ids) == 0 or len(query_arr) == 0:
+            return np.full(len(query_arr), -1, dtype=np.int64)
+        rows = np.searchsorted(ids, query_arr)
+        rows_clipped = np.minimum(rows, len(ids) - 1)
+        return np.where(ids[rows_clipped] == query_arr, rows_clipped, -1)
+
+    def dish_rows(self, dish_ids: Iterable[int]) -> np.ndarray:
+        """菜品 ID -> 快照行号（未找到为 -1）。"""
+        return self._lookup_rows(self._dish.get("dish_id", np.empty(0, dtype=np.int64)), dish_ids)
+
+    def dish_features(self, dish_ids: Iterable[int], columns: List[str],
+                      fill_value: float = 0.0) -> np.ndarray:
+        """
+        批量读取菜品特征，返回形状为 (len(dish_ids), len(columns)) 的 float64 矩阵。
+        快照中不存在的菜品整行填充 fill_value。
+        """
+        rows = self.dish_rows(dish_ids)
+        found = rows >= 0
+        matrix = np.full((len(rows), len(columns)), fill_value, dtype=np.float64)
+        for j, name in enumerate(columns):
+            column = self._dish.get(name)
+            if column is not None and found.any():
+                matrix[found, j] = column[rows[found]]
+        return matrix
+
+    def user_features(self, user_id: int) -> Optional[Dict[str, float]]:
+        """读取单个用户的特征字典，用户不在快照中时返回 None。"""
+        row = int(self._lookup_rows(self._user.get("user_id", np.empty(0, dtype=np.int64)),
+                                    [user_id])[0])
+        if row < 0:
+            return None
+        return {name: column[row].item() for name, column in self._user.items()}
+
+
+# 进程内单例：首次访问时尝试加载快照，之后定期检查 CURRENT 是否指向新快照
+feature_store = FeatureStore(Config.FEATURE_STORE_DIR)
+_load_lock = threading.Lock()
+_next_check = float("-inf")
+
+
+def get_feature_store() -> FeatureStore:
+    """获取特征仓库单例；距上次检查超过 FEATURE_STORE_RELOAD_SECONDS 秒时按 CURRENT 重新加载。"""
+    global _next_check
+    if time.monotonic() >= _next_check:
+        with _load_lock:
+            if time.monotonic() >= _next_check:
+                feature_store.reload_if_changed()
+                _next_check = time.monotonic() + Config.FEATURE_STORE_RELOAD_SECONDS
+    return feature_store
+
+
+if __name__ == "__main__":
+    # 刷新任务：可由 cron / 定时任务调度执行
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        feature_store.refresh()
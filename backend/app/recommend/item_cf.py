@@ -11,11 +11,16 @@ import logging
 import numpy as np
 from sqlalchemy import text
 
+from app.config import Config
+from app.utils.cache import TTLCache
 from app.utils.db import db
 from app.recommend.time_decay import TimeDecayHelper
 
 logger = logging.getLogger(__name__)
 
+_SIMILARITY_KEY = "dish_similarity"
+_similarity_cache = TTLCache(ttl_seconds=Config.RECOMMEND_CACHE_SECONDS)
+
 
 class ItemCFRecommender:
     """基于菜品相似度为的协同过滤推荐器"""
@@ -43,18 +48,29 @@ class ItemCFRecommender:
             return set()  # 出错时返回空集合
 
     @staticmethod
-    def compute_dish_similarity():
-        """基于共同购买行为计算菜品相似度矩阵"""
+    def compute_dish_similarity(include_archive: bool = False):
+        """
+        基于共同购买行为计算菜品相似度矩阵。
+        include_archive 为 True 时同时统计已归档的历史订单（订单与其订单项总是一起归档，两段查询 UNION ALL 即可）。
+        """
         logger.info("开始计算菜品相似度矩阵...")
         try:
             # --- 修正 SQL 查询：从 order_items 获取 user_id 和 dish_id ---
             # 假设 orders 表有 order_id, user_id
             # 假设 order_items 表有 order_id, dish_id
-            query = text("""
+            sql = """
                 SELECT o.user_id, oi.dish_id
                 FROM orders o
                 JOIN order_items oi ON o.order_id = oi.order_id
-            """)
+            """
+            if include_archive:
+                sql += """
+                UNION ALL
+                SELECT o.user_id, oi.dish_id
+                FROM orders_archive o
+                JOIN order_items_archive oi ON o.order_id = oi.order_id
+                """
+            query = text(sql)
             # 使用 db.session.execute
             results = db.session.execute(query).fetchall()
             logger.info(f"从数据库获取了 {len(results)} 条用户-菜品购买记录。")
@@ -110,6 +126,10 @@ class ItemCFRecommender:
         logger.info("菜品相似度矩阵计算完成。")
         return dish_similarity
 
+    def get_dish_similarity(self):
+        """获取菜品相似度矩阵，按 RECOMMEND_CACHE_SECONDS 缓存，避免每次请求全量重算。"""
+        return _similarity_cache.get_or_load(_SIMILARITY_KEY, self.compute_dish_similarity)
+
     def recommend_by_item_similarity(self, user_id, limit=10):
         """
         注意：这里返回的是
@@ -123,7 +143,7 @@ class ItemCFRecommender:
             return []
 
         logger.info(f"用户 {user_id} 购买过的菜品: {user_dishes}")
-        dish_similarity = self.compute_dish_similarity()  # 计算或获取相似度矩阵
+        dish_similarity = self.get_dish_similarity()  # 获取（缓存的）相似度矩阵
         if not dish_similarity:
             logger.warning("无法获取菜品相似度矩阵，推荐失败。")
             return []
@@ -194,7 +214,7 @@ class ItemCFRecommender:
             logger.info(f"用户 {user_id} 无购买记录，跳过推荐。")
             return {}
 
-        dish_similarity = self.compute_dish_similarity()
+        dish_similarity = self.get_dish_similarity()
         if not dish_similarity:
             logger.warning("菜品相似度矩阵为空，跳过推荐。")
             return {}
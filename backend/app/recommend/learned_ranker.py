@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/recommend/learned_ranker.py
+@description  可选的学习排序阶段：离线在 “曝光 -> 下单” 样本上训练逻辑回归，
+              系数保存为 .npz 模型文件；请求时对融合候选池做一次向量化打分。
+              模型不可用或超出单候选耗时预算时，由调用方回退到静态权重融合。
+              曝光日志由后台线程批量写入，请求路径只做入队。
+
+              训练任务：python -m app.recommend.learned_ranker
+              各进程每 RECOMMEND_RANKER_RELOAD_SECONDS 秒检查模型文件，修改时间变化时重新加载。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.config import Config
+from app.models.enums import OrderState
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.recommend.feature_store import FeatureStore, get_feature_store
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+# 来源得分（profile / itemcf / popular）+ 特征仓库中的菜品特征
+SOURCE_FEATURES = ("profile_score", "itemcf_score", "popular_score")
+STORE_FEATURES = ("sales", "rating", "price", "pop_7d", "pop_30d", "cooc_degree")
+FEATURE_NAMES = SOURCE_FEATURES + STORE_FEATURES
+# 计数 / 金额类特征取 log1p，压缩长尾
+_LOG_FEATURES = np.array([name in ("sales", "price", "pop_7d", "pop_30d", "cooc_degree")
+                          for name in FEATURE_NAMES])
+
+
+def build_feature_matrix(dish_ids: Sequence[int],
+                         source_scores: Sequence[Dict[int, float]],
+                         store: Optional[FeatureStore] = None) -> np.ndarray:
+    """
+    为候选菜品构建特征矩阵，形状为 (len(dish_ids), len(FEATURE_NAMES))。
+    source_scores 依次对应 SOURCE_FEATURES；特征仓库未加载时菜品特征为 0。
+    """
+    n = len(dish_ids)
+    matrix = np.zeros((n, len(FEATURE_NAMES)), dtype=np.float64)
+    for j, scores in enumerate(source_scores):
+        if scores:
+            matrix[:, j] = [scores.get(dish_id, 0.0) for dish_id in dish_ids]
+    if store is not None and store.is_loaded and n:
+        matrix[:, len(SOURCE_FEATURES):] = store.dish_features(dish_ids, list(STORE_FEATURES))
+    matrix[:, _LOG_FEATURES] = np.log1p(np.maximum(matrix[:, _LOG_FEATURES], 0.0))
+    return matrix
+
+
+def train_logistic_regression(x: np.ndarray, y: np.ndarray, l2: float = 1e-3,
+                              learning_rate: float = 0.1, epochs: int = 500
+                              ) -> Dict[str, np.ndarray]:
+    """
+    批量梯度下降训练带 L2 正则的逻辑回归（特征先做标准化）。
+    返回模型参数字典：weights / bias / mean / std。
+    """
+    mean = x.mean(axis=0)
+    std = x.std(axis=0)
+    std[std == 0] = 1.0
+    xs = (x - mean) / std
+    weights = np.zeros(xs.shape[1], dtype=np.float64)
+    bias = 0.0
+    n = len(y)
+    for _ in range(epochs):
+        pred = 1.0 / (1.0 + np.exp(-(xs @ weights + bias)))
+        error = pred - y
+        weights -= learning_rate * (xs.T @ error / n + l2 * weights)
+        bias -= learning_rate * float(error.mean())
+    return {"weights": weights, "bias": np.array([bias]), "mean": mean, "std": std}
+
+
+class LearnedRanker:
+    """加载逻辑回归模型文件并对候选特征矩阵做向量化打分。"""
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self._params: Optional[Tuple[np.ndarray, float, np.ndarray, np.ndarray]] = None
+        self._loaded_mtime: Optional[int] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._params is not None
+
+    def reload_if_changed(self) -> bool:
+        """模型文件的修改时间与已加载的不同时重新加载，返回是否发生了加载。"""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is None or mtime == self._loaded_mtime:
+            return False
+        return self.load()
+
+    def load(self) -> bool:
+        """加载模型文件；文件缺失或特征定义不一致时保持当前状态（首次加载则为未就绪）。"""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            logger.info(f"排序模型 {self.model_path} 不存在，使用静态权重融合。")
+            return False
+        # 无论成功与否都记录本次尝试的文件版本，文件不变时不再重复加载
+        self._loaded_mtime = mtime
+        try:
+            with np.load(self.model_path, allow_pickle=False) as artifact:
+                feature_names = tuple(str(name) for name in artifact["feature_names"])
+                if feature_names != FEATURE_NAMES:
+                    logger.warning(f"排序模型特征 {feature_names} 与当前定义不一致，忽略该模型。")
+                    return False
+                self._params = (artifact["weights"].astype(np.float64),
+                                float(artifact["bias"][0]),
+                                artifact["mean"].astype(np.float64),
+                                artifact["std"].astype(np.float64))
+        except (OSError, KeyError, ValueError) as ex:
+            logger.error(f"加载排序模型 {self.model_path} 失败: {ex}", exc_info=True)
+            return False
+        logger.info(f"排序模型 {self.model_path} 已加载。")
+        return True
+
+    def score(self, x: np.ndarray) -> np.ndarray:
+        """单次矩阵运算为全部候选打分，返回下单概率。"""
+        weights, bias, mean, std = self._params
+        return 1.0 / (1.0 + np.exp(-(((x - mean) / std) @ weights + bias)))
+
+    def rank(self, dish_ids: Sequence[int], source_scores: Sequence[Dict[int, float]],
+             budget_us_per_candidate: float) -> Optional[List[Tuple[int, float]]]:
+        """
+        对候选池打分并排序。模型未就绪或耗时超过 budget_us_per_candidate × 候选数时返回 None，
+        由调用方回退到静态权重。
+        """
+        if not self.is_ready or not dish_ids:
+            return None
+        budget_us = budget_us_per_candidate * len(dish_ids)
+        start = time.perf_counter()
+        x = build_feature_matrix(dish_ids, source_scores, get_feature_store())
+        # 特征构建已用完预算时不再进入打分
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        if elapsed_us > budget_us:
+            logger.warning(f"排序特征构建耗时 {elapsed_us:.1f}us 超出预算 "
+                           f"({budget_us_per_candidate}us × {len(dish_ids)})，回退静态权重。")
+            return None
+        scores = self.score(x)
+        order = np.argsort(-scores, kind="stable")
+        return [(dish_ids[i], float(scores[i])) for i in order]
+
+
+# (时间戳, 用户 ID, 菜品 ID 列表, 特征矩阵)
+_Exposure = Tuple[float, int, List[int], List[List[float]]]
+
+
+class ExposureLogger:
+    """
+    将推荐曝光（用户、菜品及当时的特征）追加写入 NDJSON，作为离线训练样本来源。
+    请求路径只把记录放入有界队列；后台线程批量序列化并写文件，队列满时丢弃并记录告警。
+    """
+
+    def __init__(self, path: str, maxsize: int = 10000):
+        self.path = path
+        self._queue: "queue.Queue[_Exposure]" = queue.Queue(maxsize=maxsize)
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def log(self, user_id: int, dish_ids: Sequence[int],
+            source_scores: Sequence[Dict[int, float]]):
+        if not dish_ids:
+            return
+        features = build_feature_matrix(dish_ids, source_scores, get_feature_store())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((datetime.now(timezone.utc).timestamp(), user_id, list(dish_ids),
+                                    features.tolist()))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"推荐曝光日志队列已满，已丢弃 {self.dropped} 批曝光记录。")
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hotmeal-exposure-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # 顺带取走已积压的记录，合并为一次写入
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """同步写出队列中尚未写入的记录（进程退出时调用）。"""
+        batch: List[_Exposure] = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: List[_Exposure]):
+        lines = "".join(
+            json.dumps({"ts": ts, "user_id": user_id, "dish_id": dish_id,
+                        "features": [round(v, 6) for v in row]}) + "\n"
+            for ts, user_id, dish_ids, features in batch
+            for dish_id, row in zip(dish_ids, features))
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as ex:
+            logger.warning(f"写入推荐曝光日志失败: {ex}")
+
+
+def build_training_set(exposure_path: str, window_hours: int
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取曝光日志并打标签：曝光后 window_hours 小时内该用户下单了该菜品记为正样本。
+    返回 (特征矩阵, 标签向量)。
+    """
+    exposures = []
+    with open(exposure_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if len(record["features"]) == len(FEATURE_NAMES):
+                exposures.append(record)
+    if not exposures:
+        return np.empty((0, len(FEATURE_NAMES))), np.empty(0)
+
+    since = datetime.fromtimestamp(min(r["ts"] for r in exposures), tz=timezone.utc)
+    purchases: Dict[Tuple[int, int], List[float]] = {}
+    for user_id, dish_id, created_at in db.session.execute(
+            select(Order.user_id, OrderItem.dish_id, Order.created_at)
+            .join(OrderItem, OrderItem.order_id == Order.order_id)
+            .where(Order.created_at >= since.replace(tzinfo=None),
+                   Order.state != OrderState.CANCELED)):
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        purchases.setdefault((user_id, dish_id), []).append(created_at.timestamp())
+
+    window = timedelta(hours=window_hours).total_seconds()
+    x = np.array([r["features"] for r in exposures], dtype=np.float64)
+    y = np.array([
+        any(r["ts"] <= t <= r["ts"] + window for t in purchases.get((r["user_id"], r["dish_id"]), ()))
+        for r in exposures
+    ], dtype=np.float64)
+    return x, y
+
+
+def train_and_save(exposure_path: str = Config.RECOMMEND_EXPOSURE_LOG_PATH,
+                   model_path: str = Config.RECOMMEND_RANKER_MODEL_PATH,
+                   window_hours: int = Config.RECOMMEND_RANKER_LABEL_WINDOW_HOURS) -> bool:
+    """离线训练任务：构建样本、训练逻辑回归并写出模型文件。"""
+    if not os.path.exists(exposure_path):
+        logger.warning(f"曝光日志 {exposure_path} 不存在，无法训练排序模型。")
+        return False
+    x, y = build_training_set(exposure_path, window_hours)
+    if len(y) == 0 or y.min() == y.max():
+        logger.warning(f"训练样本不足（{len(y)} 条，正样本 {int(y.sum()) if len(y) else 0} 条），跳过训练。")
+        return False
+    params = train_logistic_regression(x, y)
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    tmp_path = model_path + ".tmp.npz"
+    np.savez(tmp_path, feature_names=np.array(FEATURE_NAMES), **params)
+    os.replace(tmp_path, model_path)
+    logger.info(f"排序模型训练完成：{len(y)} 条样本，正样本 {int(y.sum())} 条，已写入 {model_path}。")
+    return True
+
+
+# 进程内单例：首次访问时尝试加载模型，之后定期检查模型文件是否更新
+learned_ranker = LearnedRanker(Config.RECOMMEND_RANKER_MODEL_PATH)
+exposure_logger = ExposureLogger(Config.RECOMMEND_EXPOSURE_LOG_PATH)
+_load_lock = threading.Lock()
+_next_check = float("-inf")
+
+
+def get_learned_ranker() -> LearnedRanker:
+    """获取排序模型单例；距上次检查超过 RECOMMEND_RANKER_RELOAD_SECONDS 秒时按文件修改时间重新加载。"""
+    global _next_check
+    if time.monotonic() >= _next_check:
+        with _load_lock:
+            if time.monotonic() >= _next_check:
+                learned_ranker.reload_if_changed()
+                _next_check = time.monotonic() + Config.RECOMMEND_RANKER_RELOAD_SECONDS
+    return learned_ranker
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        train_and_save()
@@ -9,14 +9,19 @@
 
 import logging
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 from sqlalchemy import text
 
+from app.config import Config
+from app.utils.cache import TTLCache
 from app.utils.db import db
 
 logger = logging.getLogger(__name__)
 
+_POPULARITY_KEY = "popularity_counts"
+_popularity_cache = TTLCache(ttl_seconds=Config.RECOMMEND_CACHE_SECONDS)
+
 
 class PopularRecommender:
     """
@@ -70,16 +75,12 @@ class PopularRecommender:
             return []  # 出错时返回空列表
 
     @staticmethod
-    def get_popular_scores(limit=10) -> Dict[int, float]:
+    def load_popularity_counts() -> List[Tuple[int, float]]:
         """
-        返回过去 30 天内最受欢迎的菜品及其得分映射。
-        用途：
-        - 用于后端推荐融合排序，如在 weighted 策略中参与打分加权。
-        - 返回格式为 {dish_id: score}，适合推荐模块内部排序与融合逻辑。
-        - 不用于前端直接展示。
+        统计过去 30 天内全部菜品的订单项数量，按数量降序、dish_id 升序排列。
+        结果按 RECOMMEND_CACHE_SECONDS 缓存，融合打分时在内存中截取 Top-N。
         """
-        logger.info(f"[融合用] 获取 Top-{limit} 热门菜品打分...")
-        try:
+        def _load() -> List[Tuple[int, float]]:
             # 为提升推荐模块聚合查询性能，此处使用原生 SQL 而非 ORM 查询
             query = text("""
                 SELECT
@@ -97,10 +98,24 @@ class PopularRecommender:
                 ORDER BY
                     order_item_count DESC,
                     oi.dish_id ASC
-                LIMIT :limit
             """)
-            results = db.session.execute(query, {"limit": limit}).fetchall()
-            return {row[0]: float(row[1]) for row in results}
+            results = db.session.execute(query).fetchall()
+            return [(row[0], float(row[1])) for row in results]
+
+        return _popularity_cache.get_or_load(_POPULARITY_KEY, _load)
+
+    @staticmethod
+    def get_popular_scores(limit=10) -> Dict[int, float]:
+        """
+        返回过去 30 天内最受欢迎的菜品及其得分映射。
+        用途：
+        - 用于后端推荐融合排序，如在 weighted 策略中参与打分加权。
+        - 返回格式为 {dish_id: score}，适合推荐模块内部排序与融合逻辑。
+        - 不用于前端直接展示。
+        """
+        logger.info(f"[融合用] 获取 Top-{limit} 热门菜品打分...")
+        try:
+            return dict(PopularRecommender.load_popularity_counts()[:limit])
         except Exception as ex:
             logger.error(f"[融合用] 获取热门菜品打分出错: {ex}", exc_info=True)
             return {}
@@ -117,28 +132,14 @@ class PopularRecommender:
         """
         logger.info(f"[融合用] 获取 Top-{limit} 热门菜品归一化打分...")
         try:
-            query = text("""
-                SELECT
-                    oi.dish_id,
-                    COUNT(oi.order_item_id) AS order_item_count
-                FROM
-                    order_items oi
-                JOIN
-                    orders o ON oi.order_id = o.order_id
-                WHERE
-                    o.created_at >= DATETIME('now', '-30 days')
-                -- 注意：此处使用 SQLite 兼容写法，生产环境下如使用 MySQL，需恢复为 DATE_SUB(NOW(), INTERVAL 30 DAY)
-                GROUP BY
-                    oi.dish_id
-                ORDER BY
-                    order_item_count DESC,
-                    oi.dish_id ASC
-                LIMIT :limit
-            """)
-            results = db.session.execute(query, {"limit": limit}).fetchall()
-            raw_scores = {row[0]: float(row[1]) for row in results}
+            raw_scores = dict(PopularRecommender.load_popularity_counts()[:limit])
             total = sum(raw_scores.values()) or 1.0
             return {dish_id: score / total for dish_id, score in raw_scores.items()}
         except Exception as ex:
             logger.error(f"[融合用] 获取热门菜品归一化打分出错: {ex}", exc_info=True)
             return {}
+
+    @staticmethod
+    def invalidate():
+        """丢弃缓存的流行度统计。"""
+        _popularity_cache.invalidate(_POPULARITY_KEY)
@@ -18,6 +18,7 @@ from app.models.dish import Dish
 from app.models.order import Order
 from app.models.order_item import OrderItem
 from app.models.user import User
+from app.recommend.category_tree import category_tree_index
 from app.utils.db import db
 
 logger = logging.getLogger(__name__)
@@ -106,11 +107,16 @@ class ProfileRecommender:
 
         logger.info(f"为用户 {user_id} 根据偏好/推断菜系 '{user_preference}' 生成推荐...")
         try:
+            # 在内存中将偏好菜系展开为其自身及全部子孙分类，子分类下的菜品同样参与推荐
+            category_ids = category_tree_index.get_subtree_ids_by_name(user_preference)
+            if not category_ids:
+                logger.info(f"偏好菜系 '{user_preference}' 未匹配到任何分类，跳过基于画像的推荐。")
+                return {}
+
             stmt = (
                 select(Dish.dish_id, Dish.sales)
-                .join(Category, Dish.category_id == Category.category_id)
                 .where(
-                    Category.name == user_preference,
+                    Dish.category_id.in_(category_ids),
                     Dish.is_available.is_(True)
                 )
                 .order_by(Dish.sales.desc(), Dish.dish_id.asc())
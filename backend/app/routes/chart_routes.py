@@ -8,7 +8,9 @@
 """
 
 import logging
+from datetime import datetime
 from http import HTTPStatus
+from typing import Optional
 
 # --- 添加必要的导入 ---
 from flask import request
@@ -16,9 +18,9 @@ from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource, fields
 
 # --- 导入服务层 ---
-from app.services import chart_service
+from app.services import analytics_service, chart_service
 # --- 导入装饰器和响应工具 ---
-from app.utils.decorators import log_request, timing  # 移除 require_roles (如果不需要)
+from app.utils.decorators import log_request, require_roles, timing
 from app.utils.response import success, bad_request
 
 # --- 导入模型枚举（如果需要权限检查）---
@@ -54,6 +56,8 @@ class SalesRanking(Resource):
 
     @chart_ns.doc('get_sales_ranking', security='jsonWebToken')
     @chart_ns.param('limit', '返回排行的数量', type=int, default=10, location='args')
+    @chart_ns.param('include_archive', '是否统计已归档的历史订单 (true/false)', type=bool, default=False,
+                    location='args')
     @chart_ns.response(HTTPStatus.OK, '成功获取销售排行', sales_ranking_output_model)
     @chart_ns.response(HTTPStatus.BAD_REQUEST, '无效的 limit 参数')
     @chart_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
@@ -75,6 +79,87 @@ class SalesRanking(Resource):
         logger.info(f"请求销量排行榜，limit={limit}")
 
         # 调用服务层获取数据 (依赖全局错误处理)
-        ranking_data = chart_service.get_sales_ranking(limit=limit)
+        include_archive = request.args.get('include_archive', 'false').lower() == 'true'
+        ranking_data = chart_service.get_sales_ranking(limit=limit, include_archive=include_archive)
 
         return success(message="成功获取销量排行榜", data={"ranking": ranking_data})
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _analytics_args():
+    """解析经营分析的公共参数，返回 (start, end, include_archive)；时间格式无效时抛出 ValueError。"""
+    return (_parse_time(request.args.get('start')), _parse_time(request.args.get('end')),
+            request.args.get('include_archive', 'false').lower() == 'true')
+
+
+def _analytics_params(func):
+    func = chart_ns.param('start', '下单时间下限 (含)，ISO 格式，如 2025-05-01', type=str, location='args')(func)
+    func = chart_ns.param('end', '下单时间上限 (不含)，ISO 格式，如 2025-06-01', type=str, location='args')(func)
+    return chart_ns.param('include_archive', '是否统计已归档的历史订单 (true/false)', type=bool,
+                          default=False, location='args')(func)
+
+
+@chart_ns.route('/revenue')
+class Revenue(Resource):
+    method_decorators = [log_request, timing, jwt_required()]
+
+    @chart_ns.doc('get_revenue', security='jsonWebToken')
+    @chart_ns.param('group_by', '分组方式: day / hour / area / payment_method', type=str, default='day',
+                    location='args')
+    @_analytics_params
+    @chart_ns.response(HTTPStatus.OK, '成功获取营收统计 (列式数据)')
+    @chart_ns.response(HTTPStatus.BAD_REQUEST, '参数无效')
+    @chart_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def get(self):
+        """按日 / 小时 / 用餐区域 / 支付方式统计营收与客单价 (仅管理员/员工)"""
+        try:
+            start, end, include_archive = _analytics_args()
+        except ValueError:
+            return bad_request("start / end 必须是 ISO 格式的日期或时间。")
+        data = analytics_service.revenue(request.args.get('group_by', 'day').lower(), start=start, end=end,
+                                         include_archive=include_archive)
+        return success(message="成功获取营收统计", data=data)
+
+
+@chart_ns.route('/order-value')
+class OrderValue(Resource):
+    method_decorators = [log_request, timing, jwt_required()]
+
+    @chart_ns.doc('get_order_value', security='jsonWebToken')
+    @_analytics_params
+    @chart_ns.response(HTTPStatus.OK, '成功获取客单价')
+    @chart_ns.response(HTTPStatus.BAD_REQUEST, '参数无效')
+    @chart_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def get(self):
+        """时间范围内的订单数、营收与客单价 (仅管理员/员工)"""
+        try:
+            start, end, include_archive = _analytics_args()
+        except ValueError:
+            return bad_request("start / end 必须是 ISO 格式的日期或时间。")
+        data = analytics_service.order_value(start=start, end=end, include_archive=include_archive)
+        return success(message="成功获取客单价", data=data)
+
+
+@chart_ns.route('/item-mix')
+class ItemMix(Resource):
+    method_decorators = [log_request, timing, jwt_required()]
+
+    @chart_ns.doc('get_item_mix', security='jsonWebToken')
+    @_analytics_params
+    @chart_ns.response(HTTPStatus.OK, '成功获取分类销售构成 (列式数据)')
+    @chart_ns.response(HTTPStatus.BAD_REQUEST, '参数无效')
+    @chart_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def get(self):
+        """按菜品分类统计销量与销售额占比 (仅管理员/员工)"""
+        try:
+            start, end, include_archive = _analytics_args()
+        except ValueError:
+            return bad_request("start / end 必须是 ISO 格式的日期或时间。")
+        data = analytics_service.item_mix(start=start, end=end, include_archive=include_archive)
+        return success(message="成功获取分类销售构成", data=data)
@@ -15,7 +15,7 @@ from flask_jwt_extended import jwt_required  # 导入需要的功能
 from flask_restx import Namespace, Resource, fields
 
 # 导入重构后的服务层模块
-from app.services import dish_service
+from app.services import dish_service, stock_shard_service
 # 导入装饰器和响应工具
 from app.utils.decorators import require_roles, log_request, timing
 from app.utils.response import success, created, no_content, bad_request  # 导入需要的响应函数
@@ -80,6 +80,7 @@ dish_output_model = dish_ns.model('DishOutput', {
     'category_id': fields.Integer(description='分类 ID'),
     'category_name': fields.String(description='分类名称'),  # 从 serialize_dish 添加
     'is_available': fields.Boolean(description='是否上架'),
+    'stock_shards': fields.Integer(description='库存分片数 (0 表示不分片)'),
     'created_at': fields.DateTime(description='创建时间 (ISO 格式)'),
     'updated_at': fields.DateTime(description='更新时间 (ISO 格式)'),
     # 'deleted_at': fields.DateTime(description='删除时间 (ISO 格式)', readonly=True, nullable=True) # 如果有软删除
@@ -248,3 +249,41 @@ class DishAvailability(Resource):
         action = "上架" if is_available else "下架"
         logger.info(f"管理员将菜品 {dish_id} 设置为 {action} 状态。")
         return success(message=f"菜品已成功{action}")
+
+
+# --- 额外的管理接口：热门菜品库存分片 ---
+@dish_ns.route("/<int:dish_id>/stock-shards")
+@dish_ns.param('dish_id', '菜品 ID')
+class DishStockShards(Resource):
+
+    @dish_ns.doc('enable_dish_stock_shards', security='jsonWebToken')
+    @dish_ns.expect(dish_ns.model('SetStockShardsInput', {
+        'shards': fields.Integer(required=True, description='分片数 (1-64)', min=1, max=64, example=8)
+    }), validate=True)
+    @dish_ns.response(HTTPStatus.OK, '库存分片设置成功')
+    @dish_ns.response(HTTPStatus.BAD_REQUEST, '输入参数无效')
+    @dish_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
+    @dish_ns.response(HTTPStatus.FORBIDDEN, '需要管理员权限')
+    @dish_ns.response(HTTPStatus.NOT_FOUND, '菜品未找到')
+    @jwt_required()
+    @require_roles(["admin"])  # 仅管理员可操作
+    @log_request
+    @timing
+    def put(self, dish_id):
+        """开启或调整菜品的库存分片，现有库存平均拆分到各分片 (仅管理员)"""
+        result = stock_shard_service.enable_sharding(dish_id, request.get_json().get('shards'))
+        return success(message="库存分片设置成功", data=result)
+
+    @dish_ns.doc('disable_dish_stock_shards', security='jsonWebToken')
+    @dish_ns.response(HTTPStatus.OK, '库存分片已关闭')
+    @dish_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
+    @dish_ns.response(HTTPStatus.FORBIDDEN, '需要管理员权限')
+    @dish_ns.response(HTTPStatus.NOT_FOUND, '菜品未找到')
+    @jwt_required()
+    @require_roles(["admin"])  # 仅管理员可操作
+    @log_request
+    @timing
+    def delete(self, dish_id):
+        """关闭菜品的库存分片，分片库存合计写回菜品 (仅管理员)"""
+        result = stock_shard_service.disable_sharding(dish_id)
+        return success(message="库存分片已关闭", data=result)
@@ -5,8 +5,15 @@
 @Desc       : Health check related APIs
 """
 
+from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource
 
+from app.services import order_expiry_service
+from app.utils import replica
+from app.utils.db import db
+from app.utils.decorators import require_roles
+from app.utils.warmup import is_ready
+
 api = Namespace('health', description='Health check related APIs')
 
 
@@ -19,3 +26,38 @@ class Health(Resource):
             'status': 'ok',
             'message': 'Service is running'
         }
+
+
+@api.route('/ready')
+class Readiness(Resource):
+    @api.doc('Readiness check', responses={200: 'Ready', 503: 'Warming up'})
+    def get(self):
+        """Readiness endpoint: returns 503 until startup warm-up has finished"""
+        if not is_ready():
+            return {
+                'status': 'warming',
+                'message': 'Service is warming up'
+            }, 503
+        return {
+            'status': 'ready',
+            'message': 'Service is ready'
+        }
+
+
+@api.route('/order-expiry')
+class OrderExpiryMetrics(Resource):
+    method_decorators = [jwt_required()]
+
+    @api.doc('Order expiry sweeper metrics', security='jsonWebToken')
+    @require_roles(["admin"])
+    def get(self):
+        """Cumulative metrics of the stale PENDING order sweeper in this process (admin only)"""
+        return order_expiry_service.stats()
+
+
+@api.route('/replicas')
+class ReplicaMetrics(Resource):
+    @api.doc('Read replica lag')
+    def get(self):
+        """Lag of each configured read replica and how often reads fell back to the primary"""
+        return replica.stats(db.engines)
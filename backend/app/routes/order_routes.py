@@ -8,16 +8,19 @@
 """
 
 import logging
+from datetime import datetime
 from http import HTTPStatus
+from typing import Optional
 
-from flask import request
+from flask import Response, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt  # 导入 get_jwt
 from flask_restx import Namespace, Resource, fields
 
+from app.config import Config
 # 导入模型枚举，用于权限检查
 from app.models.enums import UserRole
 # 导入重构后的服务层模块
-from app.services import order_service
+from app.services import idempotency_service, kitchen_feed_service, order_service, user_summary_service
 # 导入装饰器和响应工具
 from app.utils.decorators import require_roles, log_request, timing
 # 导入错误码和异常 (供参考)
@@ -60,7 +63,8 @@ order_update_model = order_ns.model('OrderUpdateInput', {
 order_item_output_model = order_ns.model('OrderItemOutput', {
     'order_item_id': fields.Integer(description='订单项 ID'),
     'dish_id': fields.Integer(description='菜品 ID'),
-    'dish_name': fields.String(description='菜品名称'),
+    'dish_name': fields.String(description='菜品名称 (下单时快照)'),
+    'dish_image_url': fields.String(description='菜品图片 (下单时快照)', allow_null=True),
     'quantity': fields.Integer(description='数量'),
     'unit_price': fields.String(description='下单时单价 (字符串)'),
     'total': fields.String(description='该项总价 (字符串)')
@@ -99,6 +103,70 @@ order_list_output_model = order_ns.model('OrderListOutput', {
     'total_pages': fields.Integer(description='总页数')
 })
 
+# 游标分页输出模型
+order_cursor_page_model = order_ns.model('OrderCursorPage', {
+    'items': fields.List(fields.Nested(order_output_model)),
+    'per_page': fields.Integer(description='每页数量'),
+    'next_cursor': fields.String(description='下一页游标，为空表示没有更多数据', allow_null=True),
+    'estimated_total': fields.Integer(description='订单总数 (缓存值，可能略有滞后)')
+})
+
+# 批量状态转换输入模型
+order_bulk_transition_model = order_ns.model('OrderBulkTransitionInput', {
+    'order_ids': fields.List(fields.Integer, required=True, description='订单 ID 列表',
+                             example=[101, 102, 103]),
+    'state': fields.String(required=True, description='目标状态 (例如: PAID, COMPLETED)',
+                           example='COMPLETED')
+})
+
+# 批量下单的子订单输入模型
+sub_order_input_model = order_ns.model('SubOrderInput', {
+    'user_id': fields.Integer(description='下单用户 ID (可选，默认当前用户；仅管理员/员工可为他人下单)',
+                              example=2),
+    'area_id': fields.Integer(description='用餐区域 ID (可选，默认使用批量请求的 area_id)', example=1),
+    'dish_list': fields.List(fields.Nested(dish_item_input_model), required=True,
+                             description='订购的菜品列表 (至少包含一项)')
+})
+
+# 批量下单输入模型
+order_batch_create_model = order_ns.model('OrderBatchCreateInput', {
+    'sub_orders': fields.List(fields.Nested(sub_order_input_model), required=True,
+                              description='子订单列表 (如宴会每位客人一单)'),
+    'area_id': fields.Integer(description='默认用餐区域 ID (可选)', example=1),
+    'atomic': fields.Boolean(description='任一子订单失败时整体回滚 (默认 false：只跳过失败的子订单)',
+                             default=False)
+})
+
+# 批量取消输入模型
+order_bulk_cancel_model = order_ns.model('OrderBulkCancelInput', {
+    'order_ids': fields.List(fields.Integer, description='订单 ID 列表 (与 area_id 二选一)',
+                             example=[101, 102, 103]),
+    'area_id': fields.Integer(description='取消该用餐区域下全部待支付订单 (与 order_ids 二选一)',
+                              example=1)
+})
+
+# 批量操作上限
+MAX_BULK_ORDER_IDS = 500
+
+# 批量下单的子订单数上限
+MAX_BATCH_SUB_ORDERS = 50
+
+# 游标分页每页数量上限
+MAX_CURSOR_PAGE_SIZE = 100
+
+
+def _parse_cursor_page_size(default: int = 10) -> int:
+    """解析游标分页的 per_page 参数。"""
+    try:
+        per_page = int(request.args.get('per_page', default))
+    except ValueError:
+        raise ValidationError("每页数量参数必须是整数。", error_code=ErrorCode.PARAM_INVALID.value)
+    if per_page <= 0 or per_page > MAX_CURSOR_PAGE_SIZE:
+        raise ValidationError(f"每页数量必须在 1-{MAX_CURSOR_PAGE_SIZE} 之间。",
+                              error_code=ErrorCode.PARAM_INVALID.value)
+    return per_page
+
+
 
 # --- 路由 ---
 
@@ -112,6 +180,13 @@ class UserOrderList(Resource):
     @order_ns.doc('get_my_orders', security='jsonWebToken')
     @order_ns.param('include_items', '是否包含订单项详情 (true/false)', type=bool, default=False,
                     location='args')
+    @order_ns.param('cursor', '游标分页：首页传空值，之后传上一页的 next_cursor；不传则返回全部订单',
+                    type=str, location='args')
+    @order_ns.param('per_page', '游标分页每页数量', type=int, default=10, location='args')
+    @order_ns.param('summary', '汇总模式 (true/false)：只返回订单数、累计消费、最近下单时间与常点菜品',
+                    type=bool, default=False, location='args')
+    @order_ns.param('include_archive', '是否包含已归档的历史订单 (true/false，不支持游标分页)', type=bool,
+                    default=False, location='args')
     @order_ns.response(HTTPStatus.OK, '成功获取我的订单列表', [order_output_model])
     @order_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
     @order_ns.response(HTTPStatus.INTERNAL_SERVER_ERROR, '获取订单失败')
@@ -122,12 +197,25 @@ class UserOrderList(Resource):
         except (ValueError, TypeError):
             return unauthorized("无效的用户身份令牌。")
 
+        if request.args.get('summary', 'false').lower() == 'true':
+            return success(message="成功获取我的订单汇总", data=user_summary_service.get_summary(current_user_id))
+
         include_items_str = request.args.get('include_items', 'false').lower()
         include_items = include_items_str == 'true'
 
+        if 'cursor' in request.args:
+            page_data = order_service.list_orders_keyset(
+                limit=_parse_cursor_page_size(),
+                cursor=request.args.get('cursor'),
+                include_items=include_items,
+                user_id=current_user_id
+            )
+            return success(message="成功获取我的订单列表", data=page_data)
+
         orders_data = order_service.get_orders_by_user(
             user_id=current_user_id,
-            include_items=include_items
+            include_items=include_items,
+            include_archive=request.args.get('include_archive', 'false').lower() == 'true'
         )
         return success(message="成功获取我的订单列表", data=orders_data)
 
@@ -138,6 +226,7 @@ class OrderList(Resource):
     method_decorators = [log_request, timing]  # 应用于类中的所有方法
 
     @order_ns.doc('create_order', security='jsonWebToken')
+    @order_ns.header('Idempotency-Key', '幂等键 (可选，最长 64 字符)：重复提交返回首次创建的订单')
     @order_ns.expect(order_create_model, validate=True)
     @order_ns.response(HTTPStatus.CREATED, '订单创建成功', order_output_model)
     @order_ns.response(HTTPStatus.BAD_REQUEST, '输入参数无效',
@@ -161,10 +250,24 @@ class OrderList(Resource):
         dish_list = data.get("dish_list", [])
         area_id = data.get("area_id")
 
+        # 幂等键：同一用户重复提交时直接返回首次结果，不再访问菜品和订单表
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip() or None
+        request_hash = None
+        if idempotency_key:
+            if len(idempotency_key) > idempotency_service.MAX_KEY_LENGTH:
+                return bad_request(f"Idempotency-Key 长度不能超过 {idempotency_service.MAX_KEY_LENGTH} 个字符。")
+            request_hash = idempotency_service.hash_request(data)
+            replay = idempotency_service.find_response(current_user_id, idempotency_key, request_hash)
+            if replay is not None:
+                headers = {"Location": f"/orders/{replay.get('order_id')}", "Idempotent-Replayed": "true"}
+                return created(data=replay, message="订单创建成功", headers=headers)
+
         new_order_data = order_service.create_order(
             user_id=current_user_id,
             dish_list=dish_list,
-            area_id=area_id
+            area_id=area_id,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash
         )
 
         logger.info(f"用户 {current_user_id} 创建订单成功: ID={new_order_data.get('order_id')}")
@@ -177,6 +280,8 @@ class OrderList(Resource):
     @order_ns.param('per_page', '每页数量', type=int, default=10, location='args')
     @order_ns.param('include_items', '是否包含订单项详情', type=bool, default=False,
                     location='args')
+    @order_ns.param('cursor', '游标分页：首页传空值，之后传上一页的 next_cursor (传入时忽略 page)',
+                    type=str, location='args')
     @order_ns.response(HTTPStatus.OK, '成功获取订单列表 (分页)', order_list_output_model)
     @order_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
     @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
@@ -185,6 +290,16 @@ class OrderList(Resource):
     @require_roles(["admin", "staff"])
     def get(self):
         """获取所有订单的分页列表 (仅管理员/员工)"""
+        include_items = request.args.get('include_items', 'false').lower() == 'true'
+        if 'cursor' in request.args:
+            # 游标分页：不执行 COUNT / OFFSET，任意深度都只扫描一页数据
+            page_data = order_service.list_orders_keyset(
+                limit=_parse_cursor_page_size(),
+                cursor=request.args.get('cursor'),
+                include_items=include_items
+            )
+            return success(message="成功获取订单列表", data=page_data)
+
         try:
             page = int(request.args.get('page', 1))
             per_page = int(request.args.get('per_page', 10))
@@ -195,9 +310,6 @@ class OrderList(Resource):
         except ValidationError as ve:  # 捕获自己抛出的 ValidationError
             return bad_request(ve.message, error_code=ve.error_code)
 
-        include_items_str = request.args.get('include_items', 'false').lower()
-        include_items = include_items_str == 'true'
-
         try:
             logger.info(
                 f"📥 list_all_orders called, page={page}, per_page={per_page}, include_items={include_items}")
@@ -212,6 +324,202 @@ class OrderList(Resource):
                                 error_code=ErrorCode.HTTP_INTERNAL_SERVER_ERROR)
 
 
+@order_ns.route("/batch")
+class OrderBatchCreate(Resource):
+    """批量下单 (团餐 / 宴会)"""
+    method_decorators = [jwt_required(), log_request, timing]
+
+    @order_ns.doc('create_orders_batch', security='jsonWebToken')
+    @order_ns.header('Idempotency-Key', '幂等键 (可选，最长 64 字符)：重复提交返回首次的批量结果')
+    @order_ns.expect(order_batch_create_model, validate=True)
+    @order_ns.response(HTTPStatus.CREATED, '批量下单完成 (返回每个子订单的结果)')
+    @order_ns.response(HTTPStatus.OK, '没有创建任何订单 (全部子订单失败)')
+    @order_ns.response(HTTPStatus.BAD_REQUEST, '输入参数无效')
+    @order_ns.response(HTTPStatus.CONFLICT, 'atomic 模式下有子订单无法创建')
+    @require_roles(["admin", "staff", "user"])
+    def post(self):
+        """在一个事务中创建多个子订单，共享菜品加载并批量插入 (atomic=false 时逐个返回成功或失败)"""
+        data = request.get_json()
+        try:
+            current_user_id = int(get_jwt_identity())
+            current_user_role = get_jwt().get("role")
+            if not current_user_role:
+                raise AuthorizationError("无法获取用户角色信息。")
+        except (ValueError, TypeError, AuthorizationError):
+            return unauthorized("无效的用户令牌或角色信息。")
+
+        sub_orders = data.get('sub_orders') or []
+        if not sub_orders:
+            return bad_request("sub_orders 不能为空。")
+        if len(sub_orders) > MAX_BATCH_SUB_ORDERS:
+            return bad_request(f"单次最多提交 {MAX_BATCH_SUB_ORDERS} 个子订单。")
+
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip() or None
+        request_hash = None
+        if idempotency_key:
+            if len(idempotency_key) > idempotency_service.MAX_KEY_LENGTH:
+                return bad_request(f"Idempotency-Key 长度不能超过 {idempotency_service.MAX_KEY_LENGTH} 个字符。")
+            request_hash = idempotency_service.hash_request(data)
+            replay = idempotency_service.find_response(current_user_id, idempotency_key, request_hash)
+            if replay is not None:
+                return created(data=replay, message="批量下单完成", headers={"Idempotent-Replayed": "true"})
+
+        result = order_service.create_orders_batch(
+            operator_id=current_user_id,
+            operator_role=current_user_role,
+            sub_orders=sub_orders,
+            area_id=data.get('area_id'),
+            atomic=bool(data.get('atomic', False)),
+            idempotency_key=idempotency_key,
+            request_hash=request_hash
+        )
+        if not result["created"]:
+            return success(message="批量下单未创建任何订单", data=result)
+        return created(data=result, message="批量下单完成")
+
+
+@order_ns.route("/export")
+class OrderExport(Resource):
+    """流式导出订单 (财务对账)"""
+    method_decorators = [jwt_required(), log_request, timing]
+
+    @order_ns.doc('export_orders', security='jsonWebToken')
+    @order_ns.param('format', '导出格式: csv (每个订单项一行) / ndjson (每个订单一行)', type=str,
+                    default='csv', location='args')
+    @order_ns.param('start', '创建时间下限 (含)，ISO 格式，如 2025-05-01', type=str, location='args')
+    @order_ns.param('end', '创建时间上限 (不含)，ISO 格式，如 2025-06-01', type=str, location='args')
+    @order_ns.param('state', '订单状态过滤 (可选)', type=str, location='args')
+    @order_ns.response(HTTPStatus.OK, '导出文件流')
+    @order_ns.response(HTTPStatus.BAD_REQUEST, '参数无效')
+    @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def get(self):
+        """按时间范围和状态流式导出订单及订单项 (仅管理员/员工)"""
+        fmt = request.args.get('format', 'csv').lower()
+        try:
+            start = _parse_export_time(request.args.get('start'))
+            end = _parse_export_time(request.args.get('end'))
+        except ValueError:
+            return bad_request("start / end 必须是 ISO 格式的日期或时间。")
+
+        chunks = order_service.export_orders(fmt, start=start, end=end,
+                                             state=request.args.get('state'))
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        filename = f"orders_{start.date() if start else 'all'}_{end.date() if end else 'now'}.{fmt}"
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+def _parse_export_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+@order_ns.route("/bulk-transition")
+class OrderBulkTransition(Resource):
+    """批量状态转换"""
+    method_decorators = [jwt_required(), log_request, timing]
+
+    @order_ns.doc('bulk_transition_orders', security='jsonWebToken')
+    @order_ns.expect(order_bulk_transition_model, validate=True)
+    @order_ns.response(HTTPStatus.OK, '批量转换完成 (返回成功与跳过的订单)')
+    @order_ns.response(HTTPStatus.BAD_REQUEST, '输入参数无效')
+    @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def post(self):
+        """将一批订单转换到目标状态，单条条件 UPDATE 完成 (仅管理员/员工)"""
+        data = request.get_json()
+        order_ids = data.get('order_ids') or []
+        if not order_ids:
+            return bad_request("order_ids 不能为空。")
+        if len(order_ids) > MAX_BULK_ORDER_IDS:
+            return bad_request(f"单次最多处理 {MAX_BULK_ORDER_IDS} 个订单。")
+
+        result = order_service.bulk_transition_orders(order_ids, data.get('state'))
+        return success(message="批量更新订单状态完成", data=result)
+
+
+@order_ns.route("/bulk-cancel")
+class OrderBulkCancel(Resource):
+    """批量取消订单"""
+    method_decorators = [jwt_required(), log_request, timing]
+
+    @order_ns.doc('bulk_cancel_orders', security='jsonWebToken')
+    @order_ns.expect(order_bulk_cancel_model, validate=True)
+    @order_ns.response(HTTPStatus.OK, '批量取消完成 (返回已取消与跳过的订单)')
+    @order_ns.response(HTTPStatus.BAD_REQUEST, '输入参数无效')
+    @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def post(self):
+        """批量取消待支付订单并以集合操作恢复库存 (仅管理员/员工)"""
+        data = request.get_json()
+        order_ids = data.get('order_ids') or []
+        area_id = data.get('area_id')
+        if not order_ids and area_id is None:
+            return bad_request("order_ids 与 area_id 至少提供一个。")
+        if len(order_ids) > MAX_BULK_ORDER_IDS:
+            return bad_request(f"单次最多处理 {MAX_BULK_ORDER_IDS} 个订单。")
+
+        result = order_service.cancel_orders_bulk(order_ids=order_ids, area_id=area_id)
+        return success(message="批量取消订单完成", data=result)
+
+
+def _parse_kitchen_cursor(value: Optional[str]) -> Optional[int]:
+    """解析看板游标 (Last-Event-ID 请求头或 after 参数)，无效时按首次连接处理。"""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+# 浏览器 EventSource 无法设置请求头，SSE 推送额外接受 ?jwt=<access_token> 查询参数
+KITCHEN_STREAM_TOKEN_LOCATIONS = ["headers", "query_string"]
+
+
+@order_ns.route("/kitchen/stream")
+class KitchenStream(Resource):
+    """后厨看板 SSE 推送"""
+    method_decorators = [jwt_required(locations=KITCHEN_STREAM_TOKEN_LOCATIONS), log_request]
+
+    @order_ns.doc('kitchen_stream', security='jsonWebToken')
+    @order_ns.param('jwt', '访问令牌；EventSource 无法携带 Authorization 请求头时使用', location='args')
+    @order_ns.header('Last-Event-ID', '断线重连时由浏览器自动携带，补发之后的消息')
+    @order_ns.response(HTTPStatus.OK, 'text/event-stream：snapshot 为待制作队列快照，order 为订单状态变化')
+    @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"], locations=KITCHEN_STREAM_TOKEN_LOCATIONS)
+    def get(self):
+        """
+        以 Server-Sent Events 推送已支付订单及订单状态变化 (仅管理员/员工)。
+        令牌可放在 Authorization 请求头或 jwt 查询参数中 (new EventSource('.../kitchen/stream?jwt=<token>'))。
+        消息只来自本进程提交的事务：多进程部署时需将看板请求路由到同一进程，否则会漏掉其他进程的订单变化。
+        """
+        after_seq = _parse_kitchen_cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+        chunks = kitchen_feed_service.stream(after_seq, Config.KITCHEN_FEED_HEARTBEAT_SECONDS)
+        return Response(stream_with_context(chunks), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@order_ns.route("/kitchen/events")
+class KitchenEvents(Resource):
+    """后厨看板长轮询"""
+    method_decorators = [jwt_required(), log_request]
+
+    @order_ns.doc('kitchen_events', security='jsonWebToken')
+    @order_ns.param('after', '上次返回的 last_seq；不传则返回待制作队列快照', type=int, location='args')
+    @order_ns.param('timeout', '最长等待秒数', type=int, location='args')
+    @order_ns.response(HTTPStatus.OK, '快照或 after 之后的订单状态变化')
+    @order_ns.response(HTTPStatus.FORBIDDEN, '需要管理员或员工权限')
+    @require_roles(["admin", "staff"])
+    def get(self):
+        """长轮询获取已支付订单及订单状态变化，无新消息时最多等待 timeout 秒 (仅管理员/员工；同样仅限本进程)"""
+        try:
+            timeout = int(request.args.get('timeout', Config.KITCHEN_FEED_HEARTBEAT_SECONDS))
+        except ValueError:
+            return bad_request("timeout 必须是整数。")
+        timeout = max(0, min(timeout, Config.KITCHEN_FEED_HEARTBEAT_SECONDS))
+        data = kitchen_feed_service.poll(_parse_kitchen_cursor(request.args.get('after')), timeout)
+        return success(message="成功获取后厨看板消息", data=data)
+
+
 @order_ns.route("/<int:order_id>")
 @order_ns.param('order_id', '订单 ID')
 @order_ns.response(HTTPStatus.NOT_FOUND, '订单未找到')
@@ -221,6 +529,7 @@ class OrderDetail(Resource):
 
     @order_ns.doc('get_order_detail', security='jsonWebToken')
     @order_ns.param('include_items', '是否包含订单项详情', type=bool, default=True, location='args')
+    @order_ns.param('include_archive', '是否查找已归档的历史订单', type=bool, default=False, location='args')
     @order_ns.response(HTTPStatus.OK, '成功获取订单详情', order_output_model)
     @order_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证')
     @order_ns.response(HTTPStatus.FORBIDDEN, '无权查看此订单')
@@ -233,7 +542,8 @@ class OrderDetail(Resource):
 
         order_data = order_service.get_order_by_id(
             order_id=order_id,  # 使用传入的 order_id
-            include_items=include_items
+            include_items=include_items,
+            include_archive=request.args.get('include_archive', 'false').lower() == 'true'
         )
         return success(message="成功获取订单详情", data=order_data)
 
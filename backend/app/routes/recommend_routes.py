@@ -16,7 +16,7 @@ from flask_restx import Namespace, Resource, fields
 from app.services.recommend_service import RecommendationService
 
 from app.utils.decorators import log_request, timing
-from app.utils.response import success, unauthorized
+from app.utils.response import success, unauthorized, bad_request
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +39,27 @@ recommendation_output_model = recommend_ns.model('RecommendationOutput', {
                                    description='推荐的菜品列表')
 })
 
+basket_input_model = recommend_ns.model('BasketAddonInput', {
+    'dish_ids': fields.List(fields.Integer, required=True, description='购物车中的菜品 ID 列表',
+                            example=[1, 3]),
+    'limit': fields.Integer(description='返回的加购推荐数量上限', example=5)
+})
+
+basket_addon_item_model = recommend_ns.model('BasketAddonItem', {
+    'dish_id': fields.Integer(description='推荐加购的菜品 ID', example=7),
+    'dish_name': fields.String(description='菜品名称', example='酸梅汤'),
+    'price': fields.String(description='菜品价格 (字符串)', example='8.00'),
+    'image_url': fields.String(description='菜品图片', allow_null=True),
+    'score': fields.Float(description='综合得分 (命中规则的置信度之和)', example=0.62),
+    'confidence': fields.Float(description='最大置信度 P(加购菜品|购物车菜品)', example=0.45),
+    'lift': fields.Float(description='最大提升度', example=2.3)
+})
+
+basket_addon_output_model = recommend_ns.model('BasketAddonOutput', {
+    'recommendations': fields.List(fields.Nested(basket_addon_item_model),
+                                   description='经常一起点的加购菜品列表')
+})
+
 
 # --- 路由 ---
 @recommend_ns.route("/")
@@ -114,3 +135,27 @@ class GetRecommendations(Resource):
 
         return success(message="成功获取推荐列表",
                        data={"recommendations": recommendations_list})
+
+
+@recommend_ns.route("/basket")
+class BasketAddonRecommendations(Resource):
+    method_decorators = [jwt_required(), log_request, timing]
+
+    @recommend_ns.doc('get_basket_addons', security='jsonWebToken')
+    @recommend_ns.expect(basket_input_model, validate=True)
+    @recommend_ns.response(HTTPStatus.OK, '成功获取加购推荐', basket_addon_output_model)
+    @recommend_ns.response(HTTPStatus.BAD_REQUEST, '请求参数错误')
+    @recommend_ns.response(HTTPStatus.UNAUTHORIZED, '需要认证或令牌无效')
+    def post(self):
+        """根据购物车中的菜品推荐“经常一起点”的加购菜品"""
+        data = request.get_json() or {}
+        dish_ids = data.get('dish_ids') or []
+        if not isinstance(dish_ids, list) or not all(isinstance(d, int) and not isinstance(d, bool) for d in dish_ids):
+            return bad_request("dish_ids 必须是整数列表。")
+
+        limit = data.get('limit')
+        if limit is not None and (not isinstance(limit, int) or limit <= 0):
+            return bad_request("limit 必须是正整数。")
+
+        addons = recommender.recommend_basket_addons(dish_ids, limit)
+        return success(message="成功获取加购推荐", data={"recommendations": addons})
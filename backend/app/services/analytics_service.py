@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/analytics_service.py
+@description  订单经营分析：营收（按日 / 小时 / 用餐区域 / 支付方式分组）、客单价与分类销售构成。
+              全部在数据库内 GROUP BY 聚合，分组结果以列式返回（每个字段一个等长列表）。
+
+              - 统计口径与销量排行一致：已支付 / 已完成且未删除的订单，下单时间落在 [start, end)；
+                按日 / 小时分桶使用数据库中存储的 created_at（不做时区换算）；
+              - 结果按 (查询, 分组, 时间范围, 是否含归档) 缓存 ANALYTICS_CACHE_SECONDS 秒。本进程提交的
+                订单事件使订单进入或离开统计口径（支付、完成、已支付订单改价或取消等）时，
+                只失效时间范围覆盖该订单下单时间的缓存；其他进程的变更在缓存过期后生效。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import desc, func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import Config
+from app.models.category import Category
+from app.models.dining_area import DiningArea
+from app.models.dish import Dish
+from app.models.enums import OrderEventType, OrderState
+from app.services.order_archive_service import order_items_source, orders_source
+from app.services.order_event_service import on_commit
+from app.utils.cache import TTLCache
+from app.utils.db import db, read_only
+from app.utils.error_codes import ErrorCode
+from app.utils.exceptions import APIException, ValidationError
+from app.utils.money import format_cents, from_cents, to_cents
+
+logger = logging.getLogger(__name__)
+
+COUNTED_STATES = (OrderState.PAID, OrderState.COMPLETED)
+REVENUE_GROUPINGS = ("day", "hour", "area", "payment_method")
+_COUNTED_STATE_NAMES = frozenset(state.name for state in COUNTED_STATES)
+_BUCKET_FORMATS = {"day": "%Y-%m-%d", "hour": "%Y-%m-%d %H:00"}
+
+# {(query, group_by, start, end, include_archive): 结果}
+_cache = TTLCache(ttl_seconds=Config.ANALYTICS_CACHE_SECONDS, maxsize=1000)
+_last_invalidated = float("-inf")
+
+
+def _normalize(value: Optional[datetime]) -> Optional[datetime]:
+    """带时区的时间换算为不带时区的 UTC，便于与数据库时间及缓存键比较。"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _time_bucket(column, group_by: str):
+    fmt = _BUCKET_FORMATS[group_by]
+    if db.engine.dialect.name == "sqlite":
+        return func.strftime(fmt, column)
+    return func.date_format(column, fmt)
+
+
+def _counted_conditions(orders, start: Optional[datetime], end: Optional[datetime]) -> List[Any]:
+    conditions = [orders.c.state.in_(COUNTED_STATES), orders.c.deleted_at.is_(None)]
+    if start is not None:
+        conditions.append(orders.c.created_at >= start)
+    if end is not None:
+        conditions.append(orders.c.created_at < end)
+    return conditions
+
+
+def _average_cents(revenue_cents: int, order_count: int) -> int:
+    return to_cents(from_cents(revenue_cents) / order_count) if order_count else 0
+
+
+def _cached(query: str, group_by: Optional[str], start: Optional[datetime], end: Optional[datetime],
+            include_archive: bool, loader: Callable[[Optional[datetime], Optional[datetime], bool], Dict[str, Any]]
+            ) -> Dict[str, Any]:
+    start, end = _normalize(start), _normalize(end)
+    if start is not None and end is not None and start >= end:
+        raise ValidationError("开始时间必须早于结束时间。", error_code=ErrorCode.PARAM_INVALID.value)
+    key = (query, group_by, start, end, include_archive)
+    missing = object()
+    result = _cache.get(key, missing)
+    if result is not missing:
+        return result
+    try:
+        data = loader(start, end, include_archive)
+    except SQLAlchemyError as e:
+        logger.error(f"查询经营分析 {query} 时发生数据库错误: {e}", exc_info=True)
+        raise APIException("获取经营分析数据失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+    result = {"query": query, "group_by": group_by,
+              "start": start.isoformat() if start else None,
+              "end": end.isoformat() if end else None, **data}
+    # 刚失效后的查询可能读到尚未同步变更的只读副本，只短暂缓存
+    recent = time.monotonic() - _last_invalidated < Config.DB_REPLICA_MAX_LAG_SECONDS
+    _cache.set(key, result, ttl_seconds=Config.DB_REPLICA_MAX_LAG_SECONDS if recent else None)
+    return result
+
+
+# --- 查询 ---
+def revenue(group_by: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+            include_archive: bool = False) -> Dict[str, Any]:
+    """
+    营收与客单价，按 group_by 分组。
+
+    Args:
+        group_by: day / hour（时间桶）、area（用餐区域）或 payment_method（支付方式）。
+        start: 下单时间下限 (含，可选)。
+        end: 下单时间上限 (不含，可选)。
+        include_archive: 是否统计已归档的历史订单。
+
+    Returns:
+        列式数据：分组键列（bucket，或 area_id + area_name，或 payment_method）
+        与 order_count、revenue、aov 列一一对应，金额为字符串。
+
+    Raises:
+        ValidationError: 分组方式无效或时间范围无效。
+    """
+    if group_by not in REVENUE_GROUPINGS:
+        raise ValidationError(f"不支持的分组方式: {group_by}，可选 {', '.join(REVENUE_GROUPINGS)}。",
+                              error_code=ErrorCode.PARAM_INVALID.value)
+    return _cached("revenue", group_by, start, end, include_archive,
+                   lambda s, e, archive: _query_revenue(group_by, s, e, archive))
+
+
+def order_value(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                include_archive: bool = False) -> Dict[str, Any]:
+    """时间范围内的订单数、营收与客单价（平均订单金额）。"""
+    return _cached("order_value", None, start, end, include_archive, _query_order_value)
+
+
+def item_mix(start: Optional[datetime] = None, end: Optional[datetime] = None,
+             include_archive: bool = False) -> Dict[str, Any]:
+    """
+    按菜品分类统计销售构成，按销售额降序；未分类菜品的 category_id 为 None。
+
+    Returns:
+        列式数据：category_id、category_name、quantity、revenue、revenue_share（占总销售额比例）。
+    """
+    return _cached("item_mix", None, start, end, include_archive, _query_item_mix)
+
+
+@read_only
+def _query_revenue(group_by: str, start: Optional[datetime], end: Optional[datetime],
+                   include_archive: bool) -> Dict[str, Any]:
+    orders = orders_source(include_archive)
+    measures = (func.count(), func.sum(orders.c.price))
+    stmt = select().where(*_counted_conditions(orders, start, end))
+    if group_by in _BUCKET_FORMATS:
+        bucket = _time_bucket(orders.c.created_at, group_by).label("bucket")
+        rows = db.session.execute(stmt.add_columns(bucket, *measures).group_by(bucket).order_by(bucket)).all()
+        data: Dict[str, Any] = {"bucket": [row[0] for row in rows]}
+    elif group_by == "area":
+        rows = db.session.execute(
+            stmt.add_columns(orders.c.area_id, DiningArea.area_name, *measures)
+            .select_from(orders)
+            .outerjoin(DiningArea, DiningArea.area_id == orders.c.area_id)
+            .group_by(orders.c.area_id, DiningArea.area_name)
+            .order_by(orders.c.area_id)).all()
+        data = {"area_id": [row[0] for row in rows], "area_name": [row[1] for row in rows]}
+    else:
+        rows = db.session.execute(
+            stmt.add_columns(orders.c.payment_method, *measures)
+            .group_by(orders.c.payment_method)
+            .order_by(orders.c.payment_method)).all()
+        data = {"payment_method": [row[0].name if row[0] else None for row in rows]}
+
+    counts = [int(row[-2]) for row in rows]
+    revenue_cents = [to_cents(row[-1] or 0) for row in rows]
+    data.update(order_count=counts,
+                revenue=[format_cents(cents) for cents in revenue_cents],
+                aov=[format_cents(_average_cents(cents, count)) for cents, count in zip(revenue_cents, counts)])
+    return data
+
+
+@read_only
+def _query_order_value(start: Optional[datetime], end: Optional[datetime],
+                       include_archive: bool) -> Dict[str, Any]:
+    orders = orders_source(include_archive)
+    count, total = db.session.execute(
+        select(func.count(), func.sum(orders.c.price)).where(*_counted_conditions(orders, start, end))).one()
+    revenue_cents = to_cents(total or 0)
+    return {"order_count": int(count), "revenue": format_cents(revenue_cents),
+            "aov": format_cents(_average_cents(revenue_cents, int(count)))}
+
+
+@read_only
+def _query_item_mix(start: Optional[datetime], end: Optional[datetime],
+                    include_archive: bool) -> Dict[str, Any]:
+    orders = orders_source(include_archive)
+    items = order_items_source(include_archive)
+    quantity = func.sum(items.c.quantity)
+    sales = func.sum(items.c.quantity * items.c.unit_price)
+    rows = db.session.execute(
+        select(Category.category_id, Category.name, quantity, sales)
+        .select_from(items)
+        .join(orders, orders.c.order_id == items.c.order_id)
+        .outerjoin(Dish, Dish.dish_id == items.c.dish_id)
+        .outerjoin(Category, Category.category_id == Dish.category_id)
+        .where(*_counted_conditions(orders, start, end))
+        .group_by(Category.category_id, Category.name)
+        .order_by(desc(sales))).all()
+    sales_cents = [to_cents(row[3] or 0) for row in rows]
+    total = sum(sales_cents)
+    return {
+        "category_id": [row[0] for row in rows],
+        "category_name": [row[1] if row[0] is not None else "未分类" for row in rows],
+        "quantity": [int(row[2] or 0) for row in rows],
+        "revenue": [format_cents(cents) for cents in sales_cents],
+        "revenue_share": [round(cents / total, 4) if total else 0.0 for cents in sales_cents],
+    }
+
+
+# --- 缓存失效 ---
+def _affects_analytics(event: Dict[str, Any]) -> bool:
+    """订单在事件前后是否处于统计口径内；订单项变更不带状态，按可能影响处理。"""
+    if event["event_type"] == OrderEventType.ITEM_UPDATED.name:
+        return True
+    payload = event["payload"]
+    return payload.get("previous_state") in _COUNTED_STATE_NAMES or payload.get("state") in _COUNTED_STATE_NAMES
+
+
+def _range_covers(key: tuple, moment: datetime) -> bool:
+    start, end = key[2], key[3]
+    return (start is None or start <= moment) and (end is None or moment < end)
+
+
+def _invalidate_for_events(events: List[Dict[str, Any]]):
+    """提交监听：失效时间范围覆盖受影响订单下单时间的缓存（只做内存操作）。"""
+    global _last_invalidated
+    moments = []
+    for event in events:
+        if not _affects_analytics(event):
+            continue
+        created_at = event["payload"].get("order_created_at")
+        if created_at is None:
+            moments = None
+            break
+        moments.append(_normalize(datetime.fromisoformat(created_at)))
+    if moments == []:
+        return
+    if moments is None:
+        _cache.invalidate()
+    else:
+        _cache.invalidate_where(lambda key: any(_range_covers(key, moment) for moment in moments))
+    _last_invalidated = time.monotonic()
+
+
+on_commit(_invalidate_for_events)
@@ -12,6 +12,7 @@ from typing import Dict, List, Optional, Any
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from app.models.category import Category
+from app.recommend.category_tree import category_tree_index
 from app.utils.db import db
 # 导入需要的错误码枚举
 from app.utils.error_codes import ErrorCode
@@ -82,6 +83,7 @@ def create_category(name: str, description: Optional[str] = None,
     try:
         db.session.add(category)
         db.session.commit()
+        category_tree_index.invalidate()  # 分类树结构变化，推荐用索引失效
         logger.info(f"分类 '{category.name}' (ID: {category.category_id}) 创建成功。")
         return _serialize_category(category)  # 返回序列化后的字典
     except IntegrityError as e:  # 捕获数据库层面的唯一性错误
@@ -217,6 +219,7 @@ def update_category(category_id: int, update_data: Dict[str, Any]) -> Dict[str,
     try:
         # updated_at 由模型 onupdate 自动处理
         db.session.commit()
+        category_tree_index.invalidate()
         logger.info(f"分类 {category_id} ('{category.name}') 信息更新成功。")
         return _serialize_category(category)
     except IntegrityError as e:
@@ -250,6 +253,7 @@ def soft_delete_category(category_id: int) -> bool:
     try:
         category.mark_as_deleted()  # 调用模型方法标记
         db.session.commit()
+        category_tree_index.invalidate()
         logger.info(f"分类 {category_id} ('{category.name}') 已被软删除。")
         return True
     except SQLAlchemyError as e:
@@ -277,6 +281,7 @@ def restore_category(category_id: int) -> Dict[str, Any]:
     try:
         category.restore()  # 调用模型方法标记
         db.session.commit()
+        category_tree_index.invalidate()
         logger.info(f"分类 {category_id} ('{category.name}') 已成功恢复。")
         return _serialize_category(category)
     except SQLAlchemyError as e:
@@ -309,6 +314,7 @@ def delete_category_permanently(category_id: int) -> bool:
         category_name_copy = category.name
         db.session.delete(category)
         db.session.commit()
+        category_tree_index.invalidate()
         logger.info(f"分类 {category_id} ('{category_name_copy}') 已被永久删除。")
         return True
     except IntegrityError as e:
@@ -15,10 +15,9 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from app.models.dish import Dish
 from app.models.enums import OrderState
-from app.models.order import Order
-from app.models.order_item import OrderItem
+from app.services.order_archive_service import order_items_source, orders_source
 # 导入数据库实例和模型
-from app.utils.db import db
+from app.utils.db import db, read_only
 from app.utils.error_codes import ErrorCode
 # 导入异常和错误码
 from app.utils.exceptions import APIException
@@ -26,13 +25,15 @@ from app.utils.exceptions import APIException
 logger = logging.getLogger(__name__)
 
 
-def get_sales_ranking(limit: int = 10) -> List[Dict[str, Any]]:
+@read_only
+def get_sales_ranking(limit: int = 10, include_archive: bool = False) -> List[Dict[str, Any]]:
     """
     获取菜品销量排行榜。
     根据菜品在已支付或已完成订单中的总销售数量进行排名。
 
     Args:
         limit: 返回排行的数量上限。
+        include_archive: 是否统计已归档的历史订单（默认只统计热表中的近期订单）。
 
     Returns:
         包含菜品名称和总销售数量的字典列表。
@@ -50,16 +51,20 @@ def get_sales_ranking(limit: int = 10) -> List[Dict[str, Any]]:
         # 定义有效的订单状态
         valid_order_states = [OrderState.PAID, OrderState.COMPLETED]
 
+        # 数据源：热表，或热表 UNION ALL 归档表
+        orders = orders_source(include_archive)
+        items = order_items_source(include_archive)
+
         # 构建查询语句
         stmt = (
             select(
                 Dish.name.label('dish_name'),  # 选择菜品名称
-                func.sum(OrderItem.quantity).label('total_quantity')  # 计算总销售数量
+                func.sum(items.c.quantity).label('total_quantity')  # 计算总销售数量
             )
-            .select_from(OrderItem)  # 从 OrderItem 开始查询
-            .join(Dish, OrderItem.dish_id == Dish.dish_id)  # 关联 Dish 获取名称
-            .join(Order, OrderItem.order_id == Order.order_id)  # 关联 Order 获取状态
-            .where(Order.state.in_(valid_order_states))  # 过滤有效的订单状态
+            .select_from(items)  # 从订单项开始查询
+            .join(Dish, items.c.dish_id == Dish.dish_id)  # 关联 Dish 获取名称
+            .join(orders, items.c.order_id == orders.c.order_id)  # 关联订单获取状态
+            .where(orders.c.state.in_(valid_order_states))  # 过滤有效的订单状态
             # 可以根据需要添加时间过滤，例如最近 30 天:
             # .where(Order.state.in_(valid_order_states), Order.created_at >= func.date_sub(func.now(), text("INTERVAL 30 DAY")))
             .group_by(Dish.dish_id, Dish.name)  # 按菜品分组
@@ -18,6 +18,7 @@ from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from app.models.category import Category
 from app.models.dish import Dish  # 导入重构后的 Dish 模型
 from app.models.tag import Tag
+from app.services import stock_shard_service
 from app.utils.db import db
 # 导入需要的错误码枚举
 from app.utils.error_codes import ErrorCode
@@ -38,7 +39,11 @@ def serialize_dish(dish: Dish) -> Dict[str, Any]:
         return {}
     # 直接调用模型提供的 to_dict 方法
     # 确保 to_dict 返回的 price 是字符串或浮点数，时间戳是 ISO 格式
-    return dish.to_dict(include_category_name=True)  # 假设 to_dict 支持此参数
+    data = dish.to_dict(include_category_name=True)  # 假设 to_dict 支持此参数
+    if dish.stock_shards:
+        # 分片菜品展示各分片的库存合计（缓存值）
+        data["stock"] = stock_shard_service.stock_totals([dish.dish_id])[dish.dish_id]
+    return data
 
 
 # --- 创建菜品 ---
@@ -219,7 +224,13 @@ def update_dish(dish_id: int, update_data: Dict[str, Any]) -> Dict[str, Any]:
     # 尝试批量设置属性，依赖模型的 @validates 进行验证
     try:
         for key, value in processed_data.items():
-            if key == "dish_id":  # 跳过主键
+            if key in ("dish_id", "stock_shards"):  # 跳过主键；分片数走专用接口
+                continue
+            if key == "stock" and dish.stock_shards:
+                # 分片菜品按新库存重新拆分到各分片
+                dish.stock = value  # 触发 @validates('stock')
+                stock_shard_service.reset_stock(dish, dish.stock)
+                updated = True
                 continue
             # 只有当值与当前值不同时才尝试设置
             if hasattr(dish, key) and getattr(dish, key) != value:
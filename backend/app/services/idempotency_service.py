@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/idempotency_service.py
+@description  下单幂等键：数据库去重表 + 进程内前置缓存。
+              幂等键记录与订单在同一事务中写入，并发重复请求由唯一约束裁决；
+              重复请求直接返回首次响应，不再访问 dish / orders 表。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import Config
+from app.models.idempotency_key import IdempotencyKey
+from app.utils.cache import TTLCache
+from app.utils.db import db
+from app.utils.error_codes import ErrorCode
+from app.utils.exceptions import BusinessError
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 64
+
+# {(user_id, key): (request_hash, response_data)}，仅缓存已完成的请求
+_front_cache = TTLCache(ttl_seconds=Config.ORDER_IDEMPOTENCY_TTL_SECONDS, maxsize=10000)
+
+
+def hash_request(payload: Any) -> str:
+    """对请求体做规范化 JSON 序列化后取 SHA-256。"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _check_hash(key: str, stored_hash: str, request_hash: str):
+    if stored_hash != request_hash:
+        raise BusinessError(f"幂等键 '{key}' 已被用于不同的下单请求。",
+                            error_code=ErrorCode.ORDER_IDEMPOTENCY_CONFLICT.value,
+                            http_status_code=HTTPStatus.CONFLICT)
+
+
+def _is_expired(record: IdempotencyKey) -> bool:
+    expires_at = record.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at <= datetime.now(timezone.utc)
+
+
+def find_response(user_id: int, key: str, request_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    查找该幂等键的首次响应：先查前置缓存，再查去重表。
+    未找到或已过期时返回 None（过期记录会被删除以便重新使用该键）。
+
+    Raises:
+        BusinessError: 同一键对应的请求体与首次不一致 (409)。
+    """
+    cached = _front_cache.get((user_id, key))
+    if cached is not None:
+        _check_hash(key, cached[0], request_hash)
+        return cached[1]
+
+    record = db.session.scalars(
+        select(IdempotencyKey).where(IdempotencyKey.user_id == user_id,
+                                     IdempotencyKey.idempotency_key == key)).first()
+    if record is None:
+        return None
+    if _is_expired(record):
+        db.session.delete(record)
+        db.session.commit()
+        return None
+    _check_hash(key, record.request_hash, request_hash)
+
+    if record.response_body is not None:
+        response = json.loads(record.response_body)
+    else:
+        # 单笔下单已提交但响应未回填（如进程在回填前退出），按订单 ID 重新读取；
+        # 批量下单的响应与幂等键同事务写入，不会走到这里
+        from app.services.order_service import get_order_by_id
+        response = get_order_by_id(record.order_id)
+    _front_cache.set((user_id, key), (record.request_hash, response))
+    logger.info(f"用户 {user_id} 重复提交幂等键 '{key}'，返回订单 {record.order_id} 的首次结果。")
+    return response
+
+
+def claim(user_id: int, key: str, request_hash: str, order_id: int,
+          response: Optional[Dict[str, Any]] = None):
+    """
+    在当前事务中登记幂等键（不 commit），与订单一同提交。
+    并发的重复请求会在 commit 时触发唯一约束冲突。
+
+    Args:
+        response: 已知的完整响应 (可选)。批量下单无法由单个订单 ID 重建响应，
+                  须在此与幂等键同事务写入。
+    """
+    db.session.add(IdempotencyKey(
+        user_id=user_id,
+        idempotency_key=key,
+        request_hash=request_hash,
+        order_id=order_id,
+        response_body=json.dumps(response, ensure_ascii=False, default=str) if response is not None else None,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=Config.ORDER_IDEMPOTENCY_TTL_SECONDS),
+    ))
+
+
+def cache_response(user_id: int, key: str, request_hash: str, response: Dict[str, Any]):
+    """将已随幂等键提交的响应写入前置缓存。"""
+    _front_cache.set((user_id, key), (request_hash, response))
+
+
+def store_response(user_id: int, key: str, request_hash: str, response: Dict[str, Any]):
+    """订单提交后回填响应数据并写入前置缓存；回填失败不影响下单结果。"""
+    _front_cache.set((user_id, key), (request_hash, response))
+    try:
+        db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.idempotency_key == key)
+            .values(response_body=json.dumps(response, ensure_ascii=False, default=str)))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.warning(f"回填幂等键 '{key}' 的响应失败，将按订单 ID 回放: {e}")
+
+
+def purge_expired() -> int:
+    """删除已过期的幂等键记录，返回删除条数。"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+    db.session.commit()
+    logger.info(f"已清理 {result.rowcount} 条过期幂等键。")
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        purge_expired()
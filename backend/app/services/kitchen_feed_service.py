@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/kitchen_feed_service.py
+@description  后厨看板推送：订单事务提交后由 order_event_service.on_commit 将状态变化写入进程内环形缓冲，
+              SSE / 长轮询连接阻塞等待新事件，空闲的看板不产生任何数据库查询。
+
+              - 推送内容：订单状态变化（含新支付的订单）与取消；新支付的订单附带订单详情；
+              - 消息序号作为 SSE id，断线重连携带 Last-Event-ID，缓冲内的消息直接补发，超出缓冲范围时重新下发队列快照；
+              - 事件来自本进程提交的事务，多进程部署时需将看板请求路由到同一进程或改用消息代理。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import Config
+from app.models.enums import OrderEventType, OrderState
+from app.services import order_service
+from app.services.order_event_service import on_commit
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+
+def _to_kitchen_message(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """将订单事件转换为看板消息；与后厨无关的事件（下单、改数量、未改状态的更新）返回 None。"""
+    payload = event["payload"]
+    if event["event_type"] == OrderEventType.CANCELED.name:
+        state = OrderState.CANCELED.name
+    elif event["event_type"] == OrderEventType.UPDATED.name and payload.get("state") != payload.get("previous_state"):
+        state = payload.get("state")
+    else:
+        return None
+    return {
+        "event_id": event["event_id"],
+        "order_id": event["order_id"],
+        "state": state,
+        "previous_state": payload.get("previous_state"),
+        "created_at": event["created_at"],
+    }
+
+
+class KitchenFeed:
+    """
+    进程内发布 / 订阅：保存最近 maxlen 条看板消息，等待者按序号增量读取。
+    序号按提交顺序在本进程内分配（并发事务的 event_id 可能不按提交顺序递增，不能作为游标）。
+    """
+
+    def __init__(self, maxlen: int):
+        self._messages: "deque[Dict[str, Any]]" = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._seq = 0
+        # 已被挤出缓冲区的最大序号，早于它的游标无法增量补发
+        self._evicted_seq = 0
+
+    def publish_events(self, events: List[Dict[str, Any]]):
+        """提交监听：筛选看板消息并唤醒全部等待者（只做内存操作）。"""
+        messages = [m for m in map(_to_kitchen_message, events) if m is not None]
+        if not messages:
+            return
+        with self._cond:
+            for message in messages:
+                if len(self._messages) == self._messages.maxlen:
+                    self._evicted_seq = self._messages[0]["seq"]
+                self._seq += 1
+                message["seq"] = self._seq
+                self._messages.append(message)
+            self._cond.notify_all()
+
+    def last_seq(self) -> int:
+        with self._cond:
+            return self._seq
+
+    def covers(self, after_seq: int) -> bool:
+        """缓冲区是否仍包含 after_seq 之后的全部消息（游标来自重启前的进程时返回 False）。"""
+        with self._cond:
+            return self._evicted_seq <= after_seq <= self._seq
+
+    def wait_for(self, after_seq: int, timeout: float) -> List[Dict[str, Any]]:
+        """阻塞至有序号大于 after_seq 的消息或超时，返回这些消息（按序号升序）。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq, timeout)
+            return [m for m in self._messages if m["seq"] > after_seq]
+
+
+kitchen_feed = KitchenFeed(Config.KITCHEN_FEED_BUFFER_SIZE)
+on_commit(kitchen_feed.publish_events)
+
+
+def _attach_orders(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """为新支付的订单附带订单详情（一次投影查询），查询后立即归还数据库连接。"""
+    paid = OrderState.PAID.name
+    paid_ids = [m["order_id"] for m in messages if m["state"] == paid]
+    orders = {}
+    if paid_ids:
+        try:
+            orders = {o["order_id"]: o for o in order_service.get_orders_by_ids(paid_ids)}
+        finally:
+            db.session.close()
+    return [dict(m, order=orders.get(m["order_id"]) if m["state"] == paid else None) for m in messages]
+
+
+def snapshot() -> Dict[str, Any]:
+    """当前待制作队列快照及其对应的消息序号水位（先取水位再查询，期间的变化会在之后重复推送而不会丢失）。"""
+    last_seq = kitchen_feed.last_seq()
+    try:
+        queue = order_service.list_kitchen_queue(Config.KITCHEN_QUEUE_LIMIT)
+    finally:
+        db.session.close()
+    return {"last_seq": last_seq, "orders": queue}
+
+
+def poll(after_seq: Optional[int], timeout: float) -> Dict[str, Any]:
+    """
+    长轮询：after_seq 为空或超出缓冲范围时立即返回队列快照；
+    否则等待最多 timeout 秒，返回 after_seq 之后的看板消息。
+    """
+    if after_seq is None or not kitchen_feed.covers(after_seq):
+        data = snapshot()
+        return {"snapshot": data, "events": [], "last_seq": data["last_seq"]}
+    messages = _attach_orders(kitchen_feed.wait_for(after_seq, timeout))
+    return {"snapshot": None, "events": messages,
+            "last_seq": messages[-1]["seq"] if messages else after_seq}
+
+
+def _sse(event: str, data: Any, seq: int) -> str:
+    head = f"id: {seq}\n"
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def stream(after_seq: Optional[int], heartbeat_seconds: float) -> Iterator[str]:
+    """SSE 事件流：先补发或下发快照，之后逐条推送看板消息，空闲时发送心跳注释保持连接。"""
+    yield f"retry: {Config.KITCHEN_FEED_RETRY_MS}\n\n"
+    if after_seq is None or not kitchen_feed.covers(after_seq):
+        data = snapshot()
+        after_seq = data["last_seq"]
+        yield _sse("snapshot", data, after_seq)
+    while True:
+        messages = kitchen_feed.wait_for(after_seq, heartbeat_seconds)
+        if not messages:
+            yield ": keepalive\n\n"
+            continue
+        for message in _attach_orders(messages):
+            yield _sse("order", message, message["seq"])
+        after_seq = messages[-1]["seq"]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/order_archive_service.py
+@description  历史订单归档：将创建超过 ORDER_ARCHIVE_MONTHS 个月的 COMPLETED / CANCELED 订单连同订单项
+              分批迁入 orders_archive / order_items_archive（INSERT ... SELECT 后 DELETE，每批一个短事务），
+              使 orders、order_items 只保留近期与进行中的订单。
+
+              - 执行：python -m app.services.order_archive_service [月数]（建议由定时任务在低峰期执行）；
+              - 查询：默认只查热表；需要历史数据的服务函数提供 include_archive 参数，
+                聚合查询通过 orders_source / order_items_source 取得热表或“热表 UNION ALL 归档表”。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import calendar
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, literal, select, union_all
+from sqlalchemy.sql import FromClause
+
+from app.config import Config
+from app.models.enums import OrderState
+from app.models.order import Order
+from app.models.order_archive import OrderArchive, OrderItemArchive
+from app.models.order_item import OrderItem
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATES = (OrderState.COMPLETED, OrderState.CANCELED)
+
+_ORDER_COLUMNS = ("order_id", "user_id", "area_id", "state", "price", "payment_method", "image_url",
+                  "created_at", "updated_at", "deleted_at")
+_ITEM_COLUMNS = ("order_item_id", "order_id", "dish_id", "quantity", "unit_price", "dish_name",
+                 "dish_image_url")
+
+
+def orders_source(include_archive: bool = False) -> FromClause:
+    """订单数据源：热表 orders，或 orders UNION ALL orders_archive（列与 orders 相同）。"""
+    if not include_archive:
+        return Order.__table__
+    return union_all(
+        select(*(getattr(Order, c) for c in _ORDER_COLUMNS)),
+        select(*(getattr(OrderArchive, c) for c in _ORDER_COLUMNS)),
+    ).subquery("orders_all")
+
+
+def order_items_source(include_archive: bool = False) -> FromClause:
+    """订单项数据源：热表 order_items，或 order_items UNION ALL order_items_archive。"""
+    if not include_archive:
+        return OrderItem.__table__
+    return union_all(
+        select(*(getattr(OrderItem, c) for c in _ITEM_COLUMNS)),
+        select(*(getattr(OrderItemArchive, c) for c in _ITEM_COLUMNS)),
+    ).subquery("order_items_all")
+
+
+def archive_cutoff(months: int, now: Optional[datetime] = None) -> datetime:
+    """months 个自然月之前的同一时刻（日期超出目标月天数时取月末），返回不带时区的 UTC 时间。"""
+    now = (now or datetime.now(timezone.utc)).replace(tzinfo=None)
+    year, month_index = divmod(now.year * 12 + now.month - 1 - months, 12)
+    day = min(now.day, calendar.monthrange(year, month_index + 1)[1])
+    return now.replace(year=year, month=month_index + 1, day=day)
+
+
+def archive_batch(cutoff: datetime, batch_size: int) -> List[int]:
+    """
+    归档一批订单并提交：跳过被其他事务锁定的行，按 order_id 顺序领取至多 batch_size 个
+    创建早于 cutoff 的 COMPLETED / CANCELED 订单。返回本批归档的订单 ID。
+    """
+    try:
+        order_ids = list(db.session.scalars(
+            select(Order.order_id)
+            .where(Order.state.in_(ARCHIVABLE_STATES), Order.created_at < cutoff)
+            .order_by(Order.order_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)))
+        if not order_ids:
+            db.session.rollback()
+            return []
+        db.session.execute(insert(OrderArchive).from_select(
+            _ORDER_COLUMNS + ("archived_at",),
+            select(*(getattr(Order, c) for c in _ORDER_COLUMNS),
+                   literal(datetime.now(timezone.utc).replace(tzinfo=None), OrderArchive.archived_at.type))
+            .where(Order.order_id.in_(order_ids))))
+        db.session.execute(insert(OrderItemArchive).from_select(
+            _ITEM_COLUMNS,
+            select(*(getattr(OrderItem, c) for c in _ITEM_COLUMNS)).where(OrderItem.order_id.in_(order_ids))))
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids))
+                           .execution_options(synchronize_session=False))
+        db.session.execute(delete(Order).where(Order.order_id.in_(order_ids))
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        return order_ids
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def archive_orders(months: int = Config.ORDER_ARCHIVE_MONTHS,
+                   batch_size: int = Config.ORDER_ARCHIVE_BATCH_SIZE,
+                   max_batches: Optional[int] = None) -> int:
+    """
+    分批归档创建超过 months 个月的已完成 / 已取消订单，直到某批不足 batch_size 或达到 max_batches。
+    需在应用上下文中调用，返回归档的订单数。
+    """
+    if months < 1:
+        raise ValueError("归档月数必须大于等于 1。")
+    cutoff = archive_cutoff(months)
+    start = time.perf_counter()
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        order_ids = archive_batch(cutoff, batch_size)
+        batches += 1
+        archived += len(order_ids)
+        if len(order_ids) < batch_size:
+            break
+    logger.info(f"订单归档完成：截止 {cutoff.isoformat()}，{batches} 批，归档 {archived} 个订单，"
+                f"耗时 {(time.perf_counter() - start) * 1000:.1f}ms。")
+    return archived
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        archive_orders(int(sys.argv[1]) if len(sys.argv) > 1 else Config.ORDER_ARCHIVE_MONTHS)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/order_event_service.py
+@description  订单事件发件箱：业务代码在订单事务中调用 record_event 写入 order_event 表，
+              后台分发线程在事务提交后批量读取待投递事件，依次投递给消息代理适配器和进程内订阅者。
+
+              - 投递语义为至少一次（at-least-once），订阅者需按 event_id 自行去重；
+              - 多个工作进程同时分发时用 SELECT ... FOR UPDATE SKIP LOCKED 分摊事件，
+                因此进程内订阅者只会收到本进程领取到的事件；
+              - 需要毫秒级推送的场景（如后厨看板）可用 on_commit 注册提交监听，
+                在本进程的订单事务提交后立即收到该事务写入的事件，不经过发件箱轮询；
+              - 清理已投递事件：python -m app.services.order_event_service
+@date         2025-06-08
+@author       taichilei
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from flask import Flask
+from flask_sqlalchemy.session import Session
+from sqlalchemy import delete, event, select, update
+
+from app.config import Config
+from app.models.enums import OrderEventType
+from app.models.order_event import OrderEvent
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[Dict[str, Any]], None]
+
+_PENDING_FLAG = "order_events_pending"
+_FLUSHED_KEY = "order_events_flushed"
+
+
+# --- 写入 ---
+def record_event(event_type: OrderEventType, order_id: int, payload: Dict[str, Any]):
+    """在当前事务中写入一条订单事件（不 commit），随订单变更一同提交。"""
+    db.session.add(OrderEvent(order_id=order_id, event_type=event_type,
+                              payload=json.dumps(payload, ensure_ascii=False, default=str)))
+    db.session.info[_PENDING_FLAG] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_events(session, _flush_context):
+    """记录本事务已 flush 的事件（此时已分配 event_id），提交后交给提交监听者。"""
+    if not session.info.get(_PENDING_FLAG) or not _commit_listeners:
+        return
+    flushed = [obj for obj in session.new if isinstance(obj, OrderEvent)]
+    if flushed:
+        now = datetime.now(timezone.utc).isoformat()
+        session.info.setdefault(_FLUSHED_KEY, []).extend({
+            "event_id": e.event_id,
+            "event_type": e.event_type.name,
+            "order_id": e.order_id,
+            "payload": json.loads(e.payload),
+            "created_at": now,
+        } for e in flushed)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher_after_commit(session):
+    if session.info.pop(_PENDING_FLAG, False):
+        order_event_dispatcher.wake()
+    committed = session.info.pop(_FLUSHED_KEY, None)
+    if committed:
+        _notify_commit_listeners(committed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_pending_flag(session):
+    session.info.pop(_PENDING_FLAG, None)
+    session.info.pop(_FLUSHED_KEY, None)
+
+
+# --- 进程内订阅 ---
+_subscribers: Dict[Optional[OrderEventType], List[EventHandler]] = defaultdict(list)
+_subscribers_lock = threading.Lock()
+
+
+def subscribe(handler: EventHandler, event_types: Optional[Iterable[OrderEventType]] = None):
+    """
+    注册进程内订阅者。event_types 为空时订阅全部事件。
+    订阅者在分发线程（已推入应用上下文）中被调用，抛出的异常只记录日志，不影响其他订阅者。
+    """
+    with _subscribers_lock:
+        for event_type in (event_types or [None]):
+            _subscribers[event_type].append(handler)
+
+
+def _notify_subscribers(event_dict: Dict[str, Any]):
+    event_type = OrderEventType[event_dict["event_type"]]
+    with _subscribers_lock:
+        handlers = _subscribers.get(event_type, []) + _subscribers.get(None, [])
+    for handler in handlers:
+        try:
+            handler(event_dict)
+        except Exception as ex:
+            logger.error(f"订单事件订阅者 {getattr(handler, '__name__', handler)} 处理事件 "
+                         f"{event_dict['event_id']} 失败: {ex}", exc_info=True)
+
+
+# --- 进程内提交监听（不经过发件箱，仅本进程提交的事务） ---
+CommitListener = Callable[[List[Dict[str, Any]]], None]
+_commit_listeners: List[CommitListener] = []
+
+
+def on_commit(listener: CommitListener):
+    """
+    注册提交监听：本进程的事务提交后，以该事务写入的事件列表调用 listener。
+    listener 在提交线程中同步执行，应只做内存操作，不得访问数据库。
+    """
+    with _subscribers_lock:
+        _commit_listeners.append(listener)
+
+
+def _notify_commit_listeners(events: List[Dict[str, Any]]):
+    for listener in list(_commit_listeners):
+        try:
+            listener(events)
+        except Exception as ex:
+            logger.error(f"订单事件提交监听 {getattr(listener, '__name__', listener)} 执行失败: {ex}",
+                         exc_info=True)
+
+
+# --- 消息代理适配器 ---
+class BrokerAdapter:
+    """消息代理适配器接口：publish 抛出异常时本批事件保持待投递，下次重试。"""
+
+    def publish(self, events: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+
+class FileBrokerAdapter(BrokerAdapter):
+    """本地替身：将事件以 NDJSON 追加写入文件，供外部进程 tail 消费。"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def publish(self, events: List[Dict[str, Any]]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events))
+
+
+class QueueBrokerAdapter(BrokerAdapter):
+    """本地替身：投递到进程内队列，便于开发调试时直接消费。"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=maxsize)
+
+    def publish(self, events: List[Dict[str, Any]]):
+        for e in events:
+            self.queue.put_nowait(e)
+
+
+def create_broker(name: str) -> Optional[BrokerAdapter]:
+    """按配置名称创建适配器：none / file / queue。"""
+    name = (name or "none").lower()
+    if name == "file":
+        return FileBrokerAdapter(Config.ORDER_EVENT_BROKER_PATH)
+    if name == "queue":
+        return QueueBrokerAdapter()
+    if name != "none":
+        logger.warning(f"未知的订单事件代理类型 '{name}'，仅投递给进程内订阅者。")
+    return None
+
+
+# --- 分发 ---
+def dispatch_pending(broker: Optional[BrokerAdapter], batch_size: int) -> int:
+    """
+    领取一批待投递事件并投递，成功后标记 dispatched_at。需在应用上下文中调用。
+    返回本批投递的事件数。
+    """
+    stmt = (select(OrderEvent)
+            .where(OrderEvent.dispatched_at.is_(None))
+            .order_by(OrderEvent.event_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True))
+    try:
+        events = db.session.scalars(stmt).all()
+        if not events:
+            db.session.rollback()
+            return 0
+        event_dicts = [e.to_dict() for e in events]
+        if broker is not None:
+            broker.publish(event_dicts)
+        for event_dict in event_dicts:
+            _notify_subscribers(event_dict)
+        db.session.execute(
+            update(OrderEvent)
+            .where(OrderEvent.event_id.in_([e["event_id"] for e in event_dicts]))
+            .values(dispatched_at=datetime.now(timezone.utc)))
+        db.session.commit()
+        return len(event_dicts)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+class OrderEventDispatcher:
+    """后台分发线程：事务提交后被唤醒，否则按 ORDER_EVENT_POLL_SECONDS 轮询兜底。"""
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.broker: Optional[BrokerAdapter] = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self, app: Flask):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.broker = create_broker(app.config.get("ORDER_EVENT_BROKER", "none"))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name="hotmeal-order-events", daemon=True)
+        self._thread.start()
+        logger.info("订单事件分发线程已启动。")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, app: Flask):
+        poll_seconds = app.config.get("ORDER_EVENT_POLL_SECONDS", 5)
+        batch_size = app.config.get("ORDER_EVENT_BATCH_SIZE", 100)
+        while not self._stop.is_set():
+            self._wakeup.wait(poll_seconds)
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    # 一批满额时继续领取，直到积压清空
+                    while not self._stop.is_set() and dispatch_pending(self.broker, batch_size) == batch_size:
+                        pass
+                except Exception as ex:
+                    logger.error(f"分发订单事件失败，将在下次轮询重试: {ex}", exc_info=True)
+                finally:
+                    db.session.remove()
+
+
+def purge_dispatched(retention_days: int = Config.ORDER_EVENT_RETENTION_DAYS) -> int:
+    """删除早于保留期的已投递事件，返回删除条数。"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).replace(tzinfo=None)
+    result = db.session.execute(
+        delete(OrderEvent).where(OrderEvent.dispatched_at.is_not(None),
+                                 OrderEvent.dispatched_at < cutoff))
+    db.session.commit()
+    logger.info(f"已清理 {result.rowcount} 条已投递的订单事件。")
+    return result.rowcount
+
+
+# 进程内单例
+order_event_dispatcher = OrderEventDispatcher()
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        purge_dispatched()
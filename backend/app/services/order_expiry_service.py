@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/order_expiry_service.py
+@description  超时未支付订单清理：按 (state, created_at) 索引找出创建超过 ORDER_PENDING_TTL_MINUTES
+              仍为 PENDING 的订单，分批取消并以集合操作恢复库存，每批一个短事务。
+
+              - 后台线程：ORDER_EXPIRY_ENABLED=true 时随应用启动，每 ORDER_EXPIRY_INTERVAL_SECONDS 秒执行一轮；
+              - 单次执行：python -m app.services.order_expiry_service；
+              - 运行指标：stats() / GET /health/order-expiry（仅管理员）。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from flask import Flask
+
+from app.config import Config
+from app.services import order_service
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryStats:
+    """清理线程的累计运行指标（进程内）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.batches = 0
+        self.canceled_total = 0
+        self.errors = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms = 0.0
+        self.last_canceled = 0
+        self.last_error: Optional[str] = None
+
+    def record_run(self, canceled: int, batches: int, duration_ms: float, error: Optional[str] = None):
+        with self._lock:
+            self.runs += 1
+            self.batches += batches
+            self.canceled_total += canceled
+            self.last_run_at = datetime.now(timezone.utc)
+            self.last_duration_ms = duration_ms
+            self.last_canceled = canceled
+            if error is not None:
+                self.errors += 1
+                self.last_error = error
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "batches": self.batches,
+                "canceled_total": self.canceled_total,
+                "errors": self.errors,
+                "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+                "last_duration_ms": round(self.last_duration_ms, 2),
+                "last_canceled": self.last_canceled,
+                "last_error": self.last_error,
+            }
+
+
+_stats = ExpiryStats()
+
+
+def stats() -> Dict[str, Any]:
+    """返回清理任务的累计运行指标。"""
+    return _stats.snapshot()
+
+
+def expire_stale_orders(ttl_minutes: int = Config.ORDER_PENDING_TTL_MINUTES,
+                        batch_size: int = Config.ORDER_EXPIRY_BATCH_SIZE,
+                        max_batches: Optional[int] = None) -> int:
+    """
+    执行一轮清理：分批取消超时 PENDING 订单，直到某批不足 batch_size 或达到 max_batches。
+    需在应用上下文中调用，返回本轮取消的订单数。
+    """
+    start = time.perf_counter()
+    canceled = batches = 0
+    error = None
+    try:
+        while max_batches is None or batches < max_batches:
+            order_ids = order_service.cancel_expired_pending_orders(ttl_minutes, batch_size)
+            batches += 1
+            canceled += len(order_ids)
+            if order_ids:
+                logger.info(f"已取消 {len(order_ids)} 个超过 {ttl_minutes} 分钟未支付的订单: {order_ids}")
+            if len(order_ids) < batch_size:
+                break
+    except Exception as ex:
+        error = str(ex)
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _stats.record_run(canceled, batches, duration_ms, error)
+        if canceled:
+            logger.info(f"超时订单清理完成：{batches} 批，取消 {canceled} 个，耗时 {duration_ms:.1f}ms。")
+    return canceled
+
+
+class OrderExpirySweeper:
+    """后台清理线程：每 ORDER_EXPIRY_INTERVAL_SECONDS 秒执行一轮 expire_stale_orders。"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, app: Flask):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name="hotmeal-order-expiry", daemon=True)
+        self._thread.start()
+        logger.info("超时订单清理线程已启动。")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, app: Flask):
+        interval = app.config.get("ORDER_EXPIRY_INTERVAL_SECONDS", 60)
+        ttl_minutes = app.config.get("ORDER_PENDING_TTL_MINUTES", 30)
+        batch_size = app.config.get("ORDER_EXPIRY_BATCH_SIZE", 100)
+        while not self._stop.wait(interval):
+            with app.app_context():
+                try:
+                    expire_stale_orders(ttl_minutes, batch_size)
+                except Exception as ex:
+                    logger.error(f"超时订单清理失败，将在下次轮询重试: {ex}", exc_info=True)
+                finally:
+                    db.session.remove()
+
+
+# 进程内单例
+order_expiry_sweeper = OrderExpirySweeper()
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        expire_stale_orders()
@@ -6,22 +6,38 @@
 @author       taichilei
 """
 
+import csv
+import io
+import json
 import logging
-from typing import Dict, List, Optional, Any
-
-from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime
+from decimal import Decimal
+from http import HTTPStatus
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Any
+
+from sqlalchemy import and_, func, insert, or_, select, text, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import joinedload, selectinload
 
-from app.models import Dish, Order, OrderItem, User, DiningArea
-from app.models.enums import OrderState, PaymentMethod, UserRole
-from app.utils.db import db
+from app.config import Config
+from app.models import Dish, DishStockShard, Order, OrderArchive, OrderItem, OrderItemArchive, User, DiningArea
+from app.models.enums import OrderEventType, OrderState, PaymentMethod, UserRole
+from app.services import idempotency_service, stock_shard_service
+from app.services.order_event_service import record_event
+from app.utils.cache import TTLCache
+from app.utils.db import db, read_only
 from app.utils.error_codes import ErrorCode
 from app.utils.exceptions import (
     APIException, BusinessError, NotFoundError, ValidationError, AuthorizationError
 )
+from app.utils.pagination import decode_time_id_cursor, encode_time_id_cursor
 
 logger = logging.getLogger(__name__)
 
+# 游标分页附带的订单总数缓存：{user_id 或 None: count}
+_order_total_cache = TTLCache(ttl_seconds=Config.ORDER_TOTAL_CACHE_SECONDS, maxsize=10000)
+
 
 # --- 辅助函数 ---
 def _serialize_order(order: Order, include_items: bool = True) -> Dict[str, Any]:
@@ -43,7 +59,7 @@ def _serialize_order(order: Order, include_items: bool = True) -> Dict[str, Any]
             "area_name": order.dining_area.area_name
         } if order.dining_area else None,
         "state": order.state.name,
-        "price": float(order.price),
+        "price": str(order.price),
         "payment_method": order.payment_method.name if order.payment_method else None,
         "image_url": order.image_url,
         "created_at": order.created_at.isoformat() if order.created_at else None,
@@ -55,10 +71,260 @@ def _serialize_order(order: Order, include_items: bool = True) -> Dict[str, Any]
     }
 
 
+
+# --- 列表查询的投影序列化：只选需要的列，直接由行元组组装字典，不构建 ORM 对象 ---
+def _order_projection_select(source=Order):
+    """
+    订单列表投影查询：订单列 + 下单用户 + 用餐区域（外连接）。输出格式与 _serialize_order 一致。
+    source 为 Order 或 OrderArchive（列相同）。
+    """
+    return (select(source.order_id, source.state, source.price, source.payment_method,
+                   source.image_url, source.created_at, source.updated_at, source.deleted_at,
+                   User.user_id, User.username, DiningArea.area_id, DiningArea.area_name)
+            .select_from(source)
+            .outerjoin(User, User.user_id == source.user_id)
+            .outerjoin(DiningArea, DiningArea.area_id == source.area_id))
+
+
+def _fetch_items_by_order(order_ids: List[int], source=OrderItem) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    一次查询取出多个订单的订单项，按 order_id 分组，格式与 OrderItem.to_dict() 一致。
+    菜品名称与图片取自订单项快照，不联表 Dish；早期未快照的订单项另以一次 IN 查询补全。
+    """
+    items_by_order: Dict[int, List[Dict[str, Any]]] = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return items_by_order
+    rows = db.session.execute(
+        select(source.order_item_id, source.order_id, source.dish_id, source.dish_name, source.dish_image_url,
+               source.quantity, source.unit_price)
+        .where(source.order_id.in_(order_ids))
+        .order_by(source.order_item_id)).all()
+    missing = {row.dish_id for row in rows if row.dish_name is None}
+    fallback = {dish_id: (name, image_url) for dish_id, name, image_url in db.session.execute(
+        select(Dish.dish_id, Dish.name, Dish.image_url).where(Dish.dish_id.in_(missing)))} if missing else {}
+    for item_id, order_id, dish_id, dish_name, dish_image_url, quantity, unit_price in rows:
+        if dish_name is None:
+            dish_name, dish_image_url = fallback.get(dish_id, ("未知菜品", None))
+        items_by_order[order_id].append({
+            'order_item_id': item_id,
+            'order_id': order_id,
+            'dish_id': dish_id,
+            'dish_name': dish_name,
+            'dish_image_url': dish_image_url,
+            'quantity': quantity,
+            'unit_price': str(unit_price) if unit_price is not None else "0.00",
+            'total': str(quantity * unit_price) if unit_price is not None else "0.00"
+        })
+    return items_by_order
+
+
+def _rows_to_order_dicts(rows, include_items: bool, archived: bool = False) -> List[Dict[str, Any]]:
+    """将 _order_projection_select() 的结果行组装为订单字典，订单项按 order_id 批量加载。"""
+    items_source = OrderItemArchive if archived else OrderItem
+    items_by_order = _fetch_items_by_order([row[0] for row in rows], items_source) if include_items else {}
+    return [{
+        "order_id": order_id,
+        "user": {"user_id": user_id, "username": username} if user_id is not None else None,
+        "area": {"area_id": area_id, "area_name": area_name} if area_id is not None else None,
+        "state": state.name,
+        "price": str(price),
+        "payment_method": payment_method.name if payment_method else None,
+        "image_url": image_url,
+        "created_at": created_at.isoformat() if created_at else None,
+        "updated_at": updated_at.isoformat() if updated_at else None,
+        "deleted_at": deleted_at.isoformat() if deleted_at else None,
+        "items": items_by_order.get(order_id, []) if include_items else []
+    } for (order_id, state, price, payment_method, image_url, created_at, updated_at, deleted_at,
+           user_id, username, area_id, area_name) in rows]
+
+def _aggregate_quantities(dish_list: List[Dict[str, Any]]) -> Dict[int, int]:
+    """按 dish_id 汇总数量（同一菜品可能在列表中出现多次）。"""
+    quantities: Dict[int, int] = {}
+    for item_data in dish_list:
+        quantities[item_data['dish_id']] = quantities.get(item_data['dish_id'], 0) + item_data['quantity']
+    return quantities
+
+
+def _reserve_dish_stock(quantities: Dict[int, int]) -> Dict[int, Dish]:
+    """
+    一次 IN 查询加载并行锁（SELECT ... FOR UPDATE）全部菜品，校验后扣减库存（不 commit）。
+
+    按 dish_id 升序加锁，并发订单以相同顺序获取行锁，避免死锁；
+    库存检查与扣减都发生在持锁期间，不会超卖。
+    开启库存分片的菜品不锁 dish 行，改为扣减随机分片（见 stock_shard_service）。
+
+    Returns:
+        {dish_id: Dish}，供调用方读取单价等信息。
+
+    Raises:
+        BusinessError: 菜品不存在、不可用或库存不足。
+    """
+    dishes = _load_dishes_for_reservation(list(quantities))
+    _deduct_stock(quantities, dishes)
+    return dishes
+
+
+def _deduct_stock(quantities: Dict[int, int], dishes: Dict[int, Dish],
+                  shard_stock: Optional[Dict[int, int]] = None):
+    """
+    在已加载（普通菜品已加行锁）的菜品上校验并扣减库存（不 commit）。
+    分片菜品按 dish_id 升序逐个扣减分片，与加载时按 dish_id 升序加行锁的顺序一致，避免死锁。
+    传入 shard_stock（stock_shard_service.lock_totals 已锁定的分片库存合计）时，
+    分片菜品只扣减该内存合计，由调用方统一写回分片；此时校验失败不会留下任何扣减。
+
+    Raises:
+        BusinessError: 菜品不存在、不可用或库存不足。
+    """
+    for dish_id, quantity in quantities.items():
+        dish = dishes.get(dish_id)
+        if not dish:
+            raise BusinessError(f"菜品 ID {dish_id} 未找到。",
+                                error_code=ErrorCode.DISH_NOT_FOUND.value)
+        if not dish.is_available:
+            raise BusinessError(f"菜品 '{dish.name}' 当前不可用。",
+                                error_code=ErrorCode.DISH_UNAVAILABLE.value)
+        if not dish.stock_shards:
+            available = dish.stock
+        elif shard_stock is not None:
+            available = shard_stock.get(dish_id, 0)
+        else:
+            continue
+        if available < quantity:
+            raise BusinessError(
+                f"菜品 '{dish.name}' 库存不足 (需要 {quantity}, 仅剩 {available})。",
+                error_code=ErrorCode.INSUFFICIENT_STOCK.value)
+
+    for dish_id in sorted(quantities):
+        dish, quantity = dishes[dish_id], quantities[dish_id]
+        if not dish.stock_shards:
+            dish.stock -= quantity
+            logger.info(f"菜品 '{dish.name}' (ID: {dish_id}) 库存扣减 {quantity}，剩余 {dish.stock}。")
+        elif shard_stock is not None:
+            shard_stock[dish_id] -= quantity
+        elif stock_shard_service.reserve(dish_id, quantity, dish.stock_shards):
+            logger.info(f"菜品 '{dish.name}' (ID: {dish_id}) 分片库存扣减 {quantity}。")
+        else:
+            remaining = stock_shard_service.stock_totals([dish_id])[dish_id]
+            raise BusinessError(
+                f"菜品 '{dish.name}' 库存不足 (需要 {quantity}, 仅剩 {remaining})。",
+                error_code=ErrorCode.INSUFFICIENT_STOCK.value)
+
+
+def _load_dishes_for_reservation(dish_ids: List[int]) -> Dict[int, Dish]:
+    """
+    加载待扣减库存的菜品：普通菜品加行锁，分片菜品不锁 dish 行（扣减时锁分片），
+    但同样重新读取，是否可用与分片数不沿用会话中的旧值。
+    """
+    sharded_hint = stock_shard_service.sharded_dish_ids()
+    dishes = _load_dishes([dish_id for dish_id in dish_ids if dish_id not in sharded_hint], lock=True)
+    dishes.update(_load_dishes([dish_id for dish_id in dish_ids if dish_id in sharded_hint], lock=False))
+    # 分片标记缓存过期（菜品已关闭分片）时补加行锁
+    stale = [dish_id for dish_id, dish in dishes.items() if not dish.stock_shards and dish_id in sharded_hint]
+    dishes.update(_load_dishes(stale, lock=True))
+    return dishes
+
+
+def _load_dishes(dish_ids: List[int], lock: bool) -> Dict[int, Dish]:
+    """
+    按 dish_id 升序加载菜品；lock=True 时 SELECT ... FOR UPDATE。
+    总是刷新会话中已有的同一菜品对象，库存、是否可用与分片数以本次读取为准。
+    """
+    if not dish_ids:
+        return {}
+    stmt = (select(Dish).where(Dish.dish_id.in_(dish_ids)).order_by(Dish.dish_id)
+            .execution_options(populate_existing=True))
+    if lock:
+        stmt = stmt.with_for_update()
+    return {dish.dish_id: dish for dish in db.session.scalars(stmt)}
+
+
+def _bulk_insert_order_items(order_id: int, items: List[Dict[str, Any]]) -> List[int]:
+    """
+    使用一次 executemany 插入订单的全部订单项（不 commit），返回按插入顺序排列的 order_item_id。
+    items 中的 quantity / unit_price 需已由调用方校验。
+    """
+    return _bulk_insert_items_for_orders({order_id: items})[order_id]
+
+
+def _bulk_insert_items_for_orders(items_by_order: Dict[int, List[Dict[str, Any]]]) -> Dict[int, List[int]]:
+    """一次 executemany 插入多个订单的订单项（不 commit），返回 {order_id: 按插入顺序排列的 order_item_id}。"""
+    db.session.execute(insert(OrderItem), [{
+        "order_id": order_id,
+        "dish_id": item["dish_id"],
+        "quantity": item["quantity"],
+        "unit_price": item["unit_price"],
+        "dish_name": item["dish_name"],
+        "dish_image_url": item["dish_image_url"],
+    } for order_id, items in items_by_order.items() for item in items])
+    # MySQL 不支持 RETURNING；这些订单的订单项仅在此处插入，按主键回查即为插入顺序
+    item_ids: Dict[int, List[int]] = {order_id: [] for order_id in items_by_order}
+    for item_id, order_id in db.session.execute(
+            select(OrderItem.order_item_id, OrderItem.order_id)
+            .where(OrderItem.order_id.in_(list(items_by_order)))
+            .order_by(OrderItem.order_item_id)):
+        item_ids[order_id].append(item_id)
+    return item_ids
+
+
+def _validate_dish_list(dish_list: List[Dict[str, Any]]):
+    """
+    校验下单菜品列表的格式。
+
+    Raises:
+        BusinessError: 列表为空。
+        ValidationError: dish_id / quantity 不是整数或数量不大于 0。
+    """
+    if not dish_list:
+        raise BusinessError("订单中的菜品列表不能为空。", error_code=ErrorCode.PARAM_INVALID.value)
+    for item_data in dish_list:
+        dish_id = item_data.get('dish_id') if isinstance(item_data, dict) else None
+        quantity = item_data.get('quantity') if isinstance(item_data, dict) else None
+        if not isinstance(dish_id, int) or not isinstance(quantity, int):
+            raise ValidationError(
+                f"菜品列表项必须包含有效的 dish_id (整数) 和 quantity (整数)。无效项: {item_data}",
+                error_code=ErrorCode.PARAM_INVALID.value)
+        if quantity <= 0:
+            raise ValidationError(f"菜品 ID {dish_id} 的数量必须大于 0。",
+                                  error_code=ErrorCode.PARAM_INVALID.value)
+
+
+def _items_to_create(dish_list: List[Dict[str, Any]], dishes: Dict[int, Dish]) -> List[Dict[str, Any]]:
+    """由下单菜品列表构建订单项数据：单价、名称与图片快照取自 Dish。"""
+    return [{
+        "dish_id": item_data['dish_id'],
+        "quantity": item_data['quantity'],
+        "unit_price": dishes[item_data['dish_id']].price,
+        "dish_name": dishes[item_data['dish_id']].name,
+        "dish_image_url": dishes[item_data['dish_id']].image_url
+    } for item_data in dish_list]
+
+
+def _items_total(items: List[Dict[str, Any]]) -> Decimal:
+    """订单项数据的总价 (Decimal)。"""
+    return sum((item['unit_price'] * item['quantity'] for item in items), Decimal("0.00"))
+
+
+def _created_items_response(order_id: int, item_ids: List[int],
+                            items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """由输入直接构建新订单的订单项响应，避免 commit 后重新加载 order_items 及其菜品。"""
+    return [{
+        'order_item_id': item_id,
+        'order_id': order_id,
+        'dish_id': item_data['dish_id'],
+        'dish_name': item_data['dish_name'],
+        'dish_image_url': item_data['dish_image_url'],
+        'quantity': item_data['quantity'],
+        'unit_price': str(item_data['unit_price']),
+        'total': str(item_data['quantity'] * item_data['unit_price'])
+    } for item_id, item_data in zip(item_ids, items)]
+
+
 # --- 创建订单 ---
 def create_order(user_id: int,
                  dish_list: List[Dict[str, Any]],
-                 area_id: Optional[int]) -> Dict[str, Any]:
+                 area_id: Optional[int],
+                 idempotency_key: Optional[str] = None,
+                 request_hash: Optional[str] = None) -> Dict[str, Any]:
     """
     创建新订单并添加菜品信息。
 
@@ -66,9 +332,12 @@ def create_order(user_id: int,
         user_id: 用户 ID。
         dish_list: 包含 'dish_id' 和 'quantity' 的字典列表。
         area_id: 用餐区域 ID (可选)。
+        idempotency_key: 客户端 Idempotency-Key (可选)，与订单在同一事务中登记。
+        request_hash: 请求体摘要，与 idempotency_key 一同提供。
 
     Returns:
         成功时返回新创建订单的信息字典 (包含订单项)。
+        并发重复请求在提交时冲突的，返回首次请求的结果。
 
     Raises:
         NotFoundError: 如果用户、区域或某个菜品未找到。
@@ -77,8 +346,7 @@ def create_order(user_id: int,
         APIException: 如果发生数据库错误。
     """
     # 1. 输入验证
-    if not dish_list:
-        raise BusinessError("订单中的菜品列表不能为空。", error_code=ErrorCode.PARAM_INVALID.value)
+    _validate_dish_list(dish_list)
 
     # 检查用户和区域是否存在
     if not User.query.get(user_id):
@@ -87,47 +355,16 @@ def create_order(user_id: int,
         raise NotFoundError(f"用餐区域 ID {area_id} 不存在。",
                             error_code=ErrorCode.HTTP_NOT_FOUND.value)  # 需要定义 AREA_NOT_FOUND
 
-    # 2. 检查菜品并计算初始价格 (在一个事务中完成)
+    # 2. 锁定菜品行并预占库存 (在一个事务中完成)
     try:
-        items_to_create = []
-        dishes_to_update_stock = {}  # 存储需要更新库存的菜品及其减少量
-
-        for item_data in dish_list:
-            dish_id = item_data.get('dish_id')
-            quantity = item_data.get('quantity')
-
-            if not isinstance(dish_id, int) or not isinstance(quantity, int):
-                raise ValidationError(
-                    f"菜品列表项必须包含有效的 dish_id (整数) 和 quantity (整数)。无效项: {item_data}",
-                    error_code=ErrorCode.PARAM_INVALID.value)
-            if quantity <= 0:
-                raise ValidationError(f"菜品 ID {dish_id} 的数量必须大于 0。",
-                                      error_code=ErrorCode.PARAM_INVALID.value)
-
-            dish = Dish.query.get(dish_id)
-            if not dish:
-                raise BusinessError(f"菜品 ID {dish_id} 未找到。",
-                                    error_code=ErrorCode.DISH_NOT_FOUND.value)
-            if not dish.is_available:
-                raise BusinessError(f"菜品 '{dish.name}' 当前不可用。",
-                                    error_code=ErrorCode.DISH_UNAVAILABLE.value)
-            if dish.stock < quantity:
-                raise BusinessError(
-                    f"菜品 '{dish.name}' 库存不足 (需要 {quantity}, 仅剩 {dish.stock})。",
-                    error_code=ErrorCode.INSUFFICIENT_STOCK.value)
-
-            # 准备 OrderItem 数据 (使用 Decimal 价格)
-            items_to_create.append({
-                "dish_id": dish.dish_id,
-                "quantity": quantity,
-                "unit_price": dish.price  # 从 Dish 模型获取 Decimal 价格
-            })
-            # 记录库存扣减量
-            dishes_to_update_stock[dish] = dishes_to_update_stock.get(dish, 0) + quantity
+        dishes = _reserve_dish_stock(_aggregate_quantities(dish_list))
+
+        # 准备 OrderItem 数据 (单价快照取自 Dish)
+        items_to_create = _items_to_create(dish_list, dishes)
 
-        # 3. 创建 Order 和 OrderItem，并更新库存 (在同一个事务中)
+        # 3. 创建 Order 和 OrderItem (与库存扣减在同一个事务中)
         # 计算初始总价 (Decimal)
-        total_price = sum(item['unit_price'] * item['quantity'] for item in items_to_create)
+        total_price = _items_total(items_to_create)
 
         order = Order(
             user_id=user_id,
@@ -139,39 +376,44 @@ def create_order(user_id: int,
         db.session.add(order)
         db.session.flush()  # 需要先 flush 获取 order.order_id
 
-        order_item_objects = []
-        for item_data in items_to_create:
-            order_item = OrderItem(
-                order_id=order.order_id,  # 使用 flush 后获取的 ID
-                dish_id=item_data['dish_id'],
-                quantity=item_data['quantity'],
-                unit_price=item_data['unit_price']  # 使用 Decimal
-            )
-            order_item_objects.append(order_item)
-        db.session.add_all(order_item_objects)
-
-        # 扣减库存
-        for dish, quantity_to_reduce in dishes_to_update_stock.items():
-            # 再次检查库存避免并发问题（或者使用数据库锁）
-            # if dish.stock < quantity_to_reduce: # 在循环外统一检查可能更好
-            #     raise BusinessError(...)
-            dish.stock -= quantity_to_reduce
-            logger.info(
-                f"菜品 '{dish.name}' (ID: {dish.dish_id}) 库存扣减 {quantity_to_reduce}，剩余 {dish.stock}。")
+        # 订单项走 Core executemany 批量插入，绕过逐对象的 unit-of-work 开销
+        item_ids = _bulk_insert_order_items(order.order_id, items_to_create)
+        record_event(OrderEventType.CREATED, order.order_id, {
+            "user_id": user_id,
+            "area_id": area_id,
+            "state": OrderState.PENDING.name,
+            "price": str(total_price),
+            "items": [{"dish_id": item['dish_id'], "quantity": item['quantity'],
+                       "unit_price": str(item['unit_price'])} for item in items_to_create],
+        })
+        order_id = order.order_id
+        if idempotency_key:
+            idempotency_service.claim(user_id, idempotency_key, request_hash, order_id)
 
         # 提交整个事务
         db.session.commit()
 
-        logger.info(f"订单 (ID: {order.order_id}) 创建成功，总价: {order.price:.2f}。")
-        # 返回序列化后的订单信息 (包含订单项)
-        # 需要重新加载 order_items，因为它们是在 commit 后才完全关联的
-        # 或者直接构建返回字典
-        return _serialize_order(order, include_items=True)  # 尝试序列化
+        logger.info(f"订单 (ID: {order_id}) 创建成功，总价: {total_price:.2f}，共 {len(item_ids)} 个订单项。")
+        # 订单项直接由输入构建，避免 commit 后重新加载 order_items 及其菜品
+        result = _serialize_order(order, include_items=False)
+        result["items"] = _created_items_response(order_id, item_ids, items_to_create)
+        if idempotency_key:
+            idempotency_service.store_response(user_id, idempotency_key, request_hash, result)
+        return result
 
     except (NotFoundError, ValidationError, BusinessError) as e:
         db.session.rollback()  # 业务逻辑错误也需要回滚
         logger.warning(f"创建订单失败 ({type(e).__name__}): {e}")
         raise e  # 重新抛出，让全局处理器处理
+    except IntegrityError as e:
+        db.session.rollback()
+        # 同一幂等键的并发请求已先行提交：本事务（含库存扣减）回滚，返回首次结果
+        replay = idempotency_service.find_response(user_id, idempotency_key,
+                                                   request_hash) if idempotency_key else None
+        if replay is not None:
+            return replay
+        logger.error(f"创建订单时发生数据库完整性错误: {e}", exc_info=True)
+        raise APIException("创建订单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
     except SQLAlchemyError as e:
         db.session.rollback()
         logger.error(f"创建订单时发生数据库错误: {e}", exc_info=True)
@@ -183,14 +425,212 @@ def create_order(user_id: int,
                            error_code=ErrorCode.INTERNAL_SERVER_ERROR.value)
 
 
+# --- 批量创建订单 (团餐 / 宴会) ---
+def create_orders_batch(operator_id: int,
+                        operator_role: str,
+                        sub_orders: List[Dict[str, Any]],
+                        area_id: Optional[int] = None,
+                        atomic: bool = False,
+                        idempotency_key: Optional[str] = None,
+                        request_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    在一个事务中创建多个子订单（如一桌宴会每位客人一单）。
+
+    用户、区域各一次 IN 查询；全部子订单涉及的菜品一次加载并按 dish_id 升序加锁，
+    各子订单依次在内存中校验并扣减库存；订单批量 flush，订单项一次 executemany 插入。
+
+    Args:
+        operator_id: 提交人 ID。
+        operator_role: 提交人角色，仅管理员/员工可为其他用户下单。
+        sub_orders: [{"dish_list": [...], "user_id": 可选, 默认提交人, "area_id": 可选}, ...]。
+        area_id: 子订单未指定区域时使用的区域 (可选)。
+        atomic: True 时任一子订单失败即整体回滚；False 时只跳过失败的子订单。
+        idempotency_key: 客户端 Idempotency-Key (可选)，登记在第一个创建的订单上并与完整响应一同提交。
+        request_hash: 请求体摘要，与 idempotency_key 一同提供。
+
+    Returns:
+        {"created": n, "failed": m, "results": [...]}，results 与 sub_orders 一一对应：
+        成功为 {"index", "status": "created", "order"}，失败为 {"index", "status": "failed", "error_code", "message"}。
+
+    Raises:
+        BusinessError: atomic 模式下有子订单失败（返回第一个失败的原因）。
+        APIException: 如果发生数据库错误。
+    """
+    is_admin_or_staff = operator_role.upper() in [UserRole.ADMIN.name, UserRole.STAFF.name]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(sub_orders)
+
+    def _fail(index: int, error: APIException):
+        results[index] = {"index": index, "status": "failed", "error_code": error.error_code,
+                          "message": error.message}
+
+    # 1. 输入与权限校验；用户、区域各一次查询
+    targets: Dict[int, tuple] = {}  # {index: (user_id, area_id, dish_list)}
+    for index, sub_order in enumerate(sub_orders):
+        user_id = sub_order.get('user_id')
+        user_id = operator_id if user_id is None else user_id
+        try:
+            if user_id != operator_id and not is_admin_or_staff:
+                raise AuthorizationError("只有管理员或员工可以为其他用户下单。")
+            _validate_dish_list(sub_order.get('dish_list'))
+        except (AuthorizationError, ValidationError, BusinessError) as e:
+            _fail(index, e)
+            continue
+        sub_area_id = sub_order.get('area_id')
+        targets[index] = (user_id, area_id if sub_area_id is None else sub_area_id, sub_order['dish_list'])
+
+    user_ids = {user_id for user_id, _, _ in targets.values()}
+    area_ids = {sub_area_id for _, sub_area_id, _ in targets.values() if sub_area_id is not None}
+    known_users = set(db.session.scalars(select(User.user_id).where(User.user_id.in_(user_ids)))) \
+        if user_ids else set()
+    known_areas = set(db.session.scalars(select(DiningArea.area_id).where(DiningArea.area_id.in_(area_ids)))) \
+        if area_ids else set()
+    for index, (user_id, sub_area_id, _) in list(targets.items()):
+        if user_id not in known_users:
+            _fail(index, NotFoundError(f"用户 ID {user_id} 不存在。", error_code=ErrorCode.USER_NOT_FOUND.value))
+        elif sub_area_id is not None and sub_area_id not in known_areas:
+            _fail(index, NotFoundError(f"用餐区域 ID {sub_area_id} 不存在。",
+                                       error_code=ErrorCode.AREA_NOT_FOUND.value))
+        else:
+            continue
+        del targets[index]
+
+    try:
+        # 2. 一次加载全部菜品并加锁，逐个子订单扣减库存
+        dishes = _load_dishes_for_reservation(
+            sorted({item['dish_id'] for _, _, dish_list in targets.values() for item in dish_list}))
+        # 分片菜品一次按序锁定全部分片，子订单在内存中分配，最后按 dish_id 升序写回
+        shard_stock = stock_shard_service.lock_totals(
+            dish_id for dish_id, dish in dishes.items() if dish.stock_shards)
+        initial_shard_stock = dict(shard_stock)
+        accepted: List[int] = []
+        for index, (_, _, dish_list) in targets.items():
+            try:
+                _deduct_stock(_aggregate_quantities(dish_list), dishes, shard_stock=shard_stock)
+            except BusinessError as e:
+                _fail(index, e)
+                continue
+            accepted.append(index)
+
+        failures = [result for result in results if result is not None]
+        if atomic and failures:
+            first = failures[0]
+            raise BusinessError(f"第 {first['index'] + 1} 个子订单无法创建: {first['message']}",
+                                error_code=first['error_code'])
+        if not accepted:
+            db.session.rollback()
+            return _batch_result(results)
+
+        for dish_id in sorted(shard_stock):
+            stock_shard_service.deduct_locked(dish_id, initial_shard_stock[dish_id] - shard_stock[dish_id])
+
+        # 3. 批量插入订单与订单项 (与库存扣减在同一个事务中)
+        items_by_index = {index: _items_to_create(targets[index][2], dishes) for index in accepted}
+        orders = {index: Order(
+            user_id=targets[index][0],
+            area_id=targets[index][1],
+            state=OrderState.PENDING,
+            price=_items_total(items_by_index[index])
+        ) for index in accepted}
+        db.session.add_all(list(orders.values()))
+        db.session.flush()
+
+        order_ids = {index: orders[index].order_id for index in accepted}
+        item_ids = _bulk_insert_items_for_orders({order_ids[index]: items_by_index[index] for index in accepted})
+        for index in accepted:
+            record_event(OrderEventType.CREATED, order_ids[index], {
+                "user_id": targets[index][0],
+                "area_id": targets[index][1],
+                "state": OrderState.PENDING.name,
+                "price": str(orders[index].price),
+                "items": [{"dish_id": item['dish_id'], "quantity": item['quantity'],
+                           "unit_price": str(item['unit_price'])} for item in items_by_index[index]],
+            })
+
+        # 提交前一次投影查询取回全部新订单（订单项由输入构建），
+        # 以便完整的批量响应与幂等键同事务写入，重放时原样返回
+        orders_data = {data['order_id']: data for data in _rows_to_order_dicts(
+            db.session.execute(_order_projection_select().where(
+                Order.order_id.in_(list(order_ids.values())))).all(), include_items=False)}
+        for index in accepted:
+            order_id = order_ids[index]
+            order_data = orders_data[order_id]
+            order_data["items"] = _created_items_response(order_id, item_ids[order_id], items_by_index[index])
+            results[index] = {"index": index, "status": "created", "order": order_data}
+        result = _batch_result(results)
+        if idempotency_key:
+            idempotency_service.claim(operator_id, idempotency_key, request_hash, order_ids[accepted[0]],
+                                      response=result)
+
+        db.session.commit()
+        logger.info(f"用户 {operator_id} 批量下单：创建 {len(accepted)} 个订单，"
+                    f"失败 {len(sub_orders) - len(accepted)} 个。")
+        if idempotency_key:
+            idempotency_service.cache_response(operator_id, idempotency_key, request_hash, result)
+        return result
+
+    except BusinessError as e:
+        db.session.rollback()
+        logger.warning(f"批量下单失败: {e}")
+        raise e
+    except IntegrityError as e:
+        db.session.rollback()
+        replay = idempotency_service.find_response(operator_id, idempotency_key,
+                                                   request_hash) if idempotency_key else None
+        if replay is not None:
+            return replay
+        logger.error(f"批量下单时发生数据库完整性错误: {e}", exc_info=True)
+        raise APIException("批量下单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"批量下单时发生数据库错误: {e}", exc_info=True)
+        raise APIException("批量下单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+
+
+def _batch_result(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    created_count = sum(1 for result in results if result["status"] == "created")
+    return {"created": created_count, "failed": len(results) - created_count, "results": results}
+
+
+# --- 订单项菜品快照回填 ---
+def backfill_dish_snapshots(batch_size: int = 1000) -> int:
+    """
+    为早期未记录菜品快照的订单项（含已归档订单项）回填下单时的菜品名称与图片，
+    按 order_item_id 分批更新并提交。可在 flask shell 中执行，返回回填的订单项数。
+    """
+    total = 0
+    for source in (OrderItem, OrderItemArchive):
+        last_id = 0
+        while True:
+            item_ids = list(db.session.scalars(
+                select(source.order_item_id)
+                .where(source.dish_name.is_(None), source.order_item_id > last_id)
+                .order_by(source.order_item_id)
+                .limit(batch_size)))
+            if not item_ids:
+                break
+            dish = select(Dish).where(Dish.dish_id == source.dish_id)
+            db.session.execute(
+                update(source)
+                .where(source.order_item_id.in_(item_ids))
+                .values(dish_name=dish.with_only_columns(Dish.name).scalar_subquery(),
+                        dish_image_url=dish.with_only_columns(Dish.image_url).scalar_subquery())
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+            total += len(item_ids)
+            last_id = item_ids[-1]
+    logger.info(f"已为 {total} 个订单项回填菜品快照。")
+    return total
+
+
 # --- 查询订单 ---
-def get_order_by_id(order_id: int, include_items: bool = True) -> Dict[str, Any]:
+def get_order_by_id(order_id: int, include_items: bool = True, include_archive: bool = False) -> Dict[str, Any]:
     """
     根据订单 ID 获取订单信息，可选是否包含订单项。
 
     Args:
         order_id: 订单 ID。
         include_items: 是否包含订单项详情。
+        include_archive: 热表中不存在时是否继续查找已归档订单。
 
     Returns:
         包含订单信息的字典。
@@ -200,12 +640,18 @@ def get_order_by_id(order_id: int, include_items: bool = True) -> Dict[str, Any]
     """
     query = Order.query
     if include_items:
-        # 预加载订单项及其关联的菜品信息
-        query = query.options(selectinload(Order.order_items).joinedload(OrderItem.dish))
+        # 预加载订单项；菜品名称与图片取自订单项快照，无需联表 Dish
+        query = query.options(selectinload(Order.order_items))
     # 预加载用户信息和区域信息（如果序列化需要）
     query = query.options(joinedload(Order.user), joinedload(Order.dining_area))
 
     order = query.get(order_id)
+    if not order and include_archive:
+        rows = db.session.execute(
+            _order_projection_select(OrderArchive).where(OrderArchive.order_id == order_id)).all()
+        if rows:
+            logger.info(f"成功检索到已归档订单: ID={order_id}")
+            return _rows_to_order_dicts(rows, include_items, archived=True)[0]
     if not order:
         logger.warning(f"尝试获取不存在的订单: order_id={order_id}")
         raise NotFoundError(f"ID 为 {order_id} 的订单未找到。",
@@ -215,13 +661,15 @@ def get_order_by_id(order_id: int, include_items: bool = True) -> Dict[str, Any]
     return _serialize_order(order, include_items=include_items)
 
 
-def get_orders_by_user(user_id: int, include_items: bool = False) -> List[Dict[str, Any]]:
+def get_orders_by_user(user_id: int, include_items: bool = False,
+                       include_archive: bool = False) -> List[Dict[str, Any]]:
     """
     获取指定用户的所有订单列表，可选是否包含订单项。
 
     Args:
         user_id: 用户 ID。
         include_items: 是否包含每个订单的订单项详情。
+        include_archive: 是否包含已归档的历史订单（按创建时间与近期订单合并排序）。
 
     Returns:
         包含订单信息字典的列表。
@@ -235,13 +683,18 @@ def get_orders_by_user(user_id: int, include_items: bool = False) -> List[Dict[s
         raise NotFoundError(f"用户 ID {user_id} 不存在。", error_code=ErrorCode.USER_NOT_FOUND.value)
 
     try:
-        query = Order.query.filter_by(user_id=user_id)
-        if include_items:
-            query = query.options(selectinload(Order.order_items).joinedload(OrderItem.dish))
         # 按创建时间降序排列
-        orders = query.order_by(Order.created_at.desc()).all()
-
-        order_list = [_serialize_order(order, include_items=include_items) for order in orders]
+        stmt = (_order_projection_select()
+                .where(Order.user_id == user_id)
+                .order_by(Order.created_at.desc()))
+        order_list = _rows_to_order_dicts(db.session.execute(stmt).all(), include_items)
+        if include_archive:
+            archive_stmt = (_order_projection_select(OrderArchive)
+                            .where(OrderArchive.user_id == user_id)
+                            .order_by(OrderArchive.created_at.desc()))
+            order_list += _rows_to_order_dicts(db.session.execute(archive_stmt).all(), include_items,
+                                               archived=True)
+            order_list.sort(key=lambda o: o["created_at"] or "", reverse=True)
         logger.info(f"成功检索到用户 {user_id} 的 {len(order_list)} 个订单。")
         return order_list
     except SQLAlchemyError as e:
@@ -249,6 +702,7 @@ def get_orders_by_user(user_id: int, include_items: bool = False) -> List[Dict[s
         raise APIException("获取用户订单列表失败。", error_code=ErrorCode.DATABASE_ERROR.value)
 
 
+@read_only
 def list_all_orders(page: int = 1,
                     per_page: int = 10,
                     include_items: bool = False) -> Dict[str, Any]:
@@ -275,22 +729,17 @@ def list_all_orders(page: int = 1,
     """
     logger.debug(f"调用 list_all_orders: page={page}, per_page={per_page}, include_items={include_items}")
     try:
-        query = Order.query
-        if include_items:
-            query = query.options(selectinload(Order.order_items).joinedload(OrderItem.dish))
-        # 预加载用户信息和区域信息
-        query = query.options(joinedload(Order.user), joinedload(Order.dining_area))
-
-        # 添加排序，例如按创建时间降序
-        query = query.order_by(Order.created_at.desc())
-
-        # 使用 paginate 进行分页
-        pagination = query.paginate(page=page, per_page=per_page,
-                                    error_out=False)  # error_out=False 避免页码超出范围时抛异常
+        # 先对订单 ID 分页（按创建时间降序），再按 ID 投影查询本页数据
+        id_stmt = select(Order.order_id).order_by(Order.created_at.desc(), Order.order_id.desc())
+        pagination = db.paginate(id_stmt, page=page, per_page=per_page,
+                                 error_out=False)  # error_out=False 避免页码超出范围时抛异常
         logger.debug(f"分页结果: 当前页={page}, 每页={per_page}, 总数={pagination.total}, 总页数={pagination.pages}")
 
-        orders_data = [_serialize_order(order, include_items=include_items) for order in
-                       pagination.items]
+        page_ids = list(pagination.items)
+        rows = db.session.execute(_order_projection_select().where(Order.order_id.in_(page_ids))).all()
+        position = {order_id: index for index, order_id in enumerate(page_ids)}
+        rows.sort(key=lambda row: position[row[0]])
+        orders_data = _rows_to_order_dicts(rows, include_items)
         logger.debug(f"序列化订单数量: {len(orders_data)}")
 
         result = {
@@ -307,10 +756,211 @@ def list_all_orders(page: int = 1,
         raise APIException("获取订单列表失败。", error_code=ErrorCode.DATABASE_ERROR.value)
 
 
+def get_orders_by_ids(order_ids: List[int], include_items: bool = True) -> List[Dict[str, Any]]:
+    """按 ID 批量投影查询订单，结果顺序与 order_ids 一致（不存在的订单被忽略）。"""
+    if not order_ids:
+        return []
+    rows = db.session.execute(_order_projection_select().where(Order.order_id.in_(order_ids))).all()
+    position = {order_id: index for index, order_id in enumerate(order_ids)}
+    rows.sort(key=lambda row: position[row[0]])
+    return _rows_to_order_dicts(rows, include_items)
+
+
+def list_kitchen_queue(limit: int = 100) -> List[Dict[str, Any]]:
+    """后厨待制作队列：已支付 (PAID) 的订单按创建时间升序，包含订单项。"""
+    rows = db.session.execute(
+        _order_projection_select()
+        .where(Order.state == OrderState.PAID, Order.deleted_at.is_(None))
+        .order_by(Order.created_at, Order.order_id)
+        .limit(limit)).all()
+    return _rows_to_order_dicts(rows, include_items=True)
+
+
+@read_only
+def list_orders_keyset(limit: int = 20,
+                       cursor: Optional[str] = None,
+                       include_items: bool = False,
+                       user_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    按 (created_at, order_id) 降序的游标分页，每页开销只与 limit 相关，不执行 COUNT 和 OFFSET。
+
+    Args:
+        limit: 每页数量。
+        cursor: 上一页返回的 next_cursor，为空表示第一页。
+        include_items: 是否包含订单项详情。
+        user_id: 仅查询该用户的订单 (可选)。
+
+    Returns:
+        {
+            "items": [...],
+            "per_page": int,
+            "next_cursor": str | None,  # 为 None 表示没有更多数据
+            "estimated_total": int      # 缓存的总数，可能略有滞后
+        }
+
+    Raises:
+        ValidationError: 游标无效。
+        APIException: 如果发生数据库错误。
+    """
+    position = decode_time_id_cursor(cursor)
+    try:
+        stmt = _order_projection_select()
+        if user_id is not None:
+            stmt = stmt.where(Order.user_id == user_id)
+        if position is not None:
+            created_at, last_id = position
+            stmt = stmt.where(or_(Order.created_at < created_at,
+                                  and_(Order.created_at == created_at, Order.order_id < last_id)))
+
+        # 多取一条判断是否还有下一页
+        rows = db.session.execute(
+            stmt.order_by(Order.created_at.desc(), Order.order_id.desc()).limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = encode_time_id_cursor(last.created_at, last.order_id)
+        return {
+            "items": _rows_to_order_dicts(rows, include_items),
+            "per_page": limit,
+            "next_cursor": next_cursor,
+            "estimated_total": _estimated_order_total(user_id),
+        }
+    except SQLAlchemyError as e:
+        logger.error(f"游标分页获取订单列表时发生数据库错误: {e}", exc_info=True)
+        raise APIException("获取订单列表失败。", error_code=ErrorCode.DATABASE_ERROR.value)
+
+
+@read_only
+def _estimated_order_total(user_id: Optional[int] = None) -> int:
+    """订单总数（全部或某用户），按 ORDER_TOTAL_CACHE_SECONDS 缓存，避免每页 COUNT(*)。"""
+    def _count() -> int:
+        stmt = select(func.count(Order.order_id))
+        if user_id is not None:
+            stmt = stmt.where(Order.user_id == user_id)
+        return db.session.scalar(stmt)
+
+    return _order_total_cache.get_or_load(user_id, _count)
+
+
+# --- 导出订单 ---
+EXPORT_FORMATS = ("csv", "ndjson")
+_EXPORT_CSV_COLUMNS = ("order_id", "user_id", "area_id", "state", "price", "payment_method",
+                       "created_at", "order_item_id", "dish_id", "dish_name", "quantity",
+                       "unit_price", "item_total")
+
+
+def export_orders(fmt: str,
+                  start: Optional[datetime] = None,
+                  end: Optional[datetime] = None,
+                  state: Optional[str] = None) -> Iterator[str]:
+    """
+    流式导出订单及订单项（财务对账用），返回逐块产出文本的生成器。
+
+    参数在调用时即完成校验；数据通过服务端游标（yield_per）分批读取，
+    内存占用与导出总量无关。调用方需在请求上下文中消费生成器（stream_with_context）。
+
+    Args:
+        fmt: 'csv'（每个订单项一行）或 'ndjson'（每个订单一行，含 items 数组）。
+        start: 创建时间下限 (含)。
+        end: 创建时间上限 (不含)。
+        state: 订单状态过滤 (可选)。
+
+    Raises:
+        ValidationError: 格式、时间范围或状态无效。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValidationError(f"不支持的导出格式: {fmt}，可选 {', '.join(EXPORT_FORMATS)}。",
+                              error_code=ErrorCode.PARAM_INVALID.value)
+    if start and end and start >= end:
+        raise ValidationError("导出开始时间必须早于结束时间。", error_code=ErrorCode.PARAM_INVALID.value)
+    try:
+        order_state = OrderState(state.upper()) if state else None
+    except ValueError:
+        raise ValidationError(f"无效的订单状态值: {state}", error_code=ErrorCode.PARAM_INVALID.value)
+
+    # 菜品名称取订单项快照，早期未快照的订单项回退到 Dish
+    stmt = (select(Order.order_id, Order.user_id, Order.area_id, Order.state, Order.price,
+                   Order.payment_method, Order.created_at, OrderItem.order_item_id,
+                   OrderItem.dish_id, func.coalesce(OrderItem.dish_name, Dish.name), OrderItem.quantity,
+                   OrderItem.unit_price)
+            .select_from(Order)
+            .outerjoin(OrderItem, OrderItem.order_id == Order.order_id)
+            .outerjoin(Dish, Dish.dish_id == OrderItem.dish_id)
+            .where(Order.deleted_at.is_(None))
+            .order_by(Order.order_id, OrderItem.order_item_id))
+    if start:
+        stmt = stmt.where(Order.created_at >= start)
+    if end:
+        stmt = stmt.where(Order.created_at < end)
+    if order_state:
+        stmt = stmt.where(Order.state == order_state)
+
+    logger.info(f"开始导出订单: format={fmt}, start={start}, end={end}, state={state}")
+    rows = _iter_export_rows(stmt.execution_options(yield_per=Config.ORDER_EXPORT_BATCH_SIZE))
+    return _export_csv(rows) if fmt == "csv" else _export_ndjson(rows)
+
+
+def _iter_export_rows(stmt) -> Iterator[Dict[str, Any]]:
+    """以服务端游标逐行读取，转换为可序列化的扁平字典。"""
+    for (order_id, user_id, area_id, state, price, payment_method, created_at,
+         item_id, dish_id, dish_name, quantity, unit_price) in db.session.execute(stmt):
+        yield {
+            "order_id": order_id,
+            "user_id": user_id,
+            "area_id": area_id,
+            "state": state.name,
+            "price": str(price),
+            "payment_method": payment_method.name if payment_method else None,
+            "created_at": created_at.isoformat() if created_at else None,
+            "order_item_id": item_id,
+            "dish_id": dish_id,
+            "dish_name": dish_name,
+            "quantity": quantity,
+            "unit_price": str(unit_price) if unit_price is not None else None,
+            "item_total": str(quantity * unit_price) if item_id is not None else None,
+        }
+
+
+def _export_csv(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_EXPORT_CSV_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % Config.ORDER_EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+    logger.info(f"订单 CSV 导出完成，共 {count} 行。")
+
+
+def _export_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """按 order_id 将连续的订单项行合并为一个订单对象，每个订单输出一行 JSON。"""
+    count = 0
+    for order_id, group in groupby(rows, key=lambda row: row["order_id"]):
+        group = list(group)
+        head = group[0]
+        order = {key: head[key] for key in ("order_id", "user_id", "area_id", "state", "price",
+                                            "payment_method", "created_at")}
+        order["items"] = [{key: row[key] for key in ("order_item_id", "dish_id", "dish_name",
+                                                     "quantity", "unit_price", "item_total")}
+                          for row in group if row["order_item_id"] is not None]
+        count += 1
+        yield json.dumps(order, ensure_ascii=False) + "\n"
+    logger.info(f"订单 NDJSON 导出完成，共 {count} 个订单。")
+
+
 # --- 更新订单 ---
 def update_order_details(order_id: int, update_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     更新订单的详细信息 (例如状态、支付方式、凭证 URL)。
+    状态改为 CANCELED（含已支付订单）时与 cancel_order 一样恢复库存并写入 CANCELED 事件。
 
     Args:
         order_id: 要更新的订单 ID。
@@ -335,6 +985,8 @@ def update_order_details(order_id: int, update_data: Dict[str, Any]) -> Dict[str
         raise BusinessError("不能修改已删除的订单。", error_code=ErrorCode.HTTP_CONFLICT.value)
 
     updated = False
+    previous_state = order.state
+    target_state = None
     processed_data = {k: v for k, v in update_data.items() if v is not None}  # 忽略 None
 
     allowed_fields = ['state', 'payment_method', 'image_url']
@@ -350,26 +1002,17 @@ def update_order_details(order_id: int, update_data: Dict[str, Any]) -> Dict[str
             if key == 'state':
                 try:
                     new_state = OrderState(value)  # 尝试从值创建枚举
-                    # 检查状态转换是否有效 (业务逻辑)
-                    # 例如：不能从 COMPLETED 或 CANCELED 变回 PENDING 或 PAID
-                    if order.state in [OrderState.COMPLETED,
-                                       OrderState.CANCELED] and new_state != order.state:
-                        raise BusinessError(
-                            f"不能将状态从 {order.state.name} 更改为 {new_state.name}。",
-                            error_code=ErrorCode.ORDER_STATE_INVALID.value)
-                    # 例如：只能从 PENDING 变为 PAID 或 CANCELED (这个逻辑在模型的 can_be_canceled 和 mark_as_canceled 中有部分体现)
-                    if order.state == OrderState.PENDING and new_state not in [OrderState.PAID,
-                                                                               OrderState.CANCELED,
-                                                                               OrderState.PENDING]:
-                        raise BusinessError(f"不能将状态从 PENDING 直接更改为 {new_state.name}。",
-                                            error_code=ErrorCode.ORDER_STATE_INVALID.value)
-
-                    if current_value != new_state:
-                        order.state = new_state
-                        updated = True
                 except ValueError:  # 无效的枚举值
                     raise ValidationError(f"无效的订单状态值: {value}",
                                           error_code=ErrorCode.PARAM_INVALID.value)
+                # 按状态机检查转换是否有效；状态本身在提交前以条件 UPDATE 写入
+                if current_value != new_state:
+                    if not Order.is_valid_transition(current_value, new_state):
+                        raise BusinessError(
+                            f"不能将状态从 {current_value.name} 更改为 {new_state.name}。",
+                            error_code=ErrorCode.ORDER_STATE_INVALID.value)
+                    target_state = new_state
+                    updated = True
             elif key == 'payment_method':
                 try:
                     new_payment_method = PaymentMethod(value) if value else None
@@ -398,16 +1041,134 @@ def update_order_details(order_id: int, update_data: Dict[str, Any]) -> Dict[str
         return _serialize_order(order)
 
     try:
+        if target_state is not None:
+            # 条件更新：仅当状态仍为读取时的值才写入，并发修改时失败而不是相互覆盖
+            _compare_and_set_state(order_id, previous_state, target_state)
+        if target_state == OrderState.CANCELED:
+            # 与 cancel_order 一致：恢复库存 (含分片) 并写入带订单项的 CANCELED 事件
+            _restore_stock_for_orders([order_id])
+            record_event(OrderEventType.CANCELED, order_id, {
+                "user_id": order.user_id,
+                "previous_state": previous_state.name,
+                "price": str(order.price),
+                "items": [{"dish_id": item.dish_id, "quantity": item.quantity}
+                          for item in order.order_items],
+            })
+        else:
+            record_event(OrderEventType.UPDATED, order_id, {
+                "user_id": order.user_id,
+                "previous_state": previous_state.name,
+                "state": (target_state or previous_state).name,
+                "payment_method": order.payment_method.name if order.payment_method else None,
+                "price": str(order.price),
+                "order_created_at": order.created_at.isoformat() if order.created_at else None,
+            })
         # updated_at 由 onupdate 自动处理
         db.session.commit()
         logger.info(f"订单 {order_id} 信息更新成功。")
         return _serialize_order(order)
+    except BusinessError:
+        db.session.rollback()
+        raise
     except SQLAlchemyError as e:
         db.session.rollback()
         logger.error(f"更新订单 {order_id} 时发生数据库错误: {e}", exc_info=True)
         raise APIException("更新订单信息失败。", error_code=ErrorCode.DATABASE_ERROR.value)
 
 
+def _compare_and_set_state(order_id: int, expected: OrderState, target: OrderState):
+    """
+    条件更新订单状态（不 commit）：UPDATE ... WHERE order_id=:id AND state=:expected。
+    影响行数为 0 说明状态已被并发修改，抛出 409。
+    """
+    result = db.session.execute(
+        update(Order)
+        .where(Order.order_id == order_id, Order.state == expected)
+        .values(state=target)
+        .execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        raise BusinessError(f"订单 {order_id} 的状态已被其他操作修改，请刷新后重试。",
+                            error_code=ErrorCode.ORDER_STATE_CONFLICT.value,
+                            http_status_code=HTTPStatus.CONFLICT)
+    logger.info(f"订单 {order_id} 状态 {expected.name} -> {target.name}。")
+
+
+def bulk_transition_orders(order_ids: List[int], target: str) -> Dict[str, Any]:
+    """
+    批量状态转换（如后厨将一批订单标记为 COMPLETED）：按 ID 升序锁定候选订单后以单条条件 UPDATE 完成。
+    取消订单涉及库存恢复，不走此接口。
+
+    Args:
+        order_ids: 订单 ID 列表。
+        target: 目标状态。
+
+    Returns:
+        {"updated": [order_id, ...], "skipped": [{"order_id", "state", "reason"}, ...]}
+
+    Raises:
+        ValidationError: 目标状态无效或为 CANCELED / PENDING。
+        APIException: 如果发生数据库错误。
+    """
+    try:
+        target_state = OrderState(target)
+    except ValueError:
+        raise ValidationError(f"无效的订单状态值: {target}", error_code=ErrorCode.PARAM_INVALID.value)
+    sources = Order.source_states(target_state)
+    if target_state == OrderState.CANCELED or not sources:
+        raise ValidationError(f"不支持批量转换到 {target_state.name}。",
+                              error_code=ErrorCode.PARAM_INVALID.value)
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return {"updated": [], "skipped": []}
+
+    try:
+        # 按 order_id 升序锁定候选订单，再对满足条件的行执行条件 UPDATE；
+        # 结果与事件均由锁定的行得出，不受并发修改影响
+        locked = {row.order_id: row for row in db.session.execute(
+            select(Order.order_id, Order.user_id, Order.state, Order.price, Order.payment_method,
+                   Order.created_at, Order.deleted_at)
+            .where(Order.order_id.in_(order_ids))
+            .order_by(Order.order_id)
+            .with_for_update())}
+
+        updated, skipped = [], []
+        for order_id in order_ids:
+            row = locked.get(order_id)
+            if row is None:
+                skipped.append({"order_id": order_id, "state": None, "reason": "订单不存在"})
+            elif row.deleted_at is None and row.state in sources:
+                updated.append(order_id)
+            else:
+                reason = "订单已删除" if row.deleted_at is not None else \
+                    f"状态 {row.state.name} 不能转换为 {target_state.name}"
+                skipped.append({"order_id": order_id, "state": row.state.name, "reason": reason})
+
+        if updated:
+            db.session.execute(
+                update(Order)
+                .where(Order.order_id.in_(updated), Order.state.in_(sources),
+                       Order.deleted_at.is_(None))
+                .values(state=target_state)
+                .execution_options(synchronize_session=False))
+        for order_id in updated:
+            row = locked[order_id]
+            record_event(OrderEventType.UPDATED, order_id, {
+                "user_id": row.user_id,
+                "previous_state": row.state.name,
+                "state": target_state.name,
+                "payment_method": row.payment_method.name if row.payment_method else None,
+                "price": str(row.price),
+                "order_created_at": row.created_at.isoformat() if row.created_at else None,
+            })
+        db.session.commit()
+        logger.info(f"批量转换订单到 {target_state.name}: 成功 {len(updated)} 个，跳过 {len(skipped)} 个。")
+        return {"updated": updated, "skipped": skipped}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"批量转换订单状态时发生数据库错误: {e}", exc_info=True)
+        raise APIException("批量更新订单状态失败。", error_code=ErrorCode.DATABASE_ERROR.value)
+
+
 # --- 更新订单项数量 ---
 def update_order_item_quantity(order_id: int, order_item_id: int, quantity: int,
                                operator_id: int) -> Dict[str, Any]:
@@ -457,13 +1218,38 @@ def update_order_item_quantity(order_id: int, order_item_id: int, quantity: int,
                                 error_code=ErrorCode.DISH_NOT_FOUND.value)
 
         diff = quantity - item.quantity
-        if diff > 0 and dish.stock < diff:
-            raise BusinessError(f"库存不足，剩余 {dish.stock}，需要增加 {diff}。",
-                                error_code=ErrorCode.INSUFFICIENT_STOCK.value)
-
+        if dish.stock_shards:
+            if diff > 0 and not stock_shard_service.reserve(dish.dish_id, diff, dish.stock_shards):
+                remaining = stock_shard_service.stock_totals([dish.dish_id])[dish.dish_id]
+                raise BusinessError(f"库存不足，剩余 {remaining}，需要增加 {diff}。",
+                                    error_code=ErrorCode.INSUFFICIENT_STOCK.value)
+            if diff < 0:
+                stock_shard_service.release(dish.dish_id, -diff)
+        elif diff != 0:
+            # 条件 UPDATE 原子地校验并扣减 (或归还) 库存，影响行数为 0 即库存不足
+            result = db.session.execute(
+                update(Dish)
+                .where(Dish.dish_id == dish.dish_id, Dish.stock >= diff)
+                .values(stock=Dish.stock - diff)
+                .execution_options(synchronize_session=False))
+            if result.rowcount == 0:
+                remaining = db.session.scalar(select(Dish.stock).where(Dish.dish_id == dish.dish_id))
+                raise BusinessError(f"库存不足，剩余 {remaining}，需要增加 {diff}。",
+                                    error_code=ErrorCode.INSUFFICIENT_STOCK.value)
+
+        previous_price = order.price
         item.quantity = quantity
-        dish.stock -= diff
         order.price = order.calculate_total_price()
+        record_event(OrderEventType.ITEM_UPDATED, order_id, {
+            "user_id": order.user_id,
+            "order_item_id": order_item_id,
+            "dish_id": item.dish_id,
+            "quantity": quantity,
+            "delta": diff,
+            "previous_price": str(previous_price),
+            "price": str(order.price),
+            "order_created_at": order.created_at.isoformat() if order.created_at else None,
+        })
 
         db.session.commit()
         logger.info(f"更新订单项成功，订单 {order_id}，项 {order_item_id}，新数量 {quantity}。")
@@ -492,15 +1278,13 @@ def cancel_order(order_id: int, operator_id: int, operator_role: str) -> bool:
         True 表示成功取消。
 
     Raises:
-        NotFoundError: 如果订单未找到或订单项中的菜品未找到。
+        NotFoundError: 如果订单未找到。
         AuthorizationError: 如果用户无权取消此订单。
         BusinessError: 如果订单状态不允许取消。
         APIException: 如果发生数据库错误。
     """
-    # 预加载订单项和关联的菜品以更新库存
-    order = Order.query.options(
-        selectinload(Order.order_items).joinedload(OrderItem.dish)
-    ).get(order_id)
+    # 预加载订单项（用于订单事件）
+    order = Order.query.options(selectinload(Order.order_items)).get(order_id)
 
     if not order:
         raise NotFoundError(f"ID 为 {order_id} 的订单未找到。",
@@ -521,23 +1305,19 @@ def cancel_order(order_id: int, operator_id: int, operator_role: str) -> bool:
                             error_code=ErrorCode.ORDER_STATE_INVALID.value)
 
     try:
-        # 恢复库存
-        for item in order.order_items:
-            # 这里的 item.dish 应该已经被预加载了
-            if item.dish:
-                item.dish.stock += item.quantity
-                logger.info(
-                    f"恢复菜品 '{item.dish.name}' (ID: {item.dish.dish_id}) 库存 {item.quantity}，剩余 {item.dish.stock}。")
-            else:
-                # 理论上不应发生，因为创建订单时检查了菜品存在性
-                logger.error(
-                    f"取消订单 {order_id} 时，订单项 {item.order_item_id} 关联的菜品 ID {item.dish_id} 未找到！")
-                # 决定是继续取消还是抛异常？这里选择抛异常保证数据一致性
-                raise NotFoundError(f"订单项关联的菜品 ID {item.dish_id} 未找到。",
-                                    error_code=ErrorCode.DISH_NOT_FOUND.value)
+        # 先以条件更新抢占状态转换，并发的取消 / 支付只有一个能成功，避免重复恢复库存
+        _compare_and_set_state(order_id, OrderState.PENDING, OrderState.CANCELED)
+
+        # 恢复库存：单条聚合 UPDATE，在数据库内原子累加，避免读-改-写覆盖并发下单的扣减
+        _restore_stock_for_orders([order_id])
 
-        # 标记订单为取消状态
-        order.mark_as_canceled()  # 调用模型方法标记状态
+        record_event(OrderEventType.CANCELED, order_id, {
+            "user_id": order.user_id,
+            "previous_state": OrderState.PENDING.name,
+            "price": str(order.price),
+            "items": [{"dish_id": item.dish_id, "quantity": item.quantity}
+                      for item in order.order_items],
+        })
 
         # 提交事务
         db.session.commit()
@@ -554,6 +1334,156 @@ def cancel_order(order_id: int, operator_id: int, operator_role: str) -> bool:
         raise APIException("取消订单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
 
 
+def _restore_stock_for_orders(order_ids: List[int]):
+    """
+    恢复一批订单占用的库存（不 commit）：按菜品聚合数量后以一条 UPDATE 写回，
+    UPDATE dish ... FROM (SELECT dish_id, SUM(quantity) ... GROUP BY dish_id)，
+    各数据库方言（MySQL 多表 UPDATE / UPDATE ... FROM）由 SQLAlchemy 负责生成。
+    """
+    if not order_ids:
+        return
+    restored = (select(OrderItem.dish_id, func.sum(OrderItem.quantity).label("quantity"))
+                .where(OrderItem.order_id.in_(order_ids))
+                .group_by(OrderItem.dish_id)
+                .subquery())
+    result = db.session.execute(
+        update(Dish)
+        .where(Dish.dish_id == restored.c.dish_id, Dish.stock_shards == 0)
+        .values(stock=Dish.stock + restored.c.quantity)
+        .execution_options(synchronize_session=False))
+    # 分片菜品的库存归还到分片 0（不依赖分片菜品集合缓存：其他进程刚开启分片的菜品同样需要归还，
+    # 没有分片菜品时不匹配任何行）
+    db.session.execute(
+        update(DishStockShard)
+        .where(DishStockShard.dish_id == restored.c.dish_id, DishStockShard.shard_no == 0)
+        .values(stock=DishStockShard.stock + restored.c.quantity)
+        .execution_options(synchronize_session=False))
+    logger.info(f"已为 {len(order_ids)} 个订单恢复 {result.rowcount} 个菜品的库存。")
+
+
+def _cancel_claimed_pending(claim_stmt) -> Dict[int, Any]:
+    """
+    锁定 claim_stmt 选出的 PENDING 订单行（需选出 order_id / user_id / price），
+    以单条条件 UPDATE 标记为 CANCELED、集合操作恢复库存并写入 CANCELED 事件（不 commit）。
+    返回 {order_id: row}。
+    """
+    claimed = {row.order_id: row for row in db.session.execute(claim_stmt)}
+
+    if claimed:
+        claimed_ids = list(claimed)
+        db.session.execute(
+            update(Order)
+            .where(Order.order_id.in_(claimed_ids), Order.state == OrderState.PENDING)
+            .values(state=OrderState.CANCELED)
+            .execution_options(synchronize_session=False))
+        _restore_stock_for_orders(claimed_ids)
+
+        items_by_order: Dict[int, List[Dict[str, int]]] = {order_id: [] for order_id in claimed_ids}
+        for order_id, dish_id, quantity in db.session.execute(
+                select(OrderItem.order_id, OrderItem.dish_id, OrderItem.quantity)
+                .where(OrderItem.order_id.in_(claimed_ids))):
+            items_by_order[order_id].append({"dish_id": dish_id, "quantity": quantity})
+        for order_id, row in claimed.items():
+            record_event(OrderEventType.CANCELED, order_id, {
+                "user_id": row.user_id,
+                "previous_state": OrderState.PENDING.name,
+                "price": str(row.price),
+                "items": items_by_order[order_id],
+            })
+    return claimed
+
+
+def cancel_orders_bulk(order_ids: Optional[List[int]] = None,
+                       area_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    批量取消 PENDING 订单（例如用餐区域打烊时），并以集合操作恢复库存。
+
+    - 按 order_id 顺序锁定仍为 PENDING 的订单行，单条 UPDATE 标记为 CANCELED；
+    - 库存按菜品聚合后单条 UPDATE 恢复；
+    - 每个被取消的订单写入一条 CANCELED 事件。
+
+    Args:
+        order_ids: 要取消的订单 ID 列表。
+        area_id: 取消该用餐区域下全部 PENDING 订单（与 order_ids 二选一）。
+
+    Returns:
+        {"canceled": [order_id, ...], "skipped": [{"order_id", "state", "reason"}, ...]}
+
+    Raises:
+        ValidationError: 未提供 order_ids 或 area_id。
+        APIException: 如果发生数据库错误。
+    """
+    if not order_ids and area_id is None:
+        raise ValidationError("必须提供 order_ids 或 area_id。", error_code=ErrorCode.PARAM_INVALID.value)
+    order_ids = list(dict.fromkeys(order_ids or []))
+
+    try:
+        claim_stmt = (select(Order.order_id, Order.user_id, Order.price)
+                      .where(Order.state == OrderState.PENDING, Order.deleted_at.is_(None))
+                      .order_by(Order.order_id)
+                      .with_for_update())
+        if order_ids:
+            claim_stmt = claim_stmt.where(Order.order_id.in_(order_ids))
+        if area_id is not None:
+            claim_stmt = claim_stmt.where(Order.area_id == area_id)
+        claimed = _cancel_claimed_pending(claim_stmt)
+
+        skipped = []
+        unclaimed = [order_id for order_id in order_ids if order_id not in claimed]
+        if unclaimed:
+            states = dict(db.session.execute(
+                select(Order.order_id, Order.state).where(Order.order_id.in_(unclaimed))).all())
+            for order_id in unclaimed:
+                state = states.get(order_id)
+                skipped.append({
+                    "order_id": order_id,
+                    "state": state.name if state else None,
+                    "reason": "订单不存在" if state is None else f"订单状态为 {state.name} 或已删除，无法取消"
+                })
+
+        db.session.commit()
+        logger.info(f"批量取消订单完成: 取消 {len(claimed)} 个，跳过 {len(skipped)} 个。")
+        return {"canceled": list(claimed), "skipped": skipped}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"批量取消订单时发生数据库错误: {e}", exc_info=True)
+        raise APIException("批量取消订单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+
+
+def _minutes_ago(minutes: int):
+    """数据库当前时间减去 minutes 分钟的 SQL 表达式，与 created_at 的 server_default now() 同一时钟和时区。"""
+    if db.engine.dialect.name == "sqlite":
+        return func.datetime("now", f"-{int(minutes)} minutes")
+    return func.date_sub(func.now(), text(f"INTERVAL {int(minutes)} MINUTE"))
+
+
+def cancel_expired_pending_orders(ttl_minutes: int, limit: int) -> List[int]:
+    """
+    取消一批创建超过 ttl_minutes 分钟的 PENDING 订单并提交，返回本批取消的订单 ID。
+    截止时间在数据库中计算，不受应用服务器时钟与时区影响。
+    按 (state, created_at) 索引从最旧的订单开始扫描，SKIP LOCKED 跳过正被支付 / 取消的订单行，
+    每批一个短事务，调用方循环调用直到返回数量不足 limit。
+
+    Raises:
+        APIException: 如果发生数据库错误。
+    """
+    claim_stmt = (select(Order.order_id, Order.user_id, Order.price)
+                  .where(Order.state == OrderState.PENDING,
+                         Order.created_at < _minutes_ago(ttl_minutes),
+                         Order.deleted_at.is_(None))
+                  .order_by(Order.created_at, Order.order_id)
+                  .limit(limit)
+                  .with_for_update(skip_locked=True))
+    try:
+        claimed = _cancel_claimed_pending(claim_stmt)
+        db.session.commit()
+        return list(claimed)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"取消超时未支付订单时发生数据库错误: {e}", exc_info=True)
+        raise APIException("取消超时订单失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+
+
 # --- 删除订单 ---
 def delete_order_soft(order_id: int, operator_id: int, operator_role: str) -> bool:
     """
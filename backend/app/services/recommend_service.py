@@ -10,10 +10,16 @@
 
 import logging
 
+from sqlalchemy import select
+
+from app.models.dish import Dish
+from app.recommend.association_rules import BasketRuleRecommender
 from app.recommend.popular import PopularRecommender
 from app.recommend.item_cf import ItemCFRecommender
+from app.recommend.learned_ranker import exposure_logger, get_learned_ranker
 from app.recommend.profile_based import ProfileRecommender
 from app.config import Config
+from app.utils.db import db, read_only
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +33,7 @@ class RecommendationService:
         self.popular = PopularRecommender()
         self.collaborative = ItemCFRecommender()
         self.user_based = ProfileRecommender()
+        self.basket = BasketRuleRecommender()
         logger.info("RecommendationService 初始化完成。")
 
     def _fuse_scores(self, user_id, limit, weights):
@@ -55,7 +62,19 @@ class RecommendationService:
         accumulate_scores(popular_scores, weights[2])
 
         sorted_dishes = sorted(score_map.items(), key=lambda x: x[1], reverse=True)
-        return [dish_id for dish_id, _ in sorted_dishes[:limit]]
+        source_scores = (usercf_scores, itemcf_scores, popular_scores)
+
+        # 可选的学习排序阶段：对整个候选池向量化打分，不可用或超时则保留静态权重排序
+        if Config.RECOMMEND_RANKER_ENABLED:
+            ranked = get_learned_ranker().rank([dish_id for dish_id, _ in sorted_dishes],
+                                               source_scores, Config.RECOMMEND_RANKER_BUDGET_US)
+            if ranked is not None:
+                sorted_dishes = ranked
+
+        result = [dish_id for dish_id, _ in sorted_dishes[:limit]]
+        if Config.RECOMMEND_EXPOSURE_LOG_ENABLED:
+            exposure_logger.log(user_id, result, source_scores)
+        return result
 
     def dish_ids_to_names(self, dish_ids):
         """
@@ -73,6 +92,7 @@ class RecommendationService:
 
     # def dish_ids_to_names(self, dish_ids):
 
+    @read_only
     def recommend(self, user_id, limit=None, strategy=None, weights=None):
         """
         推荐菜品给用户。
@@ -149,3 +169,44 @@ class RecommendationService:
         dish_ids = self._fuse_scores(user_id, limit, weights)
         logger.debug(f"[default-fallback] 推荐融合结果 dish_ids：{dish_ids}")
         return self.dish_ids_to_names(dish_ids)
+
+    @read_only
+    def recommend_basket_addons(self, cart_dish_ids, limit=None):
+        """
+        根据购物车中的菜品推荐“经常一起点”的加购菜品。
+        :param cart_dish_ids: 购物车中的菜品 ID 列表
+        :param limit: 推荐数量
+        :return: 加购菜品列表（仅包含在售菜品），附带 score / confidence / lift
+        """
+        if not limit:
+            limit = Config.RECOMMEND_LIMIT_DEFAULT
+        limit = min(limit, Config.RECOMMEND_LIMIT_MAX)
+
+        # 多取一些候选，留出过滤下架菜品的余量
+        rule_scores = self.basket.recommend_addons(cart_dish_ids, limit * 2)
+        logger.debug(f"[basket] 购物车 {cart_dish_ids} 关联规则候选：{rule_scores}")
+        if not rule_scores:
+            return []
+
+        stmt = select(Dish.dish_id, Dish.name, Dish.price, Dish.image_url).where(
+            Dish.dish_id.in_(rule_scores.keys()),
+            Dish.is_available.is_(True),
+            Dish.deleted_at.is_(None)
+        )
+        dishes = {row.dish_id: row for row in db.session.execute(stmt)}
+
+        result = []
+        for dish_id, stats in rule_scores.items():
+            dish = dishes.get(dish_id)
+            if dish is None:
+                continue
+            result.append({
+                "dish_id": dish_id,
+                "dish_name": dish.name,
+                "price": str(dish.price),
+                "image_url": dish.image_url,
+                **stats
+            })
+            if len(result) >= limit:
+                break
+        return result
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/sales_counter_service.py
+@description  菜品销量的写后（write-behind）计数：订阅订单事件，在内存中按菜品累加销量增量，
+              由后台线程每 SALES_FLUSH_SECONDS 秒以一条批量 UPDATE 写回 dish.sales，
+              下单事务本身不触碰 dish.sales，避免热门菜品行上的锁竞争。
+
+              - 销量口径：非取消订单中的菜品数量（CREATED 累加，ITEM_UPDATED 按差值，
+                取消（CANCELED 事件或 UPDATED 到 CANCELED，如已支付订单被取消）扣减）；
+              - 幂等：增量先暂存在分发事务的会话中，与标记事件已投递同一事务提交后才并入内存，
+                事务回滚（事件将被重新投递）时丢弃，重复投递不会重复计数；
+              - 进程异常退出会丢失尚未写回的增量，可由 order_items 重建：
+                python -m app.services.sales_counter_service。重建会覆盖 dish.sales，
+                必须先停止所有工作进程的分发线程（ORDER_EVENT_DISPATCH_ENABLED=false）并等待其写回，
+                最近 SALES_REBUILD_QUIET_SECONDS 秒内仍有事件被投递时拒绝执行。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from flask import Flask
+from flask_sqlalchemy.session import Session
+from sqlalchemy import case, event, func, select, update
+
+from app.config import Config
+from app.models.dish import Dish
+from app.models.enums import OrderEventType, OrderState
+from app.models.order import Order
+from app.models.order_archive import OrderArchive, OrderItemArchive
+from app.models.order_event import OrderEvent
+from app.models.order_item import OrderItem
+from app.services.order_event_service import subscribe
+from app.utils.db import db
+from app.utils.error_codes import ErrorCode
+from app.utils.exceptions import BusinessError
+
+logger = logging.getLogger(__name__)
+
+_pending: Dict[int, int] = defaultdict(int)
+_pending_lock = threading.Lock()
+# 会话中暂存的增量 {event_id: {dish_id: delta}}，随分发事务提交并入 _pending
+_STAGED_KEY = "sales_deltas_staged"
+
+
+def _add(deltas: Dict[int, int]):
+    with _pending_lock:
+        for dish_id, delta in deltas.items():
+            _pending[dish_id] += delta
+
+
+def _event_deltas(event_dict: Dict[str, Any]) -> Dict[int, int]:
+    """将订单事件换算为各菜品的销量增量；UPDATED 到 CANCELED 的事件不带订单项，需从订单项读取。"""
+    payload = event_dict["payload"]
+    event_type = event_dict["event_type"]
+    deltas: Dict[int, int] = defaultdict(int)
+    if event_type == OrderEventType.CREATED.name:
+        for item in payload.get("items", []):
+            deltas[item["dish_id"]] += item["quantity"]
+    elif event_type == OrderEventType.CANCELED.name:
+        for item in payload.get("items", []):
+            deltas[item["dish_id"]] -= item["quantity"]
+    elif event_type == OrderEventType.ITEM_UPDATED.name:
+        deltas[payload["dish_id"]] += payload.get("delta", 0)
+    elif payload.get("state") == OrderState.CANCELED.name != payload.get("previous_state"):
+        for dish_id, quantity in db.session.execute(
+                select(OrderItem.dish_id, OrderItem.quantity).where(OrderItem.order_id == event_dict["order_id"])):
+            deltas[dish_id] -= quantity
+    return {dish_id: delta for dish_id, delta in deltas.items() if delta}
+
+
+def on_order_event(event_dict: Dict[str, Any]):
+    """
+    订单事件订阅者：将事件换算为销量增量，暂存在分发事务的会话中（按 event_id，同一事件只记一次），
+    事务提交后才累加到内存。
+    """
+    deltas = _event_deltas(event_dict)
+    if deltas:
+        db.session.info.setdefault(_STAGED_KEY, {})[event_dict["event_id"]] = deltas
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_staged_after_commit(session):
+    staged = session.info.pop(_STAGED_KEY, None)
+    if staged:
+        with _pending_lock:
+            for deltas in staged.values():
+                for dish_id, delta in deltas.items():
+                    _pending[dish_id] += delta
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_staged_after_rollback(session, previous_transaction):
+    # 只在整个事务回滚时丢弃；其他订阅者回滚自己的保存点不影响已暂存的增量
+    if previous_transaction.parent is None:
+        session.info.pop(_STAGED_KEY, None)
+
+
+def pending_deltas() -> Dict[int, int]:
+    """当前尚未写回的销量增量（副本）。"""
+    with _pending_lock:
+        return {dish_id: delta for dish_id, delta in _pending.items() if delta}
+
+
+def flush() -> int:
+    """
+    将累积的增量以一条 UPDATE dish SET sales = sales + CASE dish_id ... END 写回并提交。
+    写回失败时增量放回内存，下次重试。需在应用上下文中调用，返回写回的菜品数。
+    """
+    global _pending
+    with _pending_lock:
+        deltas = {dish_id: delta for dish_id, delta in _pending.items() if delta}
+        _pending = defaultdict(int)
+    if not deltas:
+        return 0
+    try:
+        db.session.execute(
+            update(Dish)
+            .where(Dish.dish_id.in_(list(deltas)))
+            # 销量是计数器而非菜品编辑，保留原 updated_at
+            .values(sales=Dish.sales + case(deltas, value=Dish.dish_id, else_=0),
+                    updated_at=Dish.updated_at)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _add(deltas)
+        raise
+    logger.info(f"已写回 {len(deltas)} 个菜品的销量增量。")
+    return len(deltas)
+
+
+def _sold_subquery(orders, items):
+    return (select(func.coalesce(func.sum(items.quantity), 0))
+            .join(orders, orders.order_id == items.order_id)
+            .where(items.dish_id == Dish.dish_id, orders.state != OrderState.CANCELED)
+            .scalar_subquery())
+
+
+def rebuild_sales() -> int:
+    """
+    由订单项重算全部菜品销量（非取消订单的数量合计，含已归档订单）。返回更新行数。
+
+    重算结果会覆盖 dish.sales，其他进程内存中尚未写回的增量随后写回将重复计数，
+    因此要求各工作进程的分发线程已停止并完成写回：最近 SALES_REBUILD_QUIET_SECONDS 秒内
+    有事件被投递时拒绝执行。尚未投递的事件在同一事务中加锁（MySQL 可重复读下同时阻塞新事件写入），
+    其增量从重算结果中预先扣除，恢复分发后再由订阅者累加回来。
+
+    Raises:
+        BusinessError: 分发线程仍在运行（最近有事件被投递）。
+    """
+    cutoff = (datetime.now(timezone.utc)
+              - timedelta(seconds=Config.SALES_REBUILD_QUIET_SECONDS)).replace(tzinfo=None)
+    last_dispatched = db.session.scalar(select(func.max(OrderEvent.dispatched_at)))
+    if last_dispatched is not None and last_dispatched.replace(tzinfo=None) >= cutoff:
+        db.session.rollback()
+        raise BusinessError(
+            f"最近 {Config.SALES_REBUILD_QUIET_SECONDS} 秒内仍有订单事件被投递，"
+            f"请先停止所有工作进程的分发线程并等待销量写回后再重建。",
+            error_code=ErrorCode.OPERATION_FAILED.value)
+    flush()
+
+    undispatched: Dict[int, int] = defaultdict(int)
+    for event_row in db.session.scalars(
+            select(OrderEvent)
+            .where(OrderEvent.dispatched_at.is_(None))
+            .order_by(OrderEvent.event_id)
+            .with_for_update()):
+        for dish_id, delta in _event_deltas(event_row.to_dict()).items():
+            undispatched[dish_id] += delta
+
+    sold = _sold_subquery(Order, OrderItem) + _sold_subquery(OrderArchive, OrderItemArchive)
+    if undispatched:
+        sold = sold - case(dict(undispatched), value=Dish.dish_id, else_=0)
+    result = db.session.execute(
+        update(Dish).values(sales=sold, updated_at=Dish.updated_at)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    logger.info(f"已由订单项重建 {result.rowcount} 个菜品的销量（扣除 {len(undispatched)} 个菜品的待投递增量）。")
+    return result.rowcount
+
+
+class SalesCounterFlusher:
+    """后台写回线程：每 SALES_FLUSH_SECONDS 秒写回一次，进程退出前再写回一次。"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._app: Optional[Flask] = None
+        self._subscribed = False
+
+    def start(self, app: Flask):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._app = app
+        if not self._subscribed:
+            subscribe(on_order_event, [OrderEventType.CREATED, OrderEventType.UPDATED,
+                                       OrderEventType.ITEM_UPDATED, OrderEventType.CANCELED])
+            atexit.register(self.stop)
+            self._subscribed = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name="hotmeal-sales-counter", daemon=True)
+        self._thread.start()
+        logger.info("菜品销量写回线程已启动。")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._app is not None:
+            with self._app.app_context():
+                self._flush_safely()
+
+    def _flush_safely(self):
+        try:
+            flush()
+        except Exception as ex:
+            logger.error(f"写回菜品销量失败，将在下次重试: {ex}", exc_info=True)
+        finally:
+            db.session.remove()
+
+    def _run(self, app: Flask):
+        interval = app.config.get("SALES_FLUSH_SECONDS", 10)
+        while not self._stop.wait(interval):
+            with app.app_context():
+                self._flush_safely()
+
+
+# 进程内单例
+sales_counter_flusher = SalesCounterFlusher()
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        rebuild_sales()
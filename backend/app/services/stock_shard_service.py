@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/stock_shard_service.py
+@description  热门菜品库存分片：开启后菜品库存拆分到 dish_stock_shard 的 N 个子计数器中。
+
+              - 扣减：随机选择起始分片 k，按分片号升序依次尝试 k..N-1 的条件 UPDATE (stock >= 数量)；
+                都不足时不等待地锁定 0..k-1 中空闲的分片（被其他事务锁住的视为不可用），
+                再按升序锁定 k..N-1，按合计库存跨分片扣减。同一事务内分片锁总是按分片号升序等待，
+                多个菜品由调用方按 dish_id 升序扣减，避免死锁；
+              - 归还：加回到分片 0（扣减时会自动从其他分片回退，不要求分片均衡）；
+              - 展示：菜品库存为各分片合计，按 STOCK_SHARD_TOTAL_CACHE_SECONDS 缓存。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+import random
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import Config
+from app.models.dish import Dish
+from app.models.dish_stock_shard import DishStockShard
+from app.utils.cache import TTLCache
+from app.utils.db import db
+from app.utils.error_codes import ErrorCode
+from app.utils.exceptions import APIException, BusinessError, NotFoundError, ValidationError
+
+logger = logging.getLogger(__name__)
+
+MAX_SHARDS = 64
+
+# 分片菜品 ID 集合（仅作为选择扣减路径的提示，加锁后以 dish.stock_shards 为准）
+_sharded_ids_cache = TTLCache(ttl_seconds=Config.STOCK_SHARD_FLAG_CACHE_SECONDS, maxsize=1)
+# {dish_id: 各分片库存合计}
+_total_cache = TTLCache(ttl_seconds=Config.STOCK_SHARD_TOTAL_CACHE_SECONDS, maxsize=10000)
+
+
+def sharded_dish_ids() -> Set[int]:
+    """已开启库存分片的菜品 ID 集合（缓存）。"""
+    return _sharded_ids_cache.get_or_load("ids", lambda: set(db.session.scalars(
+        select(Dish.dish_id).where(Dish.stock_shards > 0))))
+
+
+def stock_totals(dish_ids: Iterable[int]) -> Dict[int, int]:
+    """分片菜品的库存合计（缓存），未缓存的菜品一次 GROUP BY 查询补齐。"""
+    totals, missing = {}, []
+    for dish_id in dish_ids:
+        cached = _total_cache.get(dish_id)
+        if cached is None:
+            missing.append(dish_id)
+        else:
+            totals[dish_id] = cached
+    if missing:
+        loaded = dict(db.session.execute(
+            select(DishStockShard.dish_id, func.sum(DishStockShard.stock))
+            .where(DishStockShard.dish_id.in_(missing))
+            .group_by(DishStockShard.dish_id)).all())
+        for dish_id in missing:
+            totals[dish_id] = int(loaded.get(dish_id) or 0)
+            _total_cache.set(dish_id, totals[dish_id])
+    return totals
+
+
+def _try_decrement(dish_id: int, shard_no: int, quantity: int) -> bool:
+    result = db.session.execute(
+        update(DishStockShard)
+        .where(DishStockShard.dish_id == dish_id,
+               DishStockShard.shard_no == shard_no,
+               DishStockShard.stock >= quantity)
+        .values(stock=DishStockShard.stock - quantity)
+        .execution_options(synchronize_session=False))
+    return result.rowcount == 1
+
+
+def _take(dish_id: int, rows: List, quantity: int):
+    """在已锁定的分片行 [(shard_no, stock)] 上按分片号顺序扣减 quantity。"""
+    remaining = quantity
+    for shard_no, stock in rows:
+        take = min(stock, remaining)
+        if take > 0:
+            _try_decrement(dish_id, shard_no, take)
+            remaining -= take
+        if remaining == 0:
+            break
+    _total_cache.invalidate(dish_id)
+
+
+def reserve(dish_id: int, quantity: int, shards: int) -> bool:
+    """
+    从分片中扣减库存（不 commit）。可用库存合计不足时返回 False，不做任何扣减。
+    """
+    start = random.randrange(shards)
+    for shard_no in range(start, shards):
+        if _try_decrement(dish_id, shard_no, quantity):
+            _total_cache.invalidate(dish_id)
+            return True
+
+    # 单个分片都不够：已持有 start 及之后分片的锁，低号分片只取空闲的，不等待
+    lower = db.session.execute(
+        select(DishStockShard.shard_no, DishStockShard.stock)
+        .where(DishStockShard.dish_id == dish_id, DishStockShard.shard_no < start)
+        .order_by(DishStockShard.shard_no)
+        .with_for_update(skip_locked=True)).all()
+    upper = db.session.execute(
+        select(DishStockShard.shard_no, DishStockShard.stock)
+        .where(DishStockShard.dish_id == dish_id, DishStockShard.shard_no >= start)
+        .order_by(DishStockShard.shard_no)
+        .with_for_update()).all()
+    rows = list(lower) + list(upper)
+    if sum(stock for _, stock in rows) < quantity:
+        return False
+    _take(dish_id, rows, quantity)
+    return True
+
+
+def lock_totals(dish_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    按 (dish_id, 分片号) 升序锁定这些菜品的全部分片并返回库存合计（不 commit）。
+    用于一次事务内多次扣减同一批菜品（批量下单）：先在内存中分配，再用 deduct_locked 写回。
+    """
+    dish_ids = sorted(set(dish_ids))
+    if not dish_ids:
+        return {}
+    totals = {dish_id: 0 for dish_id in dish_ids}
+    for dish_id, stock in db.session.execute(
+            select(DishStockShard.dish_id, DishStockShard.stock)
+            .where(DishStockShard.dish_id.in_(dish_ids))
+            .order_by(DishStockShard.dish_id, DishStockShard.shard_no)
+            .with_for_update()).all():
+        totals[dish_id] += stock
+    return totals
+
+
+def deduct_locked(dish_id: int, quantity: int):
+    """从已由 lock_totals 锁定、且合计足够的分片中扣减 quantity（不 commit）。"""
+    if quantity <= 0:
+        return
+    rows = db.session.execute(
+        select(DishStockShard.shard_no, DishStockShard.stock)
+        .where(DishStockShard.dish_id == dish_id)
+        .order_by(DishStockShard.shard_no)).all()
+    _take(dish_id, rows, quantity)
+
+
+def release(dish_id: int, quantity: int):
+    """将库存归还到分片 0（不 commit）。"""
+    db.session.execute(
+        update(DishStockShard)
+        .where(DishStockShard.dish_id == dish_id, DishStockShard.shard_no == 0)
+        .values(stock=DishStockShard.stock + quantity)
+        .execution_options(synchronize_session=False))
+    _total_cache.invalidate(dish_id)
+
+
+def _split(total: int, shards: int) -> List[int]:
+    base, extra = divmod(total, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def _write_shards(dish_id: int, total: int, shards: int):
+    db.session.execute(delete(DishStockShard).where(DishStockShard.dish_id == dish_id))
+    db.session.execute(insert(DishStockShard), [
+        {"dish_id": dish_id, "shard_no": shard_no, "stock": stock}
+        for shard_no, stock in enumerate(_split(total, shards))])
+
+
+def _lock_dish(dish_id: int) -> Dish:
+    dish = db.session.scalars(select(Dish).where(Dish.dish_id == dish_id).with_for_update()).first()
+    if not dish:
+        raise NotFoundError(f"ID 为 {dish_id} 的菜品未找到。", error_code=ErrorCode.DISH_NOT_FOUND.value)
+    return dish
+
+
+def _locked_shard_total(dish_id: int) -> int:
+    """锁定菜品的全部分片并返回库存合计。"""
+    return sum(db.session.scalars(
+        select(DishStockShard.stock)
+        .where(DishStockShard.dish_id == dish_id)
+        .order_by(DishStockShard.shard_no)
+        .with_for_update()))
+
+
+def _invalidate(dish_id: int):
+    _sharded_ids_cache.invalidate()
+    _total_cache.invalidate(dish_id)
+
+
+def enable_sharding(dish_id: int, shards: int) -> Dict[str, int]:
+    """
+    开启（或调整）菜品的库存分片：当前库存合计平均拆分到 shards 个分片。
+
+    Raises:
+        ValidationError: 分片数不在 1 ~ MAX_SHARDS 之间。
+        NotFoundError: 菜品不存在。
+        APIException: 数据库错误。
+    """
+    if not isinstance(shards, int) or not 1 <= shards <= MAX_SHARDS:
+        raise ValidationError(f"分片数必须是 1-{MAX_SHARDS} 之间的整数。",
+                              error_code=ErrorCode.PARAM_INVALID.value)
+    try:
+        dish = _lock_dish(dish_id)
+        total = _locked_shard_total(dish_id) if dish.stock_shards else dish.stock
+        _write_shards(dish_id, total, shards)
+        dish.stock = total
+        dish.stock_shards = shards
+        db.session.commit()
+    except (NotFoundError, BusinessError):
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"为菜品 {dish_id} 开启库存分片时发生数据库错误: {e}", exc_info=True)
+        raise APIException("开启库存分片失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+    finally:
+        _invalidate(dish_id)
+    logger.info(f"菜品 {dish_id} 已开启库存分片：{shards} 个分片，库存合计 {total}。")
+    return {"dish_id": dish_id, "stock_shards": shards, "stock": total}
+
+
+def disable_sharding(dish_id: int) -> Dict[str, int]:
+    """关闭菜品的库存分片：各分片合计写回 dish.stock 并删除分片。"""
+    try:
+        dish = _lock_dish(dish_id)
+        if not dish.stock_shards:
+            raise BusinessError(f"菜品 {dish_id} 未开启库存分片。", error_code=ErrorCode.PARAM_INVALID.value)
+        total = _locked_shard_total(dish_id)
+        db.session.execute(delete(DishStockShard).where(DishStockShard.dish_id == dish_id))
+        dish.stock = total
+        dish.stock_shards = 0
+        db.session.commit()
+    except (NotFoundError, BusinessError):
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"关闭菜品 {dish_id} 的库存分片时发生数据库错误: {e}", exc_info=True)
+        raise APIException("关闭库存分片失败，数据库错误。", error_code=ErrorCode.DATABASE_ERROR.value)
+    finally:
+        _invalidate(dish_id)
+    logger.info(f"菜品 {dish_id} 已关闭库存分片，库存合计 {total}。")
+    return {"dish_id": dish_id, "stock_shards": 0, "stock": total}
+
+
+def reset_stock(dish: Dish, total: int):
+    """管理员直接设置分片菜品的库存时，按新合计重新拆分（不 commit，调用方需已持有该菜品）。"""
+    _write_shards(dish.dish_id, total, dish.stock_shards)
+    _total_cache.invalidate(dish.dish_id)
@@ -15,7 +15,7 @@ from flask_sqlalchemy.pagination import Pagination
 
 from app.models.enums import UserRole, UserStatus
 from app.models.user import User
-from app.utils.db import db
+from app.utils.db import db, read_only
 
 from app.utils.error_codes import ErrorCode
 
@@ -99,6 +99,7 @@ def get_user_by_id(user_id: int) -> Dict[str, Any]:
     return user.to_dict()
 
 
+@read_only
 def get_all_users() -> List[Dict[str, Any]]:
     """
     检索所有状态为 ACTIVE 的用户。
@@ -120,6 +121,7 @@ def get_all_users() -> List[Dict[str, Any]]:
 
 
 # --- 按角色查询活跃用户 ---
+@read_only
 def get_users_by_role(role_name: str) -> List[Dict[str, Any]]:
     """
     根据角色查询所有活跃用户。
@@ -150,6 +152,7 @@ def get_users_by_role(role_name: str) -> List[Dict[str, Any]]:
 
 
 # --- 分页获取指定角色的用户列表 ---
+@read_only
 def list_users_by_role(role_name: str, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
     """
     分页获取指定角色的用户列表。
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+@file         app/services/user_summary_service.py
+@description  用户订单汇总（user_order_summary）的增量维护与读取。
+
+              - 维护：订阅订单事件，在分发线程的事务内（与标记事件已投递同一事务）锁定用户汇总行并累加：
+                CREATED 计入订单数、消费与菜品数量，ITEM_UPDATED 按差值调整，取消（CANCELED 事件
+                或 UPDATED 到 CANCELED）扣减；
+              - 用户尚无汇总行时由其订单重算，并记录重算时可见的最大事件 ID 与其中尚未投递的事件 ID：
+                这些事件已计入汇总，投递时跳过；ID 更小但重算时尚未提交的事件不在其中，投递时照常累加；
+              - 读取：按主键一次查询；全量重算：python -m app.services.user_summary_service。
+              汇总行依赖本进程的事件分发线程维护：未订阅（未启用 USER_SUMMARY_ENABLED 或
+              ORDER_EVENT_DISPATCH_ENABLED）时读取改为每次由订单实时计算，不读写汇总行，以免返回过期数据。
+@date         2025-06-08
+@author       taichilei
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.config import Config
+from app.models.dish import Dish
+from app.models.enums import OrderEventType, OrderState
+from app.models.order import Order
+from app.models.order_event import OrderEvent
+from app.models.order_item import OrderItem
+from app.models.user_order_summary import UserOrderSummary
+from app.services.order_archive_service import order_items_source, orders_source
+from app.services.order_event_service import subscribe
+from app.utils.db import db
+from app.utils.money import format_cents, from_cents, to_cents
+
+logger = logging.getLogger(__name__)
+
+_REBUILD_CHUNK = 500
+_subscribed = False
+
+
+def _compute_summaries(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """由订单表（含已归档订单）计算一批用户的汇总（三条 GROUP BY 查询）。"""
+    orders = orders_source(include_archive=True)
+    items = order_items_source(include_archive=True)
+    not_canceled = orders.c.state != OrderState.CANCELED
+    data: Dict[int, Dict[str, Any]] = {
+        uid: {"order_count": 0, "total_spent": 0, "last_order_at": None, "dish_counts": {},
+              "baseline_event_id": 0, "baseline_pending_ids": []}
+        for uid in user_ids}
+
+    rows = db.session.execute(
+        select(orders.c.user_id,
+               func.sum(case((not_canceled, 1), else_=0)),
+               func.sum(case((not_canceled, orders.c.price), else_=0)),
+               func.max(orders.c.created_at))
+        .where(orders.c.user_id.in_(user_ids))
+        .group_by(orders.c.user_id)).all()
+    for uid, count, spent, last_order_at in rows:
+        data[uid].update(order_count=int(count or 0), total_spent=to_cents(spent or 0),
+                         last_order_at=last_order_at)
+
+    rows = db.session.execute(
+        select(orders.c.user_id, items.c.dish_id, Dish.name, func.sum(items.c.quantity))
+        .select_from(orders)
+        .join(items, items.c.order_id == orders.c.order_id)
+        .join(Dish, Dish.dish_id == items.c.dish_id)
+        .where(orders.c.user_id.in_(user_ids), not_canceled)
+        .group_by(orders.c.user_id, items.c.dish_id, Dish.name)).all()
+    for uid, dish_id, name, quantity in rows:
+        data[uid]["dish_counts"][str(dish_id)] = {"name": name, "quantity": int(quantity)}
+
+    rows = db.session.execute(
+        select(Order.user_id, func.max(OrderEvent.event_id))
+        .join(OrderEvent, OrderEvent.order_id == Order.order_id)
+        .where(Order.user_id.in_(user_ids))
+        .group_by(Order.user_id)).all()
+    for uid, event_id in rows:
+        data[uid]["baseline_event_id"] = int(event_id or 0)
+
+    # 与上面的汇总读取同一快照：已可见、尚未投递的事件已计入汇总
+    for uid, event_id in db.session.execute(
+            select(Order.user_id, OrderEvent.event_id)
+            .join(OrderEvent, OrderEvent.order_id == Order.order_id)
+            .where(Order.user_id.in_(user_ids), OrderEvent.dispatched_at.is_(None))):
+        data[uid]["baseline_pending_ids"].append(int(event_id))
+    return data
+
+
+def _write_summary(summary: UserOrderSummary, data: Dict[str, Any]):
+    summary.order_count = data["order_count"]
+    summary.total_spent = from_cents(data["total_spent"])
+    summary.last_order_at = data["last_order_at"]
+    summary.set_dish_counts(data["dish_counts"])
+    summary.baseline_event_id = data["baseline_event_id"]
+    summary.set_baseline_pending_ids(data["baseline_pending_ids"])
+
+
+def _build_summary(user_id: int) -> UserOrderSummary:
+    """由订单重算单个用户的汇总并加入会话（不 commit）。"""
+    summary = UserOrderSummary(user_id=user_id)
+    _write_summary(summary, _compute_summaries([user_id])[user_id])
+    db.session.add(summary)
+    return summary
+
+
+def _dish_names(dish_ids: Iterable[int]) -> Dict[int, str]:
+    ids = list(set(dish_ids))
+    if not ids:
+        return {}
+    return dict(db.session.execute(select(Dish.dish_id, Dish.name).where(Dish.dish_id.in_(ids))).all())
+
+
+def _adjust_dishes(summary: UserOrderSummary, deltas: Dict[int, int]):
+    counts = summary.get_dish_counts()
+    names = _dish_names(dish_id for dish_id in deltas if str(dish_id) not in counts)
+    for dish_id, delta in deltas.items():
+        entry = counts.setdefault(str(dish_id), {"name": names.get(dish_id), "quantity": 0})
+        entry["quantity"] += delta
+    summary.set_dish_counts(counts)
+
+
+def _item_deltas(items: List[Dict[str, Any]], sign: int) -> Dict[int, int]:
+    deltas: Dict[int, int] = {}
+    for item in items:
+        deltas[item["dish_id"]] = deltas.get(item["dish_id"], 0) + sign * item["quantity"]
+    return deltas
+
+
+def _apply_event(summary: UserOrderSummary, event: Dict[str, Any]):
+    payload = event["payload"]
+    event_type = event["event_type"]
+    spent = to_cents(summary.total_spent)
+    if event_type == OrderEventType.CREATED.name:
+        summary.order_count += 1
+        spent += to_cents(payload["price"])
+        created_at = datetime.fromisoformat(event["created_at"]) if event.get("created_at") else None
+        if created_at and (summary.last_order_at is None
+                           or created_at.replace(tzinfo=None) > summary.last_order_at.replace(tzinfo=None)):
+            summary.last_order_at = created_at
+        _adjust_dishes(summary, _item_deltas(payload.get("items", []), 1))
+    elif event_type == OrderEventType.ITEM_UPDATED.name:
+        if "previous_price" in payload:
+            spent += to_cents(payload["price"]) - to_cents(payload["previous_price"])
+        _adjust_dishes(summary, {payload["dish_id"]: payload.get("delta", 0)})
+    else:
+        # CANCELED 事件带有订单项；UPDATED 到 CANCELED（如已支付订单被取消）需从订单项读取
+        items = payload.get("items")
+        if items is None:
+            items = [{"dish_id": dish_id, "quantity": quantity} for dish_id, quantity in db.session.execute(
+                select(OrderItem.dish_id, OrderItem.quantity).where(OrderItem.order_id == event["order_id"]))]
+        summary.order_count -= 1
+        spent -= to_cents(payload["price"])
+        _adjust_dishes(summary, _item_deltas(items, -1))
+    summary.total_spent = from_cents(spent)
+
+
+def _is_relevant(event: Dict[str, Any]) -> bool:
+    if event["event_type"] != OrderEventType.UPDATED.name:
+        return True
+    payload = event["payload"]
+    return payload.get("state") == OrderState.CANCELED.name != payload.get("previous_state")
+
+
+def _apply_if_not_included(summary: UserOrderSummary, event: Dict[str, Any]):
+    """
+    不大于 baseline_event_id 的事件：重算时已可见的未投递事件已计入汇总，跳过并移出列表；
+    不在列表中的是重算时尚未提交的事件（重算时已投递的事件不会再次投递），照常累加。
+    """
+    pending = summary.get_baseline_pending_ids()
+    if event["event_id"] in pending:
+        pending.remove(event["event_id"])
+        summary.set_baseline_pending_ids(pending)
+    else:
+        _apply_event(summary, event)
+
+
+def on_order_event(event: Dict[str, Any]):
+    """
+    订单事件订阅者：在分发事务的保存点内更新用户汇总，失败时只回滚本订阅者的修改。
+    并发分发首次为同一用户插入汇总行时主键冲突，重试一次即走加锁更新。
+    """
+    user_id = event["payload"].get("user_id")
+    if user_id is None or not _is_relevant(event):
+        return
+    for attempt in range(2):
+        try:
+            with db.session.begin_nested():
+                summary = db.session.scalars(
+                    select(UserOrderSummary)
+                    .where(UserOrderSummary.user_id == user_id)
+                    .with_for_update()).first()
+                if summary is None:
+                    # 重算结果已包含本事件（事件与订单变更在同一事务提交）
+                    _build_summary(user_id)
+                elif event["event_id"] > summary.baseline_event_id:
+                    _apply_event(summary, event)
+                else:
+                    _apply_if_not_included(summary, event)
+            return
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+def register():
+    """订阅订单事件（幂等），需在分发线程启动前调用；未启动分发线程时不应调用。"""
+    global _subscribed
+    if not _subscribed:
+        subscribe(on_order_event, [OrderEventType.CREATED, OrderEventType.UPDATED,
+                                   OrderEventType.ITEM_UPDATED, OrderEventType.CANCELED])
+        _subscribed = True
+
+
+def _serialize_summary(user_id: int, summary: Optional[UserOrderSummary]) -> Dict[str, Any]:
+    if summary is None:
+        return {"user_id": user_id, "order_count": 0, "total_spent": "0.00", "last_order_at": None,
+                "top_dishes": []}
+    return {
+        "user_id": user_id,
+        "order_count": summary.order_count,
+        "total_spent": format_cents(to_cents(summary.total_spent)),
+        "last_order_at": summary.last_order_at.isoformat() if summary.last_order_at else None,
+        "top_dishes": summary.top_dishes(Config.USER_SUMMARY_TOP_DISHES),
+    }
+
+
+def get_summary(user_id: int) -> Dict[str, Any]:
+    """
+    用户订单汇总：按主键读取一行；尚无汇总行的老用户由其订单重算并写入，之后同样只需一次读取。
+    本进程未订阅订单事件时汇总行无人维护，改为由订单实时计算且不写入。
+    """
+    if not _subscribed:
+        summary = UserOrderSummary(user_id=user_id)  # 临时对象，不加入会话
+        _write_summary(summary, _compute_summaries([user_id])[user_id])
+        return _serialize_summary(user_id, summary)
+
+    summary = db.session.get(UserOrderSummary, user_id)
+    if summary is None:
+        try:
+            summary = _build_summary(user_id)
+            db.session.commit()
+        except IntegrityError:
+            # 分发线程同时写入了该用户的汇总行
+            db.session.rollback()
+            summary = db.session.get(UserOrderSummary, user_id)
+    return _serialize_summary(user_id, summary)
+
+
+def rebuild_summaries(user_ids: Optional[List[int]] = None) -> int:
+    """
+    由订单表（含已归档订单）重算用户汇总（默认全部下过单的用户），按 _REBUILD_CHUNK 个用户一批提交。
+    请在事件积压投递完毕后执行。返回重算的用户数。
+    """
+    if user_ids is None:
+        orders = orders_source(include_archive=True)
+        user_ids = list(db.session.scalars(
+            select(orders.c.user_id).distinct().order_by(orders.c.user_id)))
+    for start in range(0, len(user_ids), _REBUILD_CHUNK):
+        chunk = user_ids[start:start + _REBUILD_CHUNK]
+        computed = _compute_summaries(chunk)
+        existing = {s.user_id: s for s in db.session.scalars(
+            select(UserOrderSummary).where(UserOrderSummary.user_id.in_(chunk)).with_for_update())}
+        for uid in chunk:
+            summary = existing.get(uid)
+            if summary is None:
+                summary = UserOrderSummary(user_id=uid)
+                db.session.add(summary)
+            _write_summary(summary, computed[uid])
+        db.session.commit()
+    logger.info(f"已由订单表重算 {len(user_ids)} 个用户的订单汇总。")
+    return len(user_ids)
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app(start_background=False)
+    with app.app_context():
+        rebuild_summaries()
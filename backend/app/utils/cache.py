@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : cache.py
+@Date       : 2025-06-08
+@Desc       : 进程内 TTL 缓存，供推荐、统计等只读热点数据复用。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    线程安全的简易 TTL 缓存。
+
+    - 每个键带过期时间，过期后视为未命中；
+    - 可选 maxsize，超出时淘汰最早写入的键；
+    - get_or_load 在未命中时调用 loader 并写回（同一键的并发加载不做合并）。
+    """
+
+    def __init__(self, ttl_seconds: float, maxsize: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取未过期的缓存值，未命中返回 default。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """写入缓存值，ttl_seconds 为空时使用默认 TTL。"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """命中则直接返回，否则调用 loader 加载并写入缓存。"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """删除指定键；key 为 None 时清空整个缓存。"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除所有满足 predicate(key) 的键，返回删除的数量。"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
@@ -3,15 +3,90 @@
 @File       : db.py
 @Date       : 2025-03-01 和版本
 @Description: Provides the shared SQLAlchemy instance for the application.
+              db.session 按语句选择引擎：@read_only 标记的只读服务函数中的查询路由到只读副本
+              （SQLALCHEMY_BINDS 中以 replica 开头的绑定），写入、加锁读取以及本会话写入过之后的查询仍走主库。
 @Project    : HotMeal - Personalized Meal Ordering System Based on Recommendation Algorithms
 @Version    : 1.0.0，移除 db_session
 @Copyright  : Copyright © 2025. All rights reserved.
 """
 
-# 只需导入 SQLAlchemy
+import functools
+from contextvars import ContextVar
+
+import sqlalchemy as sa
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = "replica"
+
+# 当前调用栈是否位于 @read_only 标记的函数内（按线程 / 协程隔离）
+_read_only: ContextVar[bool] = ContextVar("hotmeal_read_only", default=False)
+
+# session.info 键：本会话已写入主库（之后的查询读主库，保证读到自己的写入）；本会话选定的副本绑定
+_PINNED_KEY = "db_primary_pinned"
+_REPLICA_KEY = "db_replica_key"
+
+
+def read_only(func):
+    """
+    标记只读服务函数：函数内的查询可以读只读副本（可容忍 DB_REPLICA_MAX_LAG_SECONDS 秒以内的延迟）。
+    未配置副本、副本延迟超限或不可用时透明地回退到主库。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+
+    return wrapper
+
+
+def _is_replica_readable(clause) -> bool:
+    """写语句与 SELECT ... FOR UPDATE 不能走副本；flush 等无语句的场景也走主库。"""
+    if clause is None or isinstance(clause, sa.sql.dml.UpdateBase):
+        return False
+    return getattr(clause, "_for_update_arg", None) is None
 
-# 创建 SQLAlchemy 实例，供应用初始化和模型定义使用
-db = SQLAlchemy()
 
-# 不再需要 logger 或其他辅助函数
\ No newline at end of file
+class RoutingSession(Session):
+    """在 Flask-SQLAlchemy 的按 bind_key 选择引擎之上增加只读副本路由。"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if isinstance(clause, sa.sql.dml.UpdateBase):
+                self.info[_PINNED_KEY] = True
+            elif _read_only.get() and not self.info.get(_PINNED_KEY) and _is_replica_readable(clause):
+                engine = self._replica_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        # 同一会话内固定使用一个副本，避免多个副本的延迟不同导致读到的数据前后不一致
+        engines = self._db.engines
+        key = self.info.get(_REPLICA_KEY)
+        if key is None:
+            from app.utils import replica
+            key = replica.choose_replica(engines)
+            if key is None:
+                return None
+            self.info[_REPLICA_KEY] = key
+        return engines[key]
+
+
+@sa.event.listens_for(RoutingSession, "after_flush")
+def _pin_primary_after_flush(session, flush_context):
+    session.info[_PINNED_KEY] = True
+
+
+@sa.event.listens_for(RoutingSession, "after_transaction_end")
+def _release_replica(session, transaction):
+    # 事务结束后重新选择副本，使延迟检查对长生命周期的会话（后台线程）同样生效
+    if transaction.parent is None:
+        session.info.pop(_REPLICA_KEY, None)
+
+
+# 创建 SQLAlchemy 实例，供应用初始化和模型定义使用
+db = SQLAlchemy(session_options={"class_": RoutingSession})
@@ -10,7 +10,7 @@
 import functools
 import logging
 import time
-from typing import Callable, Any, List, TypeVar, cast  # 导入 TypeVar, cast 用于泛型
+from typing import Callable, Any, List, Optional, TypeVar, cast  # 导入 TypeVar, cast 用于泛型
 
 from flask import request
 from flask_jwt_extended import get_jwt, jwt_required  # 移除 get_jwt_identity 如果确实不用
@@ -111,7 +111,7 @@ def timing(f: F) -> F:
     return cast(F, wrapper)
 
 
-def require_roles(allowed_roles: List[str]) -> Callable[[F], F]:
+def require_roles(allowed_roles: List[str], locations: Optional[List[str]] = None) -> Callable[[F], F]:
     """
     Decorator factory to ensure the current user has one of the specified roles.
 
@@ -121,6 +121,8 @@ def require_roles(allowed_roles: List[str]) -> Callable[[F], F]:
     Args:
         allowed_roles: A list of role name strings (case-insensitive) that are permitted.
                        Example: ["admin", "staff"]
+        locations: Where to look for the JWT (passed to `jwt_required`). Defaults to
+                   JWT_TOKEN_LOCATION; must match the route's own `jwt_required` locations.
 
     Returns:
         A decorator function.
@@ -135,7 +137,7 @@ def require_roles(allowed_roles: List[str]) -> Callable[[F], F]:
     def decorator(f: F) -> F:
         """The actual decorator."""
 
-        @jwt_required()
+        @jwt_required(locations=locations)
         @functools.wraps(f)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
             """Wrapper that performs the role check."""
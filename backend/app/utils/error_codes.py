@@ -39,6 +39,8 @@ class ErrorCode(IntEnum):
     ORDER_ITEM_NOT_FOUND = 30007  # 订单项未找到
     ORDER_ITEM_UPDATE_FAILED = 30008  # 订单项更新失败
     ORDER_CANCEL_FAILED = 30010  # 订单取消失败
+    ORDER_IDEMPOTENCY_CONFLICT = 30011  # 幂等键已被用于不同的下单请求
+    ORDER_STATE_CONFLICT = 30012  # 订单状态已被并发修改
 
     # --- 4xxxx: 菜品 / 分类 ---
     DISH_NOT_FOUND = 40001  # 菜品未找到
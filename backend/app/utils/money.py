@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : money.py
+@Date       : 2025-06-08
+@Desc       : 金额工具：Decimal 转换，以及聚合结果（数据库 SUM 等）与整数“分”之间的互转与格式化。
+              订单与订单项的金额直接以 Decimal 计算：Numeric(10, 2) 列读出即为 Decimal，
+              逐项换算成分反而更慢，只在需要整数运算的聚合结果上使用分。
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any
+
+_ONE = Decimal(1)
+
+
+def to_decimal(value: Any) -> Decimal:
+    """
+    将金额转换为 Decimal：Decimal 原样返回，整数直接构造，其余经 str() 转换以避免浮点误差。
+
+    Raises:
+        TypeError / InvalidOperation: 值无法转换为数字。
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return Decimal(value)
+    if value is None or isinstance(value, bool):
+        raise TypeError(f"无效的金额: {value!r}")
+    return Decimal(str(value))
+
+
+def to_cents(value: Any) -> int:
+    """将金额（Decimal / int / float / str，单位元）转换为整数分，第三位小数四舍五入。"""
+    try:
+        return int(to_decimal(value).scaleb(2).quantize(_ONE, rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f"无效的金额: {value!r}")
+
+
+def from_cents(cents: int) -> Decimal:
+    """整数分转换为两位小数的 Decimal，用于写回 Numeric(10, 2) 列。"""
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def format_cents(cents: int) -> str:
+    """整数分格式化为两位小数的字符串，如 1230 -> "12.30"、-5 -> "-0.05"。"""
+    sign = "-" if cents < 0 else ""
+    yuan, fen = divmod(abs(int(cents)), 100)
+    return f"{sign}{yuan}.{fen:02d}"
+
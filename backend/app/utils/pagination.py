@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : pagination.py
+@Date       : 2025-06-08
+@Desc       : 游标（keyset）分页工具：将排序键编码为不透明的游标字符串。
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from app.utils.error_codes import ErrorCode
+from app.utils.exceptions import ValidationError
+
+
+def encode_cursor(values: Dict[str, Any]) -> str:
+    """将排序键值编码为 URL 安全的 base64 游标。"""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """解码游标，格式无效时抛出 ValidationError。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValidationError("无效的分页游标。", error_code=ErrorCode.PARAM_INVALID.value)
+    if not isinstance(values, dict):
+        raise ValidationError("无效的分页游标。", error_code=ErrorCode.PARAM_INVALID.value)
+    return values
+
+
+def encode_time_id_cursor(created_at: datetime, row_id: int) -> str:
+    """按 (created_at, id) 排序时使用的游标。"""
+    return encode_cursor({"t": created_at.isoformat(), "id": row_id})
+
+
+def decode_time_id_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """解析 (created_at, id) 游标，空游标表示第一页。"""
+    if not cursor:
+        return None
+    values = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(values["t"]), int(values["id"])
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("无效的分页游标。", error_code=ErrorCode.PARAM_INVALID.value)
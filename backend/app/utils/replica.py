@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : replica.py
+@Date       : 2025-06-08
+@Desc       : 只读副本的延迟检查与心跳。
+              - 心跳线程每 DB_REPLICA_HEARTBEAT_SECONDS 秒向主库 replica_heartbeat 写入当前时间；
+              - 路由前读取副本上的心跳，当前时间减去心跳时间即延迟上界（含一个心跳间隔），
+                超过 DB_REPLICA_MAX_LAG_SECONDS、读取失败或尚无心跳的副本不参与路由；
+              - 检查结果按 DB_REPLICA_LAG_CHECK_SECONDS 缓存，路由本身不额外查询。
+"""
+
+import logging
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional
+
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from app.config import Config
+from app.models.replica_heartbeat import ReplicaHeartbeat
+from app.utils.cache import TTLCache
+from app.utils.db import REPLICA_BIND_PREFIX, db
+
+logger = logging.getLogger(__name__)
+
+_HEARTBEAT_ID = 1
+# {bind_key: 延迟秒数，不可用为 None}
+_lag_cache = TTLCache(ttl_seconds=Config.DB_REPLICA_LAG_CHECK_SECONDS, maxsize=64)
+_stats_lock = threading.Lock()
+_fallbacks = 0
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def replica_keys(engines: Mapping[Optional[str], Engine]) -> List[str]:
+    return sorted(k for k in engines if k and k.startswith(REPLICA_BIND_PREFIX))
+
+
+def _measure_lag(key: str, engine: Engine) -> Optional[float]:
+    try:
+        with engine.connect() as conn:
+            beat_at = conn.execute(
+                select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == _HEARTBEAT_ID)).scalar()
+    except Exception as ex:
+        logger.warning(f"读取只读副本 {key} 的心跳失败，暂不路由到该副本: {ex}")
+        return None
+    if beat_at is None:
+        return None
+    if beat_at.tzinfo is not None:
+        beat_at = beat_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(0.0, (_utcnow() - beat_at).total_seconds())
+
+
+def replica_lag(key: str, engine: Engine) -> Optional[float]:
+    """副本延迟秒数（缓存），不可用返回 None。"""
+    cached = _lag_cache.get(key, default=False)
+    if cached is not False:
+        return cached
+    lag = _measure_lag(key, engine)
+    _lag_cache.set(key, lag)
+    return lag
+
+
+def choose_replica(engines: Mapping[Optional[str], Engine]) -> Optional[str]:
+    """随机选择一个延迟在 DB_REPLICA_MAX_LAG_SECONDS 以内的副本，没有可用副本时返回 None（读主库）。"""
+    global _fallbacks
+    keys = replica_keys(engines)
+    if not keys:
+        return None
+    lags = {k: replica_lag(k, engines[k]) for k in keys}
+    fresh = [k for k, lag in lags.items() if lag is not None and lag <= Config.DB_REPLICA_MAX_LAG_SECONDS]
+    if not fresh:
+        with _stats_lock:
+            _fallbacks += 1
+        return None
+    return random.choice(fresh)
+
+
+def stats(engines: Mapping[Optional[str], Engine]) -> Dict[str, Any]:
+    """各副本的延迟与回退主库的次数，用于健康检查。"""
+    with _stats_lock:
+        fallbacks = _fallbacks
+    return {
+        "max_lag_seconds": Config.DB_REPLICA_MAX_LAG_SECONDS,
+        "replicas": {k: replica_lag(k, engines[k]) for k in replica_keys(engines)},
+        "primary_fallbacks": fallbacks,
+    }
+
+
+def write_heartbeat():
+    """在主库写入心跳并提交。需在应用上下文中调用。"""
+    heartbeat = db.session.get(ReplicaHeartbeat, _HEARTBEAT_ID)
+    if heartbeat is None:
+        db.session.add(ReplicaHeartbeat(id=_HEARTBEAT_ID, beat_at=_utcnow()))
+    else:
+        heartbeat.beat_at = _utcnow()
+    db.session.commit()
+
+
+class ReplicaHeartbeatWriter:
+    """后台心跳线程，仅在配置了只读副本时启动。"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, app: Flask):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name="hotmeal-replica-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info("只读副本心跳线程已启动。")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, app: Flask):
+        interval = app.config.get("DB_REPLICA_HEARTBEAT_SECONDS", 1)
+        while True:
+            with app.app_context():
+                try:
+                    write_heartbeat()
+                except Exception as ex:
+                    db.session.rollback()
+                    logger.error(f"写入只读副本心跳失败: {ex}", exc_info=True)
+                finally:
+                    db.session.remove()
+            if self._stop.wait(interval):
+                break
+
+
+# 进程内单例
+replica_heartbeat_writer = ReplicaHeartbeatWriter()
@@ -13,8 +13,8 @@ from app.utils.db import db
 from sqlalchemy.schema import CreateTable
 from sqlalchemy.dialects.mysql import dialect as mysql_dialect
 
-# 创建 Flask 应用（不连接数据库）
-app = create_app()
+# 创建 Flask 应用（不连接数据库，不启动后台线程）
+app = create_app(start_background=False)
 
 
 # 只用 metadata，不需要实际连接 MySQL
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : warmup.py
+@Date       : 2025-06-08
+@Desc       : 应用启动预热：预建数据库连接、配置 ORM 映射、预编译热点 SQL，
+              并预加载推荐模块的相似度矩阵、流行度统计等缓存。
+              预热在后台线程中执行，完成后置位就绪标志，供 /health/ready 探针使用。
+"""
+
+import logging
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import select, text
+from sqlalchemy.orm import configure_mappers
+
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+
+
+def is_ready() -> bool:
+    """预热是否已完成（未启用预热时在应用创建后即视为就绪）。"""
+    return _ready.is_set()
+
+
+def mark_ready():
+    _ready.set()
+
+
+def _warm_db_pool(connections: int):
+    """同时检出 N 个连接并执行 SELECT 1，使连接池在首个请求前完成建连。"""
+    engine = db.engine
+    if connections <= 0:
+        size = getattr(engine.pool, "size", None)
+        connections = size() if callable(size) else 1
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+    logger.info(f"[预热] 数据库连接池已预建 {len(opened)} 个连接。")
+
+
+def _precompile_statements():
+    """
+    配置全部 ORM 映射，并执行一遍推荐 / 下单链路上的热点查询（不命中数据的谓词），
+    让语句进入引擎的编译缓存。
+    """
+    from app.models.dish import Dish
+    from app.models.order import Order
+    from app.models.order_item import OrderItem
+    from app.models.user import User
+
+    configure_mappers()
+    statements = (
+        select(Dish).where(Dish.dish_id.in_([-1]), Dish.is_available.is_(True),
+                           Dish.deleted_at.is_(None)),
+        select(Order).where(Order.user_id == -1).order_by(Order.created_at.desc()).limit(1),
+        select(OrderItem.order_id, OrderItem.dish_id).where(OrderItem.order_id == -1),
+        select(User).where(User.user_id == -1),
+    )
+    for stmt in statements:
+        db.session.execute(stmt).all()
+    db.session.rollback()
+    logger.info(f"[预热] ORM 映射已配置，{len(statements)} 条热点语句已编译。")
+
+
+def _preload_recommenders():
+    """预加载推荐模块的进程内缓存。"""
+    from app.config import Config
+    from app.recommend.association_rules import BasketRuleRecommender
+    from app.recommend.category_tree import category_tree_index
+    from app.recommend.feature_store import get_feature_store
+    from app.recommend.item_cf import ItemCFRecommender
+    from app.recommend.learned_ranker import get_learned_ranker
+    from app.recommend.popular import PopularRecommender
+
+    ItemCFRecommender().get_dish_similarity()
+    PopularRecommender.load_popularity_counts()
+    BasketRuleRecommender().refresh_rule_index()
+    category_tree_index.get_subtree_ids(-1)
+    get_feature_store()
+    if Config.RECOMMEND_RANKER_ENABLED:
+        get_learned_ranker()
+    logger.info("[预热] 相似度矩阵、流行度统计、关联规则等推荐缓存已加载。")
+
+
+def run_warmup(app: Flask):
+    """依次执行各预热步骤；单个步骤失败只记录日志，最终都会置位就绪标志。"""
+    start = time.perf_counter()
+    with app.app_context():
+        steps = (
+            ("连接池", lambda: _warm_db_pool(app.config.get("WARMUP_DB_CONNECTIONS", 0))),
+            ("SQL 预编译", _precompile_statements),
+            ("推荐缓存", _preload_recommenders),
+        )
+        for name, step in steps:
+            try:
+                step()
+            except Exception as ex:
+                logger.error(f"[预热] {name} 步骤失败: {ex}", exc_info=True)
+                db.session.rollback()
+        db.session.remove()
+    mark_ready()
+    logger.info(f"[预热] 完成，耗时 {time.perf_counter() - start:.2f}s，服务已就绪。")
+
+
+def start_warmup(app: Flask) -> threading.Thread:
+    """在后台守护线程中执行预热，不阻塞应用启动。"""
+    _ready.clear()
+    thread = threading.Thread(target=run_warmup, args=(app,), name="hotmeal-warmup", daemon=True)
+    thread.start()
+    logger.info("[预热] 后台预热线程已启动。")
+    return thread